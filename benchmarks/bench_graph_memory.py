@@ -0,0 +1,121 @@
+"""
+Compares the memory used by the interned, array-backed Graph against the previous
+__dict__-based node/edge sets when building a provenance graph from synthetic trace rows.
+
+    python benchmarks/bench_graph_memory.py --rows 1000000
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from scimon.models import Graph, Process, File, Edge
+
+
+class LegacyProcess:
+    def __init__(self, git_hash, pid):
+        self.git_hash = git_hash
+        self.pid = pid
+
+    def __eq__(self, other):
+        return isinstance(other, LegacyProcess) and self.git_hash == other.git_hash and self.pid == other.pid
+
+    def __hash__(self):
+        return hash((self.git_hash, self.pid))
+
+
+class LegacyFile:
+    def __init__(self, git_hash, filename):
+        self.git_hash = git_hash
+        self.filename = filename
+
+    def __eq__(self, other):
+        return isinstance(other, LegacyFile) and self.git_hash == other.git_hash and self.filename == other.filename
+
+    def __hash__(self):
+        return hash((self.git_hash, self.filename))
+
+
+class LegacyEdge:
+    def __init__(self, in_node, out_node, syscall):
+        self.in_node = in_node
+        self.out_node = out_node
+        self.syscall = syscall
+
+    def __eq__(self, other):
+        return self.in_node == other.in_node and self.out_node == other.out_node and self.syscall == other.syscall
+
+    def __hash__(self):
+        return hash((self.in_node, self.out_node, self.syscall))
+
+
+class LegacyGraph:
+    def __init__(self):
+        self.nodes = set()
+        self.edges = set()
+
+    def add_edge(self, edge):
+        self.nodes.add(edge.in_node)
+        self.nodes.add(edge.out_node)
+        self.edges.add(edge)
+
+    def get_adj_list(self):
+        res = {}
+        for e in self.edges:
+            res.setdefault(e.in_node, []).append(e.out_node)
+        return res
+
+
+def synthetic_rows(rows, processes, files, seed=0):
+    rng = random.Random(seed)
+    syscalls = ["openat", "stat", "execve", "readlink"]
+    for _ in range(rows):
+        # build a fresh string per row, like rows fetched from sqlite
+        yield rng.randrange(processes), "".join(["data/file_", str(rng.randrange(files)), ".csv"]), rng.choice(syscalls)
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    graph = build()
+    graph.get_adj_list()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(elapsed, 3), "retained_bytes": current, "peak_bytes": peak, "nodes": len(graph.nodes), "edges": len(graph.edges)}
+
+
+def build_legacy(rows, processes, files):
+    graph = LegacyGraph()
+    for pid, filename, syscall in synthetic_rows(rows, processes, files):
+        graph.add_edge(LegacyEdge(LegacyProcess("abc123", pid), LegacyFile("abc123", filename), syscall))
+    return graph
+
+
+def build_compact(rows, processes, files):
+    graph = Graph()
+    for pid, filename, syscall in synthetic_rows(rows, processes, files):
+        graph.add_edge(Edge(Process("abc123", pid), File("abc123", filename), syscall))
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--processes", type=int, default=2_000)
+    parser.add_argument("--files", type=int, default=20_000)
+    args = parser.parse_args()
+
+    legacy = measure(lambda: build_legacy(args.rows, args.processes, args.files))
+    compact = measure(lambda: build_compact(args.rows, args.processes, args.files))
+    print(json.dumps({
+        "benchmark": "graph_memory",
+        "rows": args.rows,
+        "legacy": legacy,
+        "compact": compact,
+        "peak_reduction": round(1 - compact["peak_bytes"] / legacy["peak_bytes"], 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Measures the latency the bash hook's directory checks add to every prompt (the pre-command and
+post-command checks together) with many clean monitored repositories, against a latency target.
+The legacy scenario runs `git status` in every monitored directory one after another, like the
+hook did before checks were scoped.
+
+    python benchmarks/bench_hook_latency.py --dirs 15 --prompts 20 --target-ms 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+from scimon import __file__ as scimon_init
+
+HOOK = os.path.join(os.path.dirname(scimon_init), "commandhook.sh")
+
+PROMPT = """
+start=$EPOCHREALTIME
+for ((i = 0; i < {prompts}; i++)); do
+  {body}
+done
+end=$EPOCHREALTIME
+echo $(( (${{end/./}} - ${{start/./}}) / {prompts} ))
+"""
+
+SCENARIOS = {
+    # cwd outside every monitored directory, e.g. `ls` in HOME
+    "outside": ("$HOME", '_scimon_git_check "ls" 1 >/dev/null; _scimon_git_check "ls" 0 >/dev/null'),
+    # cwd inside one monitored directory
+    "inside_one": ("$HOME/repo_0", '_scimon_git_check "ls" 1 >/dev/null; _scimon_git_check "ls" 0 >/dev/null'),
+    # a command whose trace touches three monitored directories
+    "trace_three": ("$HOME", 'SCIMON_TRACE_LOG="$HOME/trace.log"; _scimon_git_check "make" 1 >/dev/null; '
+                             '_scimon_git_check "make" 0 >/dev/null'),
+    "legacy_all_dirs": ("$HOME", 'for d in "${!SCIMON_DIRS[@]}"; do (cd "$d" && git status --porcelain --untracked-files=all >/dev/null); '
+                                 '(cd "$d" && git status --porcelain --untracked-files=all >/dev/null); done'),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dirs", type=int, default=15, help="monitored repositories")
+    parser.add_argument("--files", type=int, default=200, help="files in each repository")
+    parser.add_argument("--prompts", type=int, default=20, help="prompts measured per scenario")
+    parser.add_argument("--target-ms", type=float, default=50, help="per-prompt latency target")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="scimon-hook-") as home:
+        env = {**os.environ, "HOME": home}
+        os.makedirs(os.path.join(home, ".scimon"))
+        for d in range(args.dirs):
+            repo = os.path.join(home, f"repo_{d}")
+            os.makedirs(repo)
+            for f in range(args.files):
+                with open(os.path.join(repo, f"file_{f}.txt"), "w") as out:
+                    out.write(str(f))
+            subprocess.run(["git", "init", "-q"], cwd=repo, check=True)
+            subprocess.run(["git", "-c", "user.name=scimon", "-c", "user.email=scimon@example.com",
+                            "add", "-A"], cwd=repo, check=True)
+            subprocess.run(["git", "-c", "user.name=scimon", "-c", "user.email=scimon@example.com",
+                            "commit", "-q", "-m", "init"], cwd=repo, check=True)
+        with open(os.path.join(home, ".scimon", ".dirs"), "w") as f:
+            f.writelines(f"repo_{d}\n" for d in range(args.dirs))
+        with open(os.path.join(home, "trace.log"), "w") as f:
+            for d in range(min(3, args.dirs)):
+                f.write(f'1 openat(AT_FDCWD, "{home}/repo_{d}/file_0.txt", O_RDONLY) = 3\n')
+
+        results = {}
+        for name, (cwd, body) in SCENARIOS.items():
+            script = f'source "{HOOK}"\ncd "{cwd}"\n_scimon_load_dirs\n' + PROMPT.format(prompts=args.prompts, body=body)
+            output = subprocess.run(["bash", "-c", script], env=env, capture_output=True, text=True, check=True).stdout
+            ms = int(output.strip().splitlines()[-1]) / 1000
+            results[name] = {"ms_per_prompt": round(ms, 2), "within_target": ms <= args.target_ms}
+
+    print(json.dumps({
+        "benchmark": "hook_latency",
+        "dirs": args.dirs,
+        "files": args.files,
+        "prompts": args.prompts,
+        "target_ms": args.target_ms,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
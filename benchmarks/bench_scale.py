@@ -0,0 +1,150 @@
+"""
+Measures ingestion, graph generation, rendering and a full reproduce chain on synthetic
+repositories and strace logs, reporting wall time, subprocess count and peak RSS per phase.
+
+Every phase runs in a fresh interpreter so its peak RSS and subprocess count are its own.
+Results are printed (or written with --output) as JSON so runs of different releases can be diffed.
+
+    python benchmarks/bench_scale.py --lines 10000 100000 1000000 --commits 50 --files 1000
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from synthetic import make_repo, stage_file, synthetic_strace
+
+PHASES = ("ingest", "generate_graph", "render", "reproduce")
+
+
+def rss_kb() -> int:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss // 1024 if sys.platform == "darwin" else maxrss
+
+
+def run_phase(phase, repo, log, target, git_hash, render_max_edges):
+    from scimon.ingest import ingest_strace
+    from scimon.scimon import generate_graph, reproduce, MAKE_FILE_NAME
+
+    os.chdir(repo)
+    spawned = []
+    popen_init = subprocess.Popen.__init__
+
+    def counting_init(self, args, *rest, **kwargs):
+        spawned.append(args[0] if isinstance(args, (list, tuple)) else args)
+        popen_init(self, args, *rest, **kwargs)
+
+    subprocess.Popen.__init__ = counting_init
+    baseline_rss = rss_kb()
+    extra = {}
+    start = time.perf_counter()
+    # scimon prints progress for every node and edge, keep it out of the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        if phase == "ingest":
+            ingest_strace(log, git_hash)
+        elif phase == "generate_graph":
+            graph = generate_graph(target, git_hash)
+            graph.get_adj_list()
+            extra = {"nodes": len(graph.nodes), "edges": len(graph.edges)}
+        elif phase == "render":
+            graph = generate_graph(target, git_hash)
+            extra = {"nodes": len(graph.nodes), "edges": len(graph.edges)}
+            if len(graph.edges) > render_max_edges or shutil.which("dot") is None:
+                return {"skipped": True, **extra}
+            start = time.perf_counter()
+            graph.render(os.path.join(repo, "prov"))
+        elif phase == "reproduce":
+            reproduce(target, git_hash)
+            with open(MAKE_FILE_NAME) as f:
+                extra = {"rules": sum(1 for line in f if line.strip() and not line.startswith("\t"))}
+    elapsed = time.perf_counter() - start
+    subprocess.Popen.__init__ = popen_init
+    return {
+        "seconds": round(elapsed, 4),
+        "subprocesses": len(spawned),
+        "git_subprocesses": sum(1 for cmd in spawned if os.path.basename(str(cmd)) == "git"),
+        "baseline_rss_kb": baseline_rss,
+        "peak_rss_kb": rss_kb(),
+        **extra,
+    }
+
+
+def run_isolated(*args):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_phase, args)
+
+
+def environment():
+    from scimon import __version__
+    git_version = subprocess.run(["git", "--version"], capture_output=True, text=True).stdout.strip()
+    return {
+        "scimon": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "git": git_version,
+        "cpus": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[10_000, 100_000], help="strace log sizes, up to 10M")
+    parser.add_argument("--commits", type=int, default=20, help="pipeline commits in each synthetic repository")
+    parser.add_argument("--files", type=int, default=200, help="data files in each synthetic repository")
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=list(PHASES))
+    parser.add_argument("--render-max-edges", type=int, default=5_000, help="skip rendering larger graphs")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic repositories and logs")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="scimon-bench-")
+    results = []
+    try:
+        for lines in args.lines:
+            root = os.path.join(workdir, str(lines))
+            repo = os.path.join(root, "repo")
+            os.makedirs(repo)
+            start = time.perf_counter()
+            hashes = make_repo(repo, args.commits, args.files)
+            setup_seconds = time.perf_counter() - start
+
+            target = stage_file(args.commits)
+            log = os.path.join(root, "strace.log")
+            with open(log, "w") as f:
+                f.writelines(synthetic_strace(lines, repo, args.files, target))
+
+            results.append({"phase": "setup", "lines": lines, "seconds": round(setup_seconds, 4)})
+            for phase in args.phases:
+                result = run_isolated(phase, repo, log, target, hashes[-1], args.render_max_edges)
+                results.append({"phase": phase, "lines": lines, **result})
+                print(f"{phase} ({lines} lines): {result}", file=sys.stderr)
+            if not args.keep:
+                shutil.rmtree(root)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({
+        "benchmark": "scale",
+        "environment": environment(),
+        "parameters": {"commits": args.commits, "files": args.files, "lines": args.lines},
+        "results": results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
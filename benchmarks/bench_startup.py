@@ -0,0 +1,74 @@
+"""
+Measures the cold-start time of lightweight scimon commands in fresh interpreters, and lists the modules
+that dominate the import time of the CLI as reported by `python -X importtime`. Exits with status 1 when
+the fastest run of a command misses the cold-start budget.
+
+    python benchmarks/bench_startup.py --repeat 10 --top 15 --budget 0.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+COMMANDS = [["--version"], ["list"], ["tracer"]]
+# seconds, import scimon.cli alone took ~0.2s before the planner's dependencies were imported lazily
+STARTUP_BUDGET = 0.5
+
+
+def import_times(top):
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import scimon.cli"],
+                            capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                        "self_ms": int(own) / 1000, "cumulative_ms": int(cumulative) / 1000})
+    total = next(m["cumulative_ms"] for m in modules if m["module"] == "scimon.cli")
+    # direct imports of the CLI and its dependencies, the ones a lazy import would save
+    heaviest = sorted((m for m in modules if m["depth"] <= 1), key=lambda m: m["cumulative_ms"], reverse=True)[:top]
+    return total, heaviest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="modules listed by cumulative import time")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="cold-start budget in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="scimon-startup-") as home:
+        os.makedirs(os.path.join(home, ".scimon"))
+        open(os.path.join(home, ".scimon", ".dirs"), "w").close()
+        env = {**os.environ, "HOME": home}
+        commands = {}
+        for command in COMMANDS:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, "-m", "scimon", *command], env=env, capture_output=True, check=True)
+                timings.append(time.perf_counter() - start)
+            commands[" ".join(command)] = {"median_seconds": round(statistics.median(timings), 4),
+                                           "min_seconds": round(min(timings), 4),
+                                           "within_budget": min(timings) < args.budget}
+
+    total, heaviest = import_times(args.top)
+    print(json.dumps({
+        "benchmark": "startup",
+        "repeat": args.repeat,
+        "budget_seconds": args.budget,
+        "commands": commands,
+        "cli_import_ms": total,
+        "heaviest_imports": heaviest,
+    }, indent=2))
+    if not all(c["within_budget"] for c in commands.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
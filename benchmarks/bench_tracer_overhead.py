@@ -0,0 +1,85 @@
+"""
+Measures the slowdown each tracer backend adds to a file-heavy workload (stat, open, read and
+write of many small files), along with the size of the log it produces.
+Backends that are not installed are reported as skipped.
+
+    python benchmarks/bench_tracer_overhead.py --files 2000 --repeat 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from scimon.tracer import TRACERS
+
+WORKLOAD = """
+import os, sys
+root, files = sys.argv[1], int(sys.argv[2])
+for i in range(files):
+    path = os.path.join(root, f"in_{i}.txt")
+    with open(path, "w") as f:
+        f.write("x" * 64)
+for _ in range(5):
+    for i in range(files):
+        path = os.path.join(root, f"in_{i}.txt")
+        os.stat(path)
+        os.access(path, os.R_OK)
+        with open(path) as f:
+            f.read()
+with open(os.path.join(root, "out.txt"), "w") as out:
+    out.write(str(files))
+"""
+
+
+def run(argv, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(argv, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="scimon-tracer-")
+    try:
+        workload = [sys.executable, "-c", WORKLOAD, workdir, str(args.files)]
+        baseline = run(workload, args.repeat)
+        results = {"untraced": {"seconds": round(baseline, 4)}}
+
+        for name, tracer in TRACERS.items():
+            if not tracer.available():
+                results[name] = {"skipped": True}
+                continue
+            log = os.path.join(workdir, f"{name}.log")
+            seconds = run(tracer.command(log, workload), args.repeat)
+            with open(log, "rb") as f:
+                lines = sum(1 for _ in f)
+            results[name] = {
+                "seconds": round(seconds, 4),
+                "overhead": round(seconds / baseline, 2),
+                "log_bytes": os.path.getsize(log),
+                "log_lines": lines,
+            }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps({
+        "benchmark": "tracer_overhead",
+        "files": args.files,
+        "repeat": args.repeat,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Synthetic inputs for the benchmarks: git repositories with a chain of pipeline commits and
+strace logs of arbitrary length, shaped like the output of the bash hook.
+
+Commit k of a repository runs `python3 step.py k`, which reads out/stage_{k-1}.txt and a few
+files under data/ and writes out/stage_k.txt, so reproducing the last stage walks every commit.
+"""
+import os
+import random
+import sqlite3
+import subprocess
+from typing import Iterator, List
+from scimon.db import migrate_db, DB_NAME
+from scimon.ingest import ingest_lines
+from scimon.utils import get_tracked_paths
+
+GIT = ["git", "-c", "user.name=scimon", "-c", "user.email=scimon@example.com"]
+READS_PER_STEP = 3
+
+
+def git(*args, cwd) -> str:
+    return subprocess.run([*GIT, *args], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+
+
+def data_file(index: int) -> str:
+    return f"data/file_{index}.csv"
+
+
+def stage_file(commit: int) -> str:
+    return f"out/stage_{commit}.txt"
+
+
+def step_trace(workingdir: str, pid: int, commit: int, files: int, rng: random.Random) -> List[str]:
+    """Strace lines of one `python3 step.py k` run."""
+    lines = [
+        f'{pid} execve("/usr/bin/python3", ["python3", "step.py", "{commit}"], 0x7ffc /* 20 vars */) = 0',
+        f'{pid} openat(AT_FDCWD, "/usr/lib/python3.10/os.py", O_RDONLY|O_CLOEXEC) = 3',
+        f'{pid} openat(AT_FDCWD, "step.py", O_RDONLY|O_CLOEXEC) = 3',
+    ]
+    if commit > 1:
+        lines.append(f'{pid} openat(AT_FDCWD, "{stage_file(commit - 1)}", O_RDONLY) = 4')
+    for index in rng.sample(range(files), min(READS_PER_STEP, files)):
+        lines.append(f'{pid} openat(AT_FDCWD, "{data_file(index)}", O_RDONLY) = 5')
+    lines.append(f'{pid} openat(AT_FDCWD, "{workingdir}/{stage_file(commit)}", O_WRONLY|O_CREAT|O_TRUNC, 0666) = 6')
+    lines.append(f'{pid} write(6, "{commit}", 1) = 1')
+    lines.append(f'{pid} +++ exited with 0 +++')
+    return lines
+
+
+def make_repo(root: str, commits: int, files: int, seed: int = 0) -> List[str]:
+    """
+    Creates a monitored repository at root with the data files and one pipeline commit per stage,
+    ingesting the trace and command of every stage. Returns the commit hashes, oldest first
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, "data"))
+    os.makedirs(os.path.join(root, "out"))
+    for index in range(files):
+        with open(os.path.join(root, data_file(index)), "w") as f:
+            f.write(f"{index}\n")
+    with open(os.path.join(root, "step.py"), "w") as f:
+        f.write("import sys\n")
+    with open(os.path.join(root, ".gitignore"), "w") as f:
+        f.write(f"{DB_NAME}*\nreproduce.mk\n")
+
+    git("init", "-q", "-b", "main", cwd=root)
+    git("add", "-A", cwd=root)
+    git("commit", "-q", "-m", "data", cwd=root)
+    hashes = [git("rev-parse", "HEAD", cwd=root)]
+
+    cwd = os.getcwd()
+    os.chdir(root)
+    db = sqlite3.connect(DB_NAME)
+    migrate_db(db)
+    for commit in range(1, commits + 1):
+        with open(os.path.join(root, stage_file(commit)), "w") as f:
+            f.write(f"{commit}\n")
+        git("add", "-A", cwd=root)
+        git("commit", "-q", "-m", f"python3 step.py {commit}", cwd=root)
+        hashes.append(git("rev-parse", "HEAD", cwd=root))
+
+        with db:
+            db.execute(
+                "INSERT INTO commands (pre_command_commit, post_command_commit, command) VALUES (?, ?, ?)",
+                (hashes[-2], hashes[-1], f"python3 step.py {commit}")
+            )
+        tracked = get_tracked_paths(hashes[-1])
+        ingest_lines(step_trace(root, 100 + commit, commit, files, rng), db, hashes[-1], tracked, root)
+    db.close()
+    os.chdir(cwd)
+    return hashes
+
+
+def synthetic_strace(lines: int, workingdir: str, files: int, target: str, seed: int = 0) -> Iterator[str]:
+    """
+    Yields a strace log of the given number of lines: a tree of processes that read random data files
+    and system libraries, stat paths, write to descriptors and occasionally write the target file
+    """
+    rng = random.Random(seed)
+    pids = [1000]
+    next_pid = 1001
+    emitted = 0
+    while emitted < lines:
+        pid = rng.choice(pids)
+        kind = rng.random()
+        if kind < 0.02:
+            line = f"{pid} clone(child_stack=NULL, flags=CLONE_CHILD_CLEARTID|CLONE_CHILD_SETTID|SIGCHLD) = {next_pid}"
+            pids.append(next_pid)
+            next_pid += 1
+        elif kind < 0.03:
+            line = f'{pid} execve("/usr/bin/python3", ["python3", "step.py", "{pid}"], 0x7ffc /* 20 vars */) = 0'
+        elif kind < 0.035 or emitted == 0:
+            line = f'{pid} openat(AT_FDCWD, "{workingdir}/{target}", O_WRONLY|O_CREAT|O_TRUNC, 0666) = 6'
+        elif kind < 0.40:
+            line = f'{pid} openat(AT_FDCWD, "{data_file(rng.randrange(files))}", O_RDONLY|O_CLOEXEC) = 3'
+        elif kind < 0.55:
+            line = f'{pid} openat(AT_FDCWD, "/usr/lib/python3.10/lib{rng.randrange(500)}.so", O_RDONLY|O_CLOEXEC) = 3'
+        elif kind < 0.70:
+            line = f'{pid} newfstatat(AT_FDCWD, "{data_file(rng.randrange(files))}", {{st_mode=S_IFREG|0644, st_size=2, ...}}, 0) = 0'
+        elif kind < 0.90:
+            line = f'{pid} read(3, "abc", 4096) = 3'
+        else:
+            line = f'{pid} write(6, "abc", 3) = 3'
+        yield line + "\n"
+        emitted += 1
@@ -0,0 +1,141 @@
+import gzip
+import os
+import re
+import shutil
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from scimon.db import get_db, get_schema_version, migrate_db, delete_traces, SCHEMA_VERSION
+from scimon.ingest import feed_lines, parse_targets, TraceTarget
+from scimon.provenance import refresh_provenance
+from scimon.utils import get_tracked_paths
+
+ARCHIVE_DIR = os.path.expanduser("~/.scimon/archive")
+
+# rotation keeps the archive under this size, dropping the oldest traces first
+ARCHIVE_MAX_BYTES = 1024 ** 3
+# and drops traces older than this many days
+ARCHIVE_MAX_AGE_DAYS = 90
+
+ARCHIVE_SUFFIX = ".log.gz"
+TARGETS_SUFFIX = ".targets"
+RELATIVE_TIME_RE = re.compile(r'^([0-9]+)([smhdw])$')
+SECONDS_PER_UNIT = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+class ArchivedTrace(NamedTuple):
+    '''A compressed trace kept after ingestion, with the directories and commits it was ingested into'''
+    name: str
+    path: str
+    timestamp: float
+    targets: List[TraceTarget]
+
+
+def trace_timestamp(name: str) -> float:
+    '''Returns the time a trace was recorded from its name, which starts with a nanosecond timestamp'''
+    prefix = name.split("-", 1)[0]
+    return int(prefix) / 1e9 if prefix.isdigit() else 0.0
+
+
+def read_targets(path: str) -> List[TraceTarget]:
+    with open(path, "r") as f:
+        return parse_targets(f)
+
+
+def archive_trace(name: str, log_path: str, targets_path: str, archive: str = ARCHIVE_DIR) -> str:
+    '''Compresses an ingested trace into the archive, removing the original files. Returns the archived path'''
+    os.makedirs(archive, exist_ok=True)
+    path = os.path.join(archive, name + ARCHIVE_SUFFIX)
+    partial = path + ".partial"
+    with open(log_path, "rb") as src, gzip.open(partial, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(partial, path)
+    shutil.move(targets_path, os.path.join(archive, name + TARGETS_SUFFIX))
+    os.remove(log_path)
+    return path
+
+
+def list_archive(archive: str = ARCHIVE_DIR, since: Optional[float] = None) -> List[ArchivedTrace]:
+    '''Returns the archived traces recorded at or after since, oldest first'''
+    if not os.path.isdir(archive):
+        return []
+    traces = []
+    for filename in os.listdir(archive):
+        if not filename.endswith(ARCHIVE_SUFFIX):
+            continue
+        name = filename[:-len(ARCHIVE_SUFFIX)]
+        timestamp = trace_timestamp(name)
+        if since is not None and timestamp < since:
+            continue
+        targets_path = os.path.join(archive, name + TARGETS_SUFFIX)
+        targets = read_targets(targets_path) if os.path.exists(targets_path) else []
+        traces.append(ArchivedTrace(name, os.path.join(archive, filename), timestamp, targets))
+    return sorted(traces, key=lambda trace: (trace.timestamp, trace.name))
+
+
+def read_archived_trace(trace: ArchivedTrace) -> Iterator[str]:
+    '''Streams the lines of an archived trace, decompressing as it goes'''
+    with gzip.open(trace.path, "rt", errors="replace") as f:
+        yield from f
+
+
+def rotate_archive(archive: str = ARCHIVE_DIR, max_bytes: int = ARCHIVE_MAX_BYTES,
+                   max_age_days: float = ARCHIVE_MAX_AGE_DAYS, now: Optional[float] = None) -> List[str]:
+    '''Removes archived traces older than max_age_days, then the oldest ones until the archive fits in max_bytes'''
+    now = time.time() if now is None else now
+    traces = list_archive(archive)
+    sizes = {trace.name: os.path.getsize(trace.path) for trace in traces}
+    total = sum(sizes.values())
+    removed = []
+    for trace in traces:
+        if now - trace.timestamp <= max_age_days * 86400 and total <= max_bytes:
+            break
+        for suffix in (ARCHIVE_SUFFIX, TARGETS_SUFFIX):
+            path = os.path.join(archive, trace.name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+        total -= sizes[trace.name]
+        removed.append(trace.name)
+    return removed
+
+
+def parse_since(since: str, now: Optional[float] = None) -> float:
+    '''Parses a relative age such as 12h or 7d, or an ISO date/time, into a unix timestamp'''
+    now = time.time() if now is None else now
+    match = RELATIVE_TIME_RE.match(since.strip())
+    if match:
+        return now - int(match.group(1)) * SECONDS_PER_UNIT[match.group(2)]
+    try:
+        return datetime.fromisoformat(since.strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time {since}, use an age like 12h or 7d or a date like 2025-01-31")
+
+
+def reingest_archive(since: Optional[float] = None, archive: str = ARCHIVE_DIR) -> int:
+    '''
+    Streams the archived traces of the current directory back through the parser, replacing the rows of every
+    commit with a trace recorded since the given time. Returns the number of commits reingested
+    '''
+    directory = os.path.realpath(os.getcwd())
+    traces = list_archive(archive)
+    recent = {trace.name for trace in list_archive(archive, since)}
+    # every trace of a commit is replayed, including older ones, since the commit's rows are replaced as a whole
+    by_commit: Dict[str, List[Tuple[ArchivedTrace, Optional[str]]]] = {}
+    for trace in traces:
+        for target in trace.targets:
+            if os.path.realpath(target.directory) == directory:
+                by_commit.setdefault(target.commit_hash, []).append((trace, target.cwd))
+    by_commit = {c: ts for c, ts in by_commit.items() if any(t.name in recent for t, _ in ts)}
+
+    db = get_db()
+    if get_schema_version(db) < SCHEMA_VERSION:
+        migrate_db(db)
+    for commit_hash, commit_traces in by_commit.items():
+        print(f"Reingesting {len(commit_traces)} traces of commit {commit_hash}")
+        tracked = get_tracked_paths(commit_hash)
+        with db:
+            delete_traces(commit_hash, db)
+            for trace, cwd in commit_traces:
+                feed_lines(read_archived_trace(trace), db, commit_hash, tracked, directory, cwd)
+        refresh_provenance([commit_hash], db)
+    return len(by_commit)
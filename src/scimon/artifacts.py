@@ -0,0 +1,206 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import stat
+import subprocess
+from typing import List, NamedTuple, Optional, Tuple
+from scimon.db import get_artifact_stats, insert_artifact_stats, delete_artifact_stats, DB_FILES
+from scimon.utils import run_git
+
+ARTIFACT_DIR = os.path.expanduser("~/.scimon/objects")
+
+# files at least this large are kept in the artifact store, git only sees a pointer to them
+ARTIFACT_THRESHOLD = 100 * 1024 ** 2
+
+# stats of the stored artifacts, read by the bash hook, whose git status can't see changes to skip-worktree files
+STATS_FILE = os.path.join(".git", "scimon-artifacts")
+
+POINTER_HEADER = "scimon-artifact v1"
+# pointers are a few lines, anything larger is a regular file
+POINTER_MAX_SIZE = 256
+HASH_CHUNK = 1024 * 1024
+
+
+class Artifact(NamedTuple):
+    '''A file stored in the artifact store under the blake2b digest of its content'''
+    path: str
+    digest: str
+    size: int
+
+
+def hash_file(path: str) -> str:
+    '''Returns the hex blake2b digest of the file, reading it in chunks'''
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def object_path(digest: str, store: str = ARTIFACT_DIR) -> str:
+    return os.path.join(store, digest[:2], digest[2:])
+
+
+def format_pointer(artifact: Artifact) -> str:
+    return f"{POINTER_HEADER}\nblake2b {artifact.digest}\nsize {artifact.size}\n"
+
+
+def parse_pointer(content: str) -> Optional[Tuple[str, int]]:
+    '''Returns the (digest, size) a pointer refers to, or None if the content isn't a pointer'''
+    lines = content.splitlines()
+    if len(lines) != 3 or lines[0] != POINTER_HEADER:
+        return None
+    try:
+        (algorithm, digest), (key, size) = lines[1].split(" "), lines[2].split(" ")
+    except ValueError:
+        return None
+    if algorithm != "blake2b" or key != "size" or not size.isdigit():
+        return None
+    return digest, int(size)
+
+
+def read_pointer_file(path: str) -> Optional[Tuple[str, int]]:
+    '''Returns the (digest, size) of the working tree file if it is a pointer that hasn't been materialized'''
+    try:
+        if os.path.getsize(path) > POINTER_MAX_SIZE:
+            return None
+        with open(path, "r", errors="replace") as f:
+            return parse_pointer(f.read())
+    except OSError:
+        return None
+
+
+def store_file(path: str, store: str = ARTIFACT_DIR) -> Artifact:
+    '''Copies the file into the store unless an identical one is already there, returns its artifact'''
+    size = os.path.getsize(path)
+    digest = hash_file(path)
+    target = object_path(digest, store)
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = f"{target}.{os.getpid()}.partial"
+        shutil.copyfile(path, partial)
+        os.chmod(partial, 0o444)
+        os.replace(partial, target)
+    return Artifact(path, digest, size)
+
+
+def materialize(path: str, digest: str, store: str = ARTIFACT_DIR) -> None:
+    '''Writes the stored content with the given digest to path'''
+    source = object_path(digest, store)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"Artifact {digest} of {path} is missing from {store}")
+    partial = f"{path}.{os.getpid()}.partial"
+    shutil.copyfile(source, partial)
+    os.replace(partial, path)
+
+
+def materialize_pointers(paths: List[str], store: str = ARTIFACT_DIR) -> List[str]:
+    '''Replaces the pointer files among paths with their content, returns the paths that were materialized'''
+    materialized = []
+    for path in paths:
+        pointer = read_pointer_file(path)
+        if pointer is not None:
+            materialize(path, pointer[0], store)
+            materialized.append(path)
+    return materialized
+
+
+def pointer_at_commit(file: str, git_hash: str) -> Optional[Tuple[str, int]]:
+    '''Returns the (digest, size) of the file at the given commit if git stores it as a pointer'''
+    try:
+        if int(run_git("cat-file", "-s", f"{git_hash}:{file}")) > POINTER_MAX_SIZE:
+            return None
+        return parse_pointer(run_git("cat-file", "blob", f"{git_hash}:{file}"))
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def restore_from_commit(file: str, git_hash: str, store: str = ARTIFACT_DIR) -> None:
+    '''Writes the version of the file at the given commit to the working tree, from the store if it is an artifact'''
+    pointer = pointer_at_commit(file, git_hash)
+    if pointer is None:
+        run_git("restore", f"--source={git_hash}", "--", file)
+        return
+    materialize(file, pointer[0], store)
+
+
+def restore_recipe(file: str, git_hash: str) -> str:
+    '''Returns the make recipe checking the file out at the given commit'''
+    if pointer_at_commit(file, git_hash) is not None:
+        # git restore skips artifacts, their index entries are marked skip-worktree
+        return f"scimon materialize --source={git_hash} -- {file}"
+    return f"git restore --source={git_hash} -- {file}"
+
+
+def stage_artifacts(db: sqlite3.Connection, threshold: int = ARTIFACT_THRESHOLD, store: str = ARTIFACT_DIR) -> List[Artifact]:
+    '''
+    Moves the untracked or modified files of at least threshold bytes into the store and stages pointers to them
+    in their place, so the next git add -A leaves them alone. Files already stored are only hashed again when
+    their size or mtime changed. Returns the artifacts whose pointer was staged
+    '''
+    listing = run_git("ls-files", "-z", "-t", "--cached", "--others", "--modified", "--exclude-standard", "--", ".", f":(exclude){DB_FILES}")
+    candidates, stored = set(), set()
+    for entry in listing.split("\0"):
+        tag, path = entry[:1], entry[2:]
+        if tag in ("?", "C"):
+            candidates.add(path)
+        elif tag == "S":
+            stored.add(path)
+
+    stats = get_artifact_stats(db)
+    staged, removed = [], []
+    for path in sorted(stored | candidates):
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            if path in stored:
+                removed.append(path)
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        if path in stored:
+            cached = stats.get(path)
+            if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+                continue
+            if read_pointer_file(path) is not None:
+                continue
+        elif st.st_size < threshold:
+            continue
+        staged.append((store_file(path, store), st))
+
+    if staged:
+        index_info = []
+        for artifact, st in staged:
+            blob = run_git("hash-object", "-w", "--stdin", input=format_pointer(artifact)).strip()
+            mode = "100755" if st.st_mode & stat.S_IXUSR else "100644"
+            index_info.append(f"{mode} {blob}\t{artifact.path}\0")
+        run_git("update-index", "-z", "--index-info", input="".join(index_info))
+        # skip-worktree keeps git from reading the real content back in on git add -A or git status
+        run_git("update-index", "-z", "--skip-worktree", "--stdin", input="".join(a.path + "\0" for a, _ in staged))
+        with db:
+            insert_artifact_stats(((a.path, st.st_size, st.st_mtime_ns, a.digest) for a, st in staged), db)
+    if removed:
+        run_git("update-index", "-z", "--force-remove", "--stdin", input="".join(path + "\0" for path in removed))
+        with db:
+            delete_artifact_stats(removed, db)
+    write_stats_file(db)
+    return [artifact for artifact, _ in staged]
+
+
+def write_stats_file(db: sqlite3.Connection, path: str = STATS_FILE) -> bool:
+    '''
+    Writes the size, mtime and path each artifact had when it was stored, formatted like `stat -c '%s %.9Y %n'`
+    so the hook can tell an untouched tree with a single stat. Returns False outside of a git repository
+    '''
+    if not os.path.isdir(os.path.dirname(path)):
+        return False
+    lines = [
+        f"{size} {mtime_ns // 10 ** 9}.{mtime_ns % 10 ** 9:09d} {artifact}\n"
+        for artifact, (size, mtime_ns, _) in sorted(get_artifact_stats(db).items())
+    ]
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write("".join(lines))
+    os.replace(tmp, path)
+    return True
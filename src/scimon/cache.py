@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from typing import List, Optional, Tuple
+from scimon.utils import run_git
+
+CACHE_DIR = os.path.expanduser("~/.scimon/cache")
+
+# outputs kept in the cache directory are evicted least recently used first above this size
+CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT NOT NULL PRIMARY KEY,
+    outputs TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS objects (
+    blob TEXT NOT NULL PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_objects_last_used ON objects(last_used);
+'''
+
+
+def recipe_key(recipe: str, inputs: List[Tuple[str, str]]) -> str:
+    '''Returns the cache key of a recipe run on the given (path, blob hash) inputs'''
+    digest = hashlib.blake2b(digest_size=32)
+    digest.update(recipe.encode("utf-8", "surrogateescape"))
+    for path, blob in sorted(inputs):
+        digest.update(f"\0{path}\0{blob}".encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+def hash_blobs(paths: List[str]) -> List[str]:
+    '''Returns the git blob hash of each working tree file, with a single git call'''
+    if not paths:
+        return []
+    return run_git("hash-object", "--no-filters", "--stdin-paths", input="".join(p + "\n" for p in paths)).split()
+
+
+def in_git(blob: str) -> bool:
+    return subprocess.run(["git", "cat-file", "-e", f"{blob}^{{blob}}"], capture_output=True).returncode == 0
+
+
+class BuildCache:
+    '''
+    Maps a recipe and the blob hashes of its inputs to the blob hashes of the outputs it produced. Output content is
+    read back from git when the blob is in the repository, otherwise from the cache directory
+    '''
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # shared by the runner's worker threads, every use goes through the lock
+        self.db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self.db.executescript(CACHE_SCHEMA)
+        self.lock = threading.Lock()
+
+    def object_path(self, blob: str) -> str:
+        return os.path.join(self.directory, "objects", blob[:2], blob[2:])
+
+    def key(self, recipe: str, prerequisites: List[str]) -> str:
+        return recipe_key(recipe, list(zip(prerequisites, hash_blobs(prerequisites))))
+
+    def restore(self, key: str) -> Optional[List[str]]:
+        '''Writes the outputs cached under key to the working tree, returns their paths or None on a miss'''
+        with self.lock:
+            row = self.db.execute('''SELECT outputs FROM entries WHERE key = ?''', (key,)).fetchone()
+        if row is None:
+            return None
+        outputs = json.loads(row[0])
+        sources = {}
+        for path, blob in outputs:
+            if os.path.exists(self.object_path(blob)):
+                sources[blob] = self.object_path(blob)
+            elif not in_git(blob):
+                # evicted and not in the repository, the recipe has to run again
+                return None
+        for path, blob in outputs:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = f"{path}.{os.getpid()}.partial"
+            if blob in sources:
+                shutil.copyfile(sources[blob], partial)
+            else:
+                with open(partial, "wb") as f:
+                    subprocess.run(["git", "cat-file", "blob", blob], stdout=f, check=True)
+            os.replace(partial, path)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('''UPDATE entries SET last_used = ? WHERE key = ?''', (now, key))
+            self.db.executemany('''UPDATE objects SET last_used = ? WHERE blob = ?''', ((now, blob) for _, blob in outputs))
+        return [path for path, _ in outputs]
+
+    def store(self, key: str, outputs: List[str]) -> None:
+        '''Records the outputs produced under key, copying the ones git doesn't have into the cache directory'''
+        outputs = [path for path in outputs if os.path.isfile(path)]
+        blobs = hash_blobs(outputs)
+        now = time.time()
+        copied = []
+        for path, blob in zip(outputs, blobs):
+            target = self.object_path(blob)
+            if in_git(blob) or os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            partial = f"{target}.{os.getpid()}.{threading.get_ident()}.partial"
+            shutil.copyfile(path, partial)
+            os.replace(partial, target)
+            copied.append((blob, os.path.getsize(target), now))
+        with self.lock, self.db:
+            self.db.execute('''INSERT OR REPLACE INTO entries (key, outputs, last_used) VALUES (?, ?, ?)''',
+                            (key, json.dumps(list(zip(outputs, blobs))), now))
+            self.db.executemany('''INSERT OR REPLACE INTO objects (blob, size, last_used) VALUES (?, ?, ?)''', copied)
+        self.evict()
+
+    def evict(self) -> List[str]:
+        '''Removes the least recently used objects until the cache directory fits in max_bytes, returns their blobs'''
+        with self.lock:
+            total = self.db.execute('''SELECT COALESCE(SUM(size), 0) FROM objects''').fetchone()[0]
+            if total <= self.max_bytes:
+                return []
+            evicted = []
+            for blob, size in self.db.execute('''SELECT blob, size FROM objects ORDER BY last_used''').fetchall():
+                if total <= self.max_bytes:
+                    break
+                if os.path.exists(self.object_path(blob)):
+                    os.remove(self.object_path(blob))
+                total -= size
+                evicted.append(blob)
+            with self.db:
+                self.db.executemany('''DELETE FROM objects WHERE blob = ?''', ((blob,) for blob in evicted))
+        return evicted
+
+    def close(self) -> None:
+        self.db.close()
@@ -1,10 +1,17 @@
-from typing import Optional
+from typing import List, Optional
 import typer
 from scimon import __app_name__, __version__, __file__
-from scimon.scimon import reproduce as r
-from scimon.scimon import visualize as v
-from scimon.db import initialize_db
-from scimon.utils import add_to_gitignore
+from scimon.db import initialize_db, get_db, migrate_db, get_schema_version, get_command_patterns, DB_NAME, DB_FILES, SCHEMA_VERSION
+from scimon.ingest import ingest_strace, STRACE_LOG_DIR
+from scimon.utils import add_to_gitignore, run_git
+from scimon.tracer import TRACERS, PROFILES, DEFAULT_PROFILE, get_tracer_for_dir, get_profile_for_dir, set_tracer_for_dir
+from scimon.daemon import run_daemon, SPOOL_DIR, BATCH_SIZE, POLL_INTERVAL
+from scimon.cache import CACHE_MAX_BYTES
+from scimon.artifacts import materialize_pointers, restore_from_commit, ARTIFACT_THRESHOLD
+from scimon.archive import reingest_archive, parse_since, ARCHIVE_DIR, ARCHIVE_MAX_BYTES, ARCHIVE_MAX_AGE_DAYS
+from scimon.metrics import span, format_profile, write_metrics
+from scimon.fastpath import read_only_patterns, set_rule, RULES
+import glob
 import os
 from pathlib import Path
 import subprocess
@@ -12,28 +19,68 @@ import subprocess
 app = typer.Typer()
 MONITORED_DIR=os.path.expanduser("~/.scimon/.dirs")
 
+# the planner pulls in jinja2, graphviz and the thread pool, so only the commands using it import it
+def r(file: str, git_hash: Optional[str]) -> None:
+    from scimon.scimon import reproduce
+    reproduce(file, git_hash)
+
+def v(file: str, git_hash: Optional[str]) -> None:
+    from scimon.scimon import visualize
+    visualize(file, git_hash)
+
 def _version_callback(value: bool) -> None:
     if value:
         typer.echo(f"{__app_name__} v{__version__}")
         raise typer.Exit()
 
+def _report_metrics(command: str, profile: bool) -> None:
+    if profile:
+        typer.echo(format_profile(), err=True)
+    write_metrics(command)
+
 @app.callback()
-def main(version: Optional[bool] = typer.Option(
+def main(ctx: typer.Context, version: Optional[bool] = typer.Option(
     None,
     "--version",
     "-v",
     help="Display the application's version and exit",
     callback=_version_callback,
     is_eager=True
-)) -> None:
-    return
+), profile: bool = typer.Option(False, "--profile", help="Print where the command spent its time once it is done")) -> None:
+    # the whole command is a span, closed before its spans are printed and appended to the metrics file
+    ctx.call_on_close(lambda: _report_metrics(ctx.invoked_subcommand, profile))
+    ctx.with_resource(span(ctx.invoked_subcommand))
 
-@app.command(help="Generates a Makefile for reproducing the supplied file at a given version specified with the git commit hash.")
+@app.command(help="Generates a Makefile for reproducing the supplied files at a given version specified with the git commit hash.")
 def reproduce(
+    files: List[str] = typer.Argument(None, help="Paths or glob patterns of the files to reproduce"),
+    git_hash: Optional[str] = typer.Option(None, "--git-hash", "-g", help="Git commit hash of the version to reproduce, selects newest version by default"),
+    all_outputs_of: Optional[str] = typer.Option(None, help="Also reproduce every file changed by this commit")
+) -> None:
+    files = files or []
+    if len(files) == 1 and not all_outputs_of and not glob.has_magic(files[0]):
+        r(files[0], git_hash)
+        return
+    if not files and not all_outputs_of:
+        typer.echo("Supply at least one file or --all-outputs-of")
+        raise typer.Exit(code=1)
+    from scimon.scimon import reproduce_targets
+    reproduce_targets(files, git_hash, all_outputs_of)
+
+@app.command(help="Reproduces the supplied file at a given version by running its plan directly, independent steps in parallel.")
+def run(
     file: str = typer.Argument(help="Path to the file to reproduce"),
-    git_hash: Optional[str] = typer.Option(None, "--git-hash", "-g", help="Git commit hash of the version to reproduce, selects newest version by default")
+    git_hash: Optional[str] = typer.Option(None, "--git-hash", "-g", help="Git commit hash of the version to reproduce, selects newest version by default"),
+    jobs: int = typer.Option(os.cpu_count() or 1, "--jobs", "-j", help="Number of steps run at once"),
+    use_cache: bool = typer.Option(True, "--cache/--no-cache", help="Restore the outputs of recipes already run on identical inputs"),
+    cache_max_mb: int = typer.Option(CACHE_MAX_BYTES // 1024 ** 2, help="Size the build cache directory is evicted down to")
 ) -> None:
-    r(file, git_hash)
+    from scimon.scimon import run as run_plan
+    from scimon.cache import BuildCache
+    cache = BuildCache(max_bytes=cache_max_mb * 1024 ** 2) if use_cache else None
+    result = run_plan(file, git_hash, jobs, cache)
+    if result is None or result.failed or result.cancelled:
+        raise typer.Exit(code=1)
 
 @app.command(help="Generates a provenance graph for the supplied file at a given version specified with the git commit hash.")
 def visualize(
@@ -41,7 +88,150 @@ def visualize(
     git_hash: Optional[str] = typer.Option(None, "--git-hash", "-g", help="Git commit hash of the version to reproduce, selects newest version by default")
 ) -> None:
     v(file, git_hash)
-    
+
+@app.command(help="Lists the file versions the supplied file was derived from, across every recorded commit.")
+def lineage(
+    file: str = typer.Argument(help="Path to the file to trace"),
+    git_hash: Optional[str] = typer.Option(None, "--git-hash", "-g", help="Git commit hash of the version to trace, selects newest version by default"),
+    downstream: bool = typer.Option(False, "--downstream", help="List the file versions derived from it instead")
+) -> None:
+    from scimon.provenance import get_lineage
+    try:
+        edges = get_lineage(file, git_hash or "HEAD", get_db(), downstream)
+    except ValueError as e:
+        typer.echo(str(e))
+        raise typer.Exit(code=1)
+    for edge in edges:
+        typer.echo(f"{edge.filename}@{edge.commit_hash[:7]} <- {edge.input_filename}@{edge.input_commit[:7]}")
+
+
+@app.command(help="Parses a strace log and stores the captured system calls in the database of the current directory.")
+def ingest(
+    log: str = typer.Argument(help="Path to the strace log to parse", default=STRACE_LOG_DIR),
+    git_hash: Optional[str] = typer.Option(None, "--git-hash", "-g", help="Git commit hash to associate the system calls with, uses HEAD by default")
+) -> None:
+    ingest_strace(log, git_hash)
+
+@app.command(help="Commits the changes of the current directory and records the command that made them, used by the bash hook.")
+def snapshot(
+    command: str = typer.Argument(help="Command line the changes are attributed to, used as the commit message"),
+    pre: bool = typer.Option(False, "--pre", help="Snapshot taken before the command runs, no command is recorded"),
+    pending: Optional[str] = typer.Option(None, help="File to append the directory and new commit to, for the command's trace to be ingested into"),
+    artifact_threshold_mb: int = typer.Option(ARTIFACT_THRESHOLD // 1024 ** 2, help="Files this large are kept in the artifact store instead of git"),
+    pattern: Optional[str] = typer.Option(None, help="Pattern of the command, counted towards the read-only fast path whether it changed anything or not"),
+    trace_cwd: Optional[str] = typer.Option(None, help="Directory the traced command ran from, appended to pending with the new commit")
+) -> None:
+    from scimon.snapshot import snapshot as take_snapshot
+    taken = take_snapshot(command, pre, pending, artifact_threshold_mb * 1024 ** 2, pattern=pattern, trace_cwd=trace_cwd)
+    if taken is not None:
+        typer.echo(f"Committed {len(taken.changed)} changed files as {taken.commit[:7]}")
+
+@app.command(help="Replaces pointer files with their content from the artifact store, or checks files out at a commit when --source is given.")
+def materialize(
+    files: List[str] = typer.Argument(None, help="Files to materialize, every pointer file tracked in the current directory by default"),
+    source: Optional[str] = typer.Option(None, "--source", "-s", help="Git commit hash to check the files out at")
+) -> None:
+    if source:
+        for file in files or []:
+            restore_from_commit(file, source)
+        typer.echo(f"Restored {len(files or [])} files from {source}")
+        return
+    if not files:
+        files = [f for f in run_git("ls-files", "-z").split("\0") if f]
+    typer.echo(f"Materialized {len(materialize_pointers(files))} files")
+
+@app.command(help="Ingests the traces queued by the bash hook in the background, as the only database writer.")
+def daemon(
+    spool: str = typer.Option(SPOOL_DIR, help="Directory the bash hook queues finished traces in"),
+    batch_size: int = typer.Option(BATCH_SIZE, help="Traces ingested per transaction"),
+    poll_interval: float = typer.Option(POLL_INTERVAL, help="Seconds to wait between scans of an empty spool"),
+    once: bool = typer.Option(False, "--once", help="Exit once the spool is empty"),
+    archive_max_mb: int = typer.Option(ARCHIVE_MAX_BYTES // 1024 ** 2, help="Size the compressed trace archive is rotated down to"),
+    archive_max_days: float = typer.Option(ARCHIVE_MAX_AGE_DAYS, help="Age after which archived traces are removed")
+) -> None:
+    run_daemon(spool, batch_size, poll_interval, once, archive_max_bytes=archive_max_mb * 1024 ** 2,
+               archive_max_age_days=archive_max_days)
+
+@app.command(help="Parses the archived traces of the current directory again, replacing the system calls stored for their commits.")
+def reingest(
+    since: Optional[str] = typer.Option(None, "--since", "-s", help="Only traces recorded since this age (e.g. 12h, 7d) or date (e.g. 2025-01-31)"),
+    archive: str = typer.Option(ARCHIVE_DIR, help="Directory of the compressed traces")
+) -> None:
+    try:
+        timestamp = parse_since(since) if since else None
+    except ValueError as e:
+        typer.echo(str(e))
+        raise typer.Exit(code=1)
+    count = reingest_archive(timestamp, archive)
+    typer.echo(f"Reingested {count} commits")
+
+@app.command(help="Shows or sets the system call tracer and tracing profile used for commands run in a directory.")
+def tracer(
+    backend: Optional[str] = typer.Argument(None, help=f"Tracer to use, one of {', '.join(TRACERS)}"),
+    dir: str = typer.Option(os.getcwd(), "--dir", "-d", help="Directory the tracer applies to, including its subdirectories"),
+    profile: str = typer.Option(DEFAULT_PROFILE, "--tracing-profile", "-p", help=f"System calls and paths to trace, one of {', '.join(PROFILES)}")
+) -> None:
+    if backend is None:
+        current, current_profile = get_tracer_for_dir(dir), get_profile_for_dir(dir)
+        for t in TRACERS.values():
+            marker = "*" if t is current else " "
+            status = "" if t.available() else " (not available)"
+            typer.echo(f"{marker} {t.name}: {t.description}{status}")
+        typer.echo("Profiles:")
+        for p in PROFILES.values():
+            marker = "*" if p is current_profile else " "
+            typer.echo(f"{marker} {p.name}: {p.description}")
+        return
+    if backend not in TRACERS:
+        typer.echo(f"Unknown tracer {backend}, choose one of {', '.join(TRACERS)}")
+        raise typer.Exit(code=1)
+    if profile not in PROFILES:
+        typer.echo(f"Unknown tracing profile {profile}, choose one of {', '.join(PROFILES)}")
+        raise typer.Exit(code=1)
+    if not TRACERS[backend].available():
+        typer.echo(f"Warning: {backend} is not available on this machine")
+    set_tracer_for_dir(dir, backend, profile=profile)
+    typer.echo(f"Commands run in {dir} will be traced with {backend} using the {profile} profile")
+
+@app.command(help="Lists the command patterns learned in the current directory, or allows, denies or clears the rule deciding whether the bash hook runs one untraced.")
+def fastpath(
+    rule: Optional[str] = typer.Argument(None, help=f"One of {', '.join(RULES)} or clear"),
+    command: Optional[str] = typer.Argument(None, help='Command line or pattern the rule applies to, e.g. "git log"')
+) -> None:
+    db = get_db()
+    if rule is None:
+        patterns = get_command_patterns(db)
+        read_only = set(read_only_patterns(patterns))
+        for p in patterns:
+            marker = "*" if p.pattern in read_only else " "
+            ruled = f" ({p.rule})" if p.rule else ""
+            typer.echo(f"{marker} {p.pattern}: {p.runs} traced runs, {p.writes} changed files{ruled}")
+        return
+    try:
+        pattern = set_rule(command or "", None if rule == "clear" else rule, db)
+    except ValueError as e:
+        typer.echo(str(e))
+        raise typer.Exit(code=1)
+    typer.echo(f"Cleared the rule of {pattern}" if rule == "clear" else f"{pattern}: {rule}")
+
+@app.command(help="Upgrades the database of the current directory to the latest schema.")
+def migrate(
+    vacuum: bool = typer.Option(True, help="Reclaim the space freed by the migration")
+) -> None:
+    if not os.path.exists(DB_NAME):
+        typer.echo("No database in the current directory, exiting...")
+        return
+    size = os.path.getsize(DB_NAME)
+    db = get_db()
+    version = get_schema_version(db)
+    migrated = migrate_db(db)
+    if not migrated and version >= SCHEMA_VERSION:
+        typer.echo("Database already up to date")
+        return
+    if migrated and vacuum:
+        db.execute("VACUUM")
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    typer.echo(f"Database migrated from version {version} to {SCHEMA_VERSION}, {size} -> {os.path.getsize(DB_NAME)} bytes")
 
 @app.command(help="Initialize the current working directory for monitoring")
 def init() -> None:
@@ -61,8 +251,8 @@ def init() -> None:
     with open(MONITORED_DIR, "a+") as f:
         f.write(str(cwd.relative_to(home_path))+"\n")
     
-    # append '.db' into .gitignore TODO
-    add_to_gitignore(".db")
+    # the database and its -wal/-shm files stay out of the repository
+    add_to_gitignore(DB_FILES)
 
     # initialize git repository
     try:
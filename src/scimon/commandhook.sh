@@ -5,10 +5,63 @@ shopt -s extdebug
 
 # Directories
 GITCHECK_DIRS="$HOME/.scimon/.dirs"
-STRACE_LOG_DIR="$HOME/.scimon/strace.log"
+# one trace file per command, named by timestamp and pre-command commit
+SCIMON_TRACES="$HOME/.scimon/traces"
+SCIMON_TRACE_LOG=""
+# schema shared with scimon/db.py
+SCIMON_SCHEMA="$(dirname "${BASH_SOURCE[0]}")/schema.sql"
+# finished traces waiting for `scimon daemon`
+SCIMON_SPOOL="$HOME/.scimon/spool"
+SCIMON_SPOOL_LIMIT=64
+# commits of the running command waiting for its trace, one file per shell so concurrent shells can't spool or
+# delete each other's
+SCIMON_PENDING="$HOME/.scimon/.pending.$$"
+SCIMON_DAEMON_PID="$HOME/.scimon/daemon.pid"
+# tracer chosen per directory with `scimon tracer`, see scimon/tracer.py
+TRACER_CONFIG="$HOME/.scimon/.tracers"
+# keeps the trace lines with a path in one of the directories given as arguments, a relative path, no path at all,
+# or a change of working directory, for the scoped tracing profiles. The arguments are dropped before reading, so
+# awk reads the trace from stdin. The program holds no single quote, it is quoted whole for the shell
+SCIMON_SCOPE_FILTER='BEGIN { n = ARGC - 1; for (i = 1; i <= n; i++) roots[i] = ARGV[i]; ARGC = 1 }
+/^[0-9]+ +f?chdir\(/ { print; next }
+{
+  rest = $0; inside = 0; outside = 0
+  while (!inside && (q = index(rest, "\"")) > 0) {
+    rest = substr(rest, q + 1)
+    e = index(rest, "\"")
+    if (e == 0) break
+    path = substr(rest, 1, e - 1)
+    rest = substr(rest, e + 1)
+    if (substr(path, 1, 1) != "/") inside = 1
+    for (i = 1; i <= n && !inside; i++) if (roots[i] != "" && (path == roots[i] || index(path, roots[i] "/") == 1)) inside = 1
+    if (!inside) outside = 1
+  }
+  if (inside || !outside) print
+}'
+SCIMON_DEFAULT_TRACER="strace -f -e trace=openat,openat2,open,creat,access,faccessat,faccessat2,statx,stat,lstat,fstat,readlink,readlinkat,rename,renameat,renameat2,link,linkat,symlink,symlinkat,mkdir,mkdirat,chdir,fchdir,execve,execveat,fork,vfork,clone,clone3,connect,accept,accept4,fchownat,fchmodat"
+
+# monitored directories checked concurrently after a command
+SCIMON_CHECK_WORKERS=4
+# an untraced read-only command is traced in full once every this many runs, to notice it started writing
+SCIMON_REVALIDATE_EVERY=20
+# how long each hook phase took is appended here after every command, next to the spans of the scimon
+# commands, see scimon/metrics.py. An empty SCIMON_METRICS turns it off
+SCIMON_METRICS="${SCIMON_METRICS-$HOME/.scimon/metrics.prom}"
 
 # Variables
+# monitored directories keyed by absolute path, and the ones the current check is scoped to
+declare -gA SCIMON_DIRS=()
+declare -gA SCIMON_CHECK=()
 IS_COMMAND_IN_PROGRESS=1 # setting it to 1 to take care of the case when history 1 on shell startup is a pipe
+# pattern of the command being run, learned from on its post-check, see scimon/fastpath.py
+SCIMON_COMMAND_PATTERN=""
+SCIMON_FAST_PATH=0
+SCIMON_FULL_CMD=""
+# untraced runs of each pattern since its last full trace
+declare -gA SCIMON_UNTRACED=()
+# "phase microseconds" pairs timed since the last command's metrics were written
+SCIMON_PHASES=()
+SCIMON_PHASE_START=""
 #-------- database operations --------
 
 # TODO: aknowledge reprozip by using their license? Since I am using their database schema
@@ -16,370 +69,346 @@ IS_COMMAND_IN_PROGRESS=1 # setting it to 1 to take care of the case when history
 
 # Create the tables if they don't exist
 _scimon_initialize_db() {
-
-
-    sqlite3 .db 'CREATE TABLE IF NOT EXISTS commands (
-    id INTEGER NOT NULL PRIMARY KEY, 
-    pre_command_commit TEXT,
-    post_command_commit TEXT,
-    command TEXT,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-CREATE INDEX IF NOT EXISTS idx_commands_pre_commit ON commands(pre_command_commit);
-CREATE INDEX IF NOT EXISTS idx_commands_post_commit on commands(post_command_commit);
-CREATE TABLE IF NOT EXISTS file_changes (
-    id INTEGER NOT NULL PRIMARY KEY,
-    commit_hash TEXT NOT NULL,
-    filename TEXT NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_changes_git_hash on file_changes(commit_hash);
-CREATE TABLE IF NOT EXISTS processes (
-    id INTEGER NOT NULL PRIMARY KEY,
-    pid INTEGER NOT NULL,
-    commit_hash TEXT NOT NULL,
-    parent_pid INTEGER,
-    child_pid INTEGER,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    syscall TEXT NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_processes_git_hash on processes(commit_hash);
-CREATE TABLE IF NOT EXISTS opened_files (
-    id INTEGER NOT NULL PRIMARY KEY,
-    commit_hash TEXT NOT NULL,
-    filename TEXT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    mode INTEGER NOT NULL,
-    is_directory BOOLEAN NOT NULL,
-    pid INTEGER NOT NULL,
-    syscall TEXT NOT NULL,
-    open_flag TEXT NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_opened_files_git_hash on opened_files(commit_hash);
-CREATE TABLE IF NOT EXISTS executed_files (
-    id INTEGER NOT NULL PRIMARY KEY,
-    filename TEXT NOT NULL,
-    commit_hash TEXT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    pid INTEGER NOT NULL,
-    argv TEXT NOT NULL,
-    envp TEXT NOT NULL,
-    workingdir TEXT NOT NULL,
-    syscall TEXT NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_executed_files_git_hash on executed_files(commit_hash);
-
-PRAGMA journal_mode=WAL;
-PRAGMA synchronous=NORMAL;
-PRAGMA cache_size=10000;
-PRAGMA temp_store=memory;
-'
-
+  sqlite3 .db < "$SCIMON_SCHEMA"
 }
 
 
-# Table operations
-
-_scimon_insert_command() {
-
-  local pre_commit="$1"
-  local post_commit="$2"
-  local command="$3"
-  
-  # escape single quotes
-  command="${command//\'/\'\'}"
-  sqlite3 .db \
-  "INSERT INTO commands (pre_command_commit, post_command_commit, command) \
-    VALUES ('$pre_commit', '$post_commit', '$command');"
+# ---------------- trace spooling ----------------
+# Starts `scimon daemon` unless it is already running
+_scimon_ensure_daemon() {
+  if [[ -f "$SCIMON_DAEMON_PID" ]] && kill -0 "$(cat "$SCIMON_DAEMON_PID")" 2>/dev/null; then
+    return
+  fi
+  ( nohup scimon daemon >> "$HOME/.scimon/daemon.log" 2>&1 & )
+}
 
+# Picks the trace file of the command about to run, and remembers the directory it runs from since the trace
+# holds paths relative to it
+_scimon_new_trace_log() {
+  mkdir -p "$SCIMON_TRACES"
+  SCIMON_TRACE_LOG="$SCIMON_TRACES/$(date +%s%N)-$(git rev-parse --short HEAD 2>/dev/null || echo none).log"
+  SCIMON_TRACE_CWD="$PWD"
 }
 
-_scimon_update_post_command_commit_hash() {
+# Hands the finished trace over to the daemon, see scimon/daemon.py
+_scimon_spool_trace() {
+  local log="$SCIMON_TRACE_LOG"
+  SCIMON_TRACE_LOG=""
+  if [[ ! -s "$SCIMON_PENDING" || -z "$log" || ! -f "$log" ]]; then
+    rm -f "$SCIMON_PENDING"
+    [[ -n "$log" ]] && rm -f "$log"
+    return
+  fi
+  mkdir -p "$SCIMON_SPOOL"
+  _scimon_ensure_daemon
+
+  # back-pressure: wait (up to 30s) for the daemon to catch up instead of growing the queue without bound
+  local waited=0
+  while (( $(find "$SCIMON_SPOOL" -maxdepth 1 -name '*.targets' | wc -l) >= SCIMON_SPOOL_LIMIT && waited < 300 )); do
+    (( waited == 0 )) && echo "Waiting for scimon daemon to catch up..."
+    sleep 0.1
+    waited=$((waited + 1))
+  done
+
+  # the targets file is moved last, the daemon only picks up entries that have one
+  local name
+  name="$(basename "$log" .log)"
+  mv "$log" "$SCIMON_SPOOL/$name.log"
+  mv "$SCIMON_PENDING" "$SCIMON_SPOOL/$name.targets"
+}
 
-    local pre_command_commit="$1"
-    local post_command_commit="$2"
 
-    sqlite3 .db "UPDATE commands 
-                SET post_command_commit = '$post_command_commit' 
-                WHERE pre_command_commit = '$pre_command_commit';"
+# ---------------- hook metrics ----------------
+# Starts timing a hook phase, EPOCHREALTIME is empty before bash 5 and then nothing is timed
+_scimon_phase_start() {
+  SCIMON_PHASE_START="${EPOCHREALTIME//[.,]/}"
+}
 
+# Records how long the phase started last took, builtins only so timing costs no extra process
+_scimon_phase_end() {
+  [[ -n "$SCIMON_PHASE_START" ]] || return 0
+  local now="${EPOCHREALTIME//[.,]/}"
+  SCIMON_PHASES+=("$1 $((now - SCIMON_PHASE_START))")
+  SCIMON_PHASE_START=""
 }
 
-_scimon_insert_file_change() {
+# Appends the recorded phases to the metrics file as one OpenMetrics exposition
+_scimon_write_metrics() {
+  (( ${#SCIMON_PHASES[@]} )) || return 0
+  local phases=("${SCIMON_PHASES[@]}")
+  SCIMON_PHASES=()
+  [[ -n "$SCIMON_METRICS" && -d "${SCIMON_METRICS%/*}" ]] || return 0
+  local timestamp="${EPOCHREALTIME/,/.}" phase name micros
+  {
+    echo "# TYPE scimon_hook_phase_seconds gauge"
+    echo "# UNIT scimon_hook_phase_seconds seconds"
+    for phase in "${phases[@]}"; do
+      read -r name micros <<< "$phase"
+      printf 'scimon_hook_phase_seconds{phase="%s"} %d.%06d %s\n' "$name" $((micros / 1000000)) $((micros % 1000000)) "$timestamp"
+    done
+    echo "# EOF"
+  } >> "$SCIMON_METRICS"
+}
 
-  local commit="$1"
-  local filename="$2"
 
-  sqlite3 .db "INSERT INTO file_changes (commit_hash, filename) VALUES ('$commit', '$filename');"
+# ---------------- tracer selection ----------------
+# Sets SCIMON_TRACER_ARGS to the tracer command configured for the current directory or its closest configured parent,
+# and SCIMON_TRACER_SCOPED to 1 when its tracing profile only keeps paths in monitored directories
+_scimon_tracer_command() {
+  local rel="${PWD#"$HOME"/}"
+  local dir backend args profile scoped best=""
+  SCIMON_TRACER_ARGS="$SCIMON_DEFAULT_TRACER"
+  SCIMON_TRACER_SCOPED=0
+  if [[ -f "$TRACER_CONFIG" ]]; then
+    while IFS=$'\t' read -r dir backend args profile scoped; do
+      if [[ "$rel" == "$dir" || "$rel" == "$dir"/* ]] && (( ${#dir} > ${#best} )); then
+        best="$dir"
+        SCIMON_TRACER_ARGS="$args"
+        SCIMON_TRACER_SCOPED="${scoped:-0}"
+      fi
+    done < "$TRACER_CONFIG"
+  fi
+}
 
+# Runs a command line under the tracer (the remaining arguments) into SCIMON_TRACE_LOG. With a scoped profile strace
+# pipes its output through SCIMON_SCOPE_FILTER, so the lines about paths outside every monitored directory never
+# reach the disk
+_scimon_trace() {
+  local cmd="$1" output="$SCIMON_TRACE_LOG" roots="" dir q="'\\''"
+  shift
+  if (( SCIMON_TRACER_SCOPED )); then
+    (( ${#SCIMON_DIRS[@]} )) || _scimon_load_dirs
+    for dir in "${!SCIMON_DIRS[@]}"; do
+      roots+=" '${dir//\'/$q}'"
+    done
+    # strace starts the pipe with sh -c, so everything awk needs is single-quoted into the pipe itself rather than
+    # exported, where the traced command would see it
+    [[ -n "$roots" ]] && output="|awk '$SCIMON_SCOPE_FILTER'$roots > '${SCIMON_TRACE_LOG//\'/$q}'"
+  fi
+  "$@" -o "$output" -- bash -c "$cmd"
 }
 
 
+# ---------------- read-only fast path ----------------
+# Sets SCIMON_COMMAND_PATTERN to the pattern a command is learned under, like command_pattern in scimon/fastpath.py:
+# the name of the executable followed by its first argument that isn't an option
+_scimon_command_pattern() {
+  local words=() word exe=""
+  read -r -a words <<< "$1"
+  for word in "${words[@]}"; do
+    if [[ -z "$exe" ]]; then
+      [[ "$word" =~ ^[A-Za-z_][A-Za-z0-9_]*= ]] && continue
+      exe="${word##*/}"
+    elif [[ "$word" != -* ]]; then
+      SCIMON_COMMAND_PATTERN="$exe $word"
+      return
+    fi
+  done
+  SCIMON_COMMAND_PATTERN="$exe"
+}
 
-_scimon_insert_process() {
-  # TODO: is it possible that there might be multiple possible pids with the same child pid and commit hash?
-  local pid="$1"
-  local commit="$2"
-  local child_pid="$3"
-  local syscall="$4"
-  local sql="$5"
+# Succeeds when the pattern can run untraced in every monitored directory in SCIMON_CHECK: the profile scimon keeps
+# in its .git/scimon-readonly allows it or learned it read-only, and doesn't deny it. A bare executable is only
+# there when the user allowed it, and then covers all of its commands
+_scimon_is_read_only() {
+  local pattern="$1" exe="${1%% *}" dir line allowed denied
+  (( ${#SCIMON_CHECK[@]} )) || return 1
+  for dir in "${!SCIMON_CHECK[@]}"; do
+    [[ -f "$dir/.git/scimon-readonly" ]] || return 1
+    allowed=0
+    denied=0
+    while IFS="" read -r line; do
+      case "$line" in
+        "+$pattern") allowed=2 ;;
+        "+$exe") (( allowed )) || allowed=1 ;;
+        "-$pattern") denied=2 ;;
+        "-$exe") (( denied )) || denied=1 ;;
+      esac
+    done < "$dir/.git/scimon-readonly"
+    # a rule on the whole pattern wins over one on its executable
+    (( allowed > denied )) || return 1
+  done
+}
 
-  local parent_pid=$(sqlite3 .db "SELECT pid FROM processes WHERE child_pid='$pid' AND commit_hash='$commit'")
-  if [[ -z "$parent_pid" ]]; then
-    parent_pid="NULL"
+# Succeeds when a monitored directory has nothing to commit, leaving out the database and its -wal/-shm files.
+# git status doesn't look at artifacts, whose pointer files are skip-worktree entries, so their stats are compared
+# with the ones scimon recorded in .git/scimon-artifacts when storing them, see scimon/artifacts.py
+_scimon_tree_clean() {
+  local dir="$1" stats="$1/.git/scimon-artifacts" line paths=()
+  [[ -z "$(git -C "$dir" status --porcelain -- . ':!.db*' 2>/dev/null)" ]] || return 1
+  if [[ ! -f "$stats" ]]; then
+    # not snapshotted by this version of scimon yet, any artifact counts as changed
+    ! git -C "$dir" ls-files -v 2>/dev/null | grep -q '^S '
+    return
   fi
-  # sqlite3 .db \
-  # "INSERT INTO processes (pid, commit_hash, parent_pid, child_pid, syscall) \
-  #   VALUES ($pid, '$commit', $parent_pid, $child_pid, '$syscall');"
-  echo "INSERT INTO processes (pid, commit_hash, parent_pid, child_pid, syscall) VALUES ($pid, '$commit', $parent_pid, $child_pid, '$syscall');" >> "$sql"
+  [[ -s "$stats" ]] || return 0
+  while IFS="" read -r line; do
+    paths+=("${line#* * }")
+  done < "$stats"
+  [[ "$(cd "$dir" && stat -c '%s %.9Y %n' -- "${paths[@]}" 2>/dev/null)" == "$(< "$stats")" ]]
 }
 
-
-_scimon_insert_opened_file() {
-  local commit="$1"
-  local filename="$2"
-  local mode="$3"
-  local is_directory="$4"
-  local pid="$5"
-  local syscall="$6"
-  local open_flag="$7"
-  local sql="$8"
-
-#   sqlite3 .db \
-#   "INSERT INTO opened_files (commit_hash, filename, mode, is_directory, pid, syscall, open_flag) \
-#     VALUES ('$commit', '$filename', $mode, $is_directory, $pid, '$syscall', '$open_flag');"
-echo "INSERT INTO opened_files (commit_hash, filename, mode, is_directory, pid, syscall, open_flag) VALUES ('$commit', '$filename', $mode, $is_directory, $pid, '$syscall', '$open_flag');" >> "$sql"
+# Succeeds when every directory in SCIMON_CHECK is clean. An untraced command skips the pre-command snapshot, so
+# changes made before it would otherwise be committed as its own
+_scimon_scope_clean() {
+  local dir
+  for dir in "${!SCIMON_CHECK[@]}"; do
+    _scimon_tree_clean "$dir" || return 1
+  done
 }
 
-
-_scimon_insert_executed_file() {
-  local filename="$1"
-  local commit="$2"
-  local pid="$3"
-  local argv="$4"
-  local envp="$5"
-  local workingdir="$6"
-  local syscall="$7"
-  local sql="$8"
-
-  # sqlite3 .db \
-  # "INSERT INTO executed_files (filename, commit_hash, pid, argv, envp, workingdir, syscall) \
-  #   VALUES ('$filename', '$commit', $pid, '$argv', '$envp', '$workingdir', '$syscall');"
-  echo "INSERT INTO executed_files (filename, commit_hash, pid, argv, envp, workingdir, syscall) VALUES ('$filename', '$commit', $pid, '$argv', '$envp', '$workingdir', '$syscall');" >> "$sql"
+# Checks the directories in scope after an untraced command, only running the full check where the tree changed,
+# which also unlearns the pattern
+_scimon_fast_post_check() {
+  local msg="$1" dir
+  for dir in "${!SCIMON_CHECK[@]}"; do
+    _scimon_tree_clean "$dir" || _scimon_check_dir "$dir" "$msg" 0
+  done
 }
 
-# ---------------- strace parsing ----------------
-_scimon_parse_strace() {
-
-  { 
-    echo "Parsing strace"
-    # initialize temporary sql file for batch write
-    local sql=$(mktemp)
-    echo "BEGIN TRANSACTION;" > "$sql"
-    echo "temp sql file: $sql"
-    while IFS= read -r line || [[ -n "$line" ]]; do
-      # extract the process ID, system call, arguments and return value
-      if [[ $line =~ ^([0-9]+)\ ([a-z0-9_]+)\((.*)\)\ =\ ([0-9-]+) ]]; then
-        local pid="${BASH_REMATCH[1]}"
-        local syscall="${BASH_REMATCH[2]}"
-        local args="${BASH_REMATCH[3]}"
-        local retval="${BASH_REMATCH[4]}"
-
-        # setup case filter to redirect to different database storing functions
-        case "$syscall" in
-          fork|clone|clone3|vfork)
-          # processes table
-          _scimon_handle_processes "$pid" "$syscall" "$args" "$retval" "$sql"
-          ;;
-          open|openat|openat2|creat|access|faccessat|faccessat2|stat|lstat|stat64|oldstat|oldlstat|fstatat64|newfstatat|statx|readlink|readlinkat|mkdir|mkdirat|chdir|rename|renameat|renameat2|link|linkat|symlink|symlinkat|connect|accept|accept4|socketcall)
-          # handle file opening
-          _scimon_handle_file_open "$pid" "$syscall" "$args" "$retval" "$sql"
-          ;;
-          execve|execveat)
-          # handle executed files
-          _scimon_handle_file_execute "$pid" "$syscall" "$args" "$retval" "$sql"
-          ;;    
-          esac    
-      fi
-    done < "$STRACE_LOG_DIR"
-
-    echo "COMMIT;" >> "$sql"
-    
-    sqlite3 .db < "$sql" 2>/dev/null || echo "Something went wrong while attempting to store strace information to database"
 
-    rm "$sql"
-    rm .db-shm
-    rm .db-wal
+# ---------------------- MAIN HOOK LOGIC ---------------------------
 
-    echo "Strace parsing completed."
-  } &
 
+# Loads ~/.scimon/.dirs into SCIMON_DIRS, entries are relative to HOME
+_scimon_load_dirs() {
+  SCIMON_DIRS=()
+  [[ -f "$GITCHECK_DIRS" ]] || return
+  local dir
+  while IFS="" read -r dir || [[ -n "$dir" ]]; do
+    [[ -z "$dir" ]] && continue
+    [[ "$dir" != /* ]] && dir="$HOME/$dir"
+    SCIMON_DIRS["${dir%/}"]=1
+  done < "$GITCHECK_DIRS"
 }
 
-_scimon_is_file_tracked_by_git() {
-  local filename="$1"
-
-  if git ls-files --error-unmatch "$filename" &>/dev/null; then
-    return 0
-  fi
-
-  return 1
+# Marks every monitored directory containing the path (absolute or relative to PWD) for checking
+_scimon_scope_path() {
+  local path="$1"
+  [[ "$path" == "~"* ]] && path="$HOME${path:1}"
+  [[ "$path" != /* ]] && path="$PWD/$path"
+
+  # resolve . and .. without touching the filesystem
+  local part parts=() normalized=""
+  IFS=/ read -r -a parts <<< "$path"
+  local stack=()
+  for part in "${parts[@]}"; do
+    case "$part" in
+      ""|.) ;;
+      ..) (( ${#stack[@]} )) && unset 'stack[${#stack[@]}-1]' ;;
+      *) stack+=("$part") ;;
+    esac
+  done
+  for part in "${stack[@]}"; do
+    normalized+="/$part"
+  done
+
+  # walk up the ancestors, each one is a single lookup in SCIMON_DIRS
+  while [[ -n "$normalized" ]]; do
+    [[ -n "${SCIMON_DIRS[$normalized]}" ]] && SCIMON_CHECK["$normalized"]=1
+    normalized="${normalized%/*}"
+  done
 }
 
-_scimon_handle_processes() {
-  # store the system calls into the processes table
-  local pid="$1"
-  local syscall="$2"
-  local args="$3"
-  local retval="$4"
-  local sql="$5"
-
-  _scimon_insert_process "$pid" "$(git rev-parse HEAD)" "$retval" "$syscall" "$sql"
+# Picks the monitored directories a command can have touched: the ones containing PWD or any path-like word of
+# the command line, and after the command, the ones that appear in its trace
+_scimon_scope_dirs() {
+  local msg="$1"
+  local is_pre_command="$2"
+  SCIMON_CHECK=()
+  (( ${#SCIMON_DIRS[@]} )) || return
+
+  _scimon_scope_path "$PWD"
+  local word words=()
+  read -r -a words <<< "$msg"
+  for word in "${words[@]}"; do
+    word="${word#*=}"
+    [[ "$word" == */* || -e "$word" ]] && _scimon_scope_path "$word"
+  done
+
+  if (( ! is_pre_command )) && [[ -n "$SCIMON_TRACE_LOG" && -f "$SCIMON_TRACE_LOG" ]]; then
+    # a single grep over the trace for the quoted absolute path prefix of every monitored directory
+    local matched
+    while IFS="" read -r matched; do
+      SCIMON_CHECK["${matched:1:${#matched}-2}"]=1
+    done < <(printf '"%s/\n' "${!SCIMON_DIRS[@]}" | grep -oF -f - "$SCIMON_TRACE_LOG" | sort -u)
+  fi
 }
 
-_scimon_handle_file_open() {
-  # store the system calls into opened_files table
-  local pid="$1"
-  local syscall="$2"
-  local args="$3"
-  local retval="$4"
-  local sql="$5"
-
-  # process arguments first
-  local filename=$(printf '%s' "$args" | sed -E 's/.*"([^"]+)".*/\1/')
-  local mode=-1
-  local is_dir
-  local open_flag=""
-
-  if ! _scimon_is_file_tracked_by_git "$filename"; then
+# Offers to initialize a monitored directory that isn't a git repository yet, returns 1 if it stays one
+_scimon_ensure_repo() {
+  local dir="$1"
+  [[ -d "$dir/.git" ]] && return 0
+  echo "$dir isn't a git repository, would you like to initialize a git repository in $dir? (y/n)"
+  read -r answer </dev/tty
+  if [[ "$answer" == "y" || "$answer" == "Y" ]]; then
+    (
+      cd "$dir" || exit 1
+      git init
+      git add -A
+      git commit -m "Initial commit"
+      _scimon_initialize_db
+    )
     return 0
   fi
-
-  if [[ "$syscall" == "open" ]]; then
-    if [[ "$args" =~ \"[^\"]+\",[[:space:]]*([^,\)]+) ]]; then
-      open_flag="${BASH_REMATCH[1]}"
-    fi
-  elif [[ "$syscall" == "openat" || "$syscall" == "openat2" ]]; then
-    if [[ "$args" =~ \"[^\"]+\",[[:space:]]*([^,\)]+) ]]; then
-      open_flag="${BASH_REMATCH[1]}"
-    fi
-  fi
-
-
-  if [[ "$args" =~ ,[[:space:]]*([0-7]{3,4}) ]]; then
-    mode="${BASH_REMATCH[1]}"
-  fi
-
-  # Check on-disk if it’s a directory
-  [[ -d "$filename" ]] && is_dir=1 || is_dir=0
-
-  # store into db
-  _scimon_insert_opened_file "$(git rev-parse HEAD)" "$filename" "$mode" "$is_dir" "$pid" "$syscall" "$open_flag" "$sql"
+  echo "Skipping $dir, not a git repository."
+  return 1
 }
 
-_scimon_handle_file_execute() {
-  # store the system calls into the executed_files table
-  local pid="$1"
-  local syscall="$2"
-  local args="$3"
-  local retval="$4"
-  local sql="$5"
-  local workingdir="$(pwd)"
-  local filename=""
-  if [[ "$args" =~ \"([^\"]+)\" ]]; then
-    filename="${BASH_REMATCH[1]}"
-  fi
-  
-  if [[ "$syscall" == "execve" ]]; then
-    # Get everything between the first [ and the following ],
-    if [[ "$args" =~ \"[^\"]+\",[[:space:]]*(\[.*\]),[[:space:]]* ]]; then
-      local argv="${BASH_REMATCH[1]}"
+# Commits the changes of one monitored directory, recording the command and its trace if it isn't a pre-command check.
+# `scimon snapshot` does it in one process, with git plumbing and a single database transaction, see scimon/snapshot.py
+_scimon_check_dir() {
+  local dir="$1"
+  local msg="$2"
+  local is_pre_command="$3"
+  echo "Checking directory: $dir $msg $is_pre_command"
+  (
+    # change directory to the git repo, or skip if it doesn't exist
+    cd "$dir" 2>/dev/null || { echo "Cannot access $dir, skipping..."; exit 0; }
+    if (( is_pre_command )); then
+      scimon snapshot --pre "$msg" || echo "snapshot failed in $dir"
     else
-      echo "Failed to extract argv from: $args"
-      return 1
+      # records that the trace of the command has to be ingested into this directory at its new commit
+      local learn=() cwd=()
+      [[ -n "$SCIMON_COMMAND_PATTERN" ]] && learn=(--pattern "$SCIMON_COMMAND_PATTERN")
+      [[ -n "$SCIMON_TRACE_LOG" ]] && cwd=(--trace-cwd "$SCIMON_TRACE_CWD")
+      scimon snapshot --pending "$SCIMON_PENDING" "${learn[@]}" "${cwd[@]}" "$msg" || echo "snapshot failed in $dir"
     fi
-  elif [[ "$syscall" == "execveat" ]]; then
-    # Handle execveat format
-    if [[ "$args" =~ [^,]+,[[:space:]]*\"[^\"]+\",[[:space:]]*(\[.*\]),[[:space:]]* ]]; then
-      local argv="${BASH_REMATCH[1]}"
-    else
-      echo "Failed to extract argv from execveat: $args"
-      return 1
-    fi
-  fi
-
-  if [[ "$args" =~ (\[.*\]),[[:space:]]*(.*) ]]; then
-    local envp="${BASH_REMATCH[2]}"
-  else
-    echo "Failed to extract envp from: $args"
-    local envp="(unknown environment)"
-  fi
-
-  argv="${argv//\'/\'\'}"
-  # remove trailing comments from envp
-  envp=$(echo "$envp" | sed -E 's/[[:space:]]*\/\*.*\*\/[[:space:]]*$//')
-  
-  # echo "Exec: PID: $pid, filename: $filename, argv: $argv, envp: $envp, retval: $retval"
-  _scimon_insert_executed_file "$filename" "$(git rev-parse HEAD)" "$pid" "$argv" "$envp" "$workingdir" "$syscall" "$sql"
+  )
 }
 
-
-# ---------------------- MAIN HOOK LOGIC ---------------------------
-
-
 _scimon_git_check() {
   local msg="$1"
   local is_pre_command="$2"
   if [[ "$msg" == *"scimon"* ]]; then
     return 1
   fi
-  while IFS="" read -r dir || [ -n "$dir" ] 
-  do
-    echo "Checking directory: $dir $msg $is_pre_command"
-    [[ -z "$dir" ]] && continue
-    (
-      # change directory to the git repo, or skip if it doesn't exist
-      cd "$HOME/$dir" 2>/dev/null || echo "Cannot access $dir, skipping...";
-
-      if [[ ! -d .git ]]; then
-        echo "$dir isn't a git repository, would you like to initialize a git repository in $dir? (y/n)"
-        read -r answer </dev/tty
-        if [[ "$answer" == "y" || "$answer" == "Y" ]]; then
-          git init
-          git add -A
-          git commit -m "Initial commit"
-          _scimon_initialize_db
-        else
-          echo "Skipping $dir, not a git repository."
-          return
-        fi
-      fi
 
-      # if git status isn't clean we will create a commit
-      if [ -n "$(git status --porcelain --untracked-files=all)" ]; then
-        local dirty_files
-
-        # when we are doing pre-command git check and see dirty files, simply commit. No need to add a command into the db.
-        if (( ! is_pre_command )); then
-          _scimon_insert_command "$(git rev-parse HEAD)" "" "$msg"
-        fi
+  _scimon_load_dirs
+  _scimon_scope_dirs "$msg" "$is_pre_command"
 
-        dirty_files=$(git status --porcelain --untracked-files=all | awk '{print $2}');
-        
-        
-        git add -A || echo "git add failed in $dir"
-        git commit -m "$msg" || echo "commit failed in $dir"
+  # initializing asks the user, so it happens one directory at a time before any check starts
+  local dir dirs=()
+  for dir in "${!SCIMON_CHECK[@]}"; do
+    _scimon_ensure_repo "$dir" && dirs+=("$dir")
+  done
 
-        if (( ! is_pre_command )); then
-          _scimon_update_post_command_commit_hash "$(git rev-parse HEAD^)" "$(git rev-parse HEAD)"
-          _scimon_parse_strace
+  if (( ${#dirs[@]} == 1 )); then
+    _scimon_check_dir "${dirs[0]}" "$msg" "$is_pre_command"
+  elif (( ${#dirs[@]} > 1 )); then
+    # at most SCIMON_CHECK_WORKERS directories at once, in a subshell so job control stays quiet
+    (
+      running=0
+      for dir in "${dirs[@]}"; do
+        _scimon_check_dir "$dir" "$msg" "$is_pre_command" &
+        if (( ++running >= SCIMON_CHECK_WORKERS )); then
+          wait -n
+          (( running-- ))
         fi
-
-        for file in $dirty_files; do
-          _scimon_insert_file_change "$(git rev-parse HEAD)" "$file"
-        done
-      fi
+      done
+      wait
     )
-  done < "$GITCHECK_DIRS"
+  fi
 }
 
 # Before each user command
@@ -411,15 +440,45 @@ _scimon_pre_exec_hook() {
   type=$(type -t -- "${cmd_and_args[0]}")
   local full_cmd=$(history 1 | sed -E 's/^[[:space:]]*[0-9]+[[:space:]]*//')
   local history_count=$(history 1 | awk '{print $1}')
-  
+
+  SCIMON_COMMAND_PATTERN=""
+  SCIMON_FAST_PATH=0
+  # only simple commands are learned, a pipe or a redirection can write whatever the executable does
+  if [[ $type == file && "$full_cmd" != *[\|\>\<\;\&\`]* && "$full_cmd" != *'$('* && "$full_cmd" != *scimon* ]]; then
+    _scimon_command_pattern "$BASH_COMMAND"
+    _scimon_load_dirs
+    _scimon_scope_dirs "$full_cmd" 1
+    if _scimon_is_read_only "$SCIMON_COMMAND_PATTERN" && _scimon_scope_clean; then
+      local untraced=$(( ${SCIMON_UNTRACED[$SCIMON_COMMAND_PATTERN]:-0} + 1 ))
+      if (( untraced < SCIMON_REVALIDATE_EVERY )); then
+        # runs as in plain bash, without the pre-check or the tracer
+        SCIMON_UNTRACED["$SCIMON_COMMAND_PATTERN"]=$untraced
+        SCIMON_FAST_PATH=1
+        SCIMON_FULL_CMD="$full_cmd"
+        PROMPT_COMMAND='_scimon_post_exec_hook'
+        return 0
+      fi
+      SCIMON_UNTRACED["$SCIMON_COMMAND_PATTERN"]=0
+    fi
+  fi
+
+  _scimon_phase_start
   _scimon_git_check "$full_cmd" 1
+  _scimon_phase_end pre_check
   echo "command to be executed: $BASH_COMMAND"
 
+  local tracer=()
+  _scimon_tracer_command
+  read -r -a tracer <<< "$SCIMON_TRACER_ARGS"
+
   # handle pipes and redirection
   if [[ ("$full_cmd" == *"|"* || "$full_cmd" == *">"*)  && $IS_COMMAND_IN_PROGRESS -eq 0 ]]; then
-    echo "Running pipe command under strace"
+    echo "Running pipe command under ${tracer[0]}"
     IS_COMMAND_IN_PROGRESS=1
-    strace -f -e trace=openat,openat2,open,creat,access,faccessat,faccessat2,statx,stat,lstat,fstat,readlink,readlinkat,rename,renameat,renameat2,link,linkat,symlink,symlinkat,mkdir,mkdirat,execve,execveat,fork,vfork,clone,clone3,connect,accept,accept4,fchownat,fchmodat -o "$STRACE_LOG_DIR" -- bash -c "$full_cmd"
+    _scimon_new_trace_log
+    _scimon_phase_start
+    _scimon_trace "$full_cmd" "${tracer[@]}"
+    _scimon_phase_end trace
     trap '_scimon_pre_exec_hook' DEBUG
     return 1
   elif [[ "$full_cmd" == *"|"*  && $IS_COMMAND_IN_PROGRESS -eq 1 ]]; then
@@ -428,8 +487,11 @@ _scimon_pre_exec_hook() {
   fi
   # normal case - only trace external commands (files), let built-ins execute normally
   if [[ $type == file ]]; then
-    echo "Running command under strace: $BASH_COMMAND"
-    strace -f -e trace=openat,openat2,open,creat,access,faccessat,faccessat2,statx,stat,lstat,fstat,readlink,readlinkat,rename,renameat,renameat2,link,linkat,symlink,symlinkat,mkdir,mkdirat,execve,execveat,fork,vfork,clone,clone3,connect,accept,accept4,fchownat,fchmodat -o "$STRACE_LOG_DIR" -- bash -c "$BASH_COMMAND"    
+    echo "Running command under ${tracer[0]}: $BASH_COMMAND"
+    _scimon_new_trace_log
+    _scimon_phase_start
+    _scimon_trace "$BASH_COMMAND" "${tracer[@]}"
+    _scimon_phase_end trace
     # terminate the original command early so it doesn't execute the same effects twice
     return 1
   fi
@@ -441,8 +503,22 @@ _scimon_pre_exec_hook() {
 _scimon_post_exec_hook() {
   # again, disable DEBUG so we don't recurse when we cd/git inside here
   trap - DEBUG
-  local full_cmd=$(history 1 | sed -E 's/^[[:space:]]*[0-9]+[[:space:]]*//')
-  _scimon_git_check "$full_cmd" 0
+  if (( SCIMON_FAST_PATH )); then
+    _scimon_phase_start
+    _scimon_fast_post_check "$SCIMON_FULL_CMD"
+    _scimon_phase_end fast_check
+  else
+    local full_cmd=$(history 1 | sed -E 's/^[[:space:]]*[0-9]+[[:space:]]*//')
+    _scimon_phase_start
+    _scimon_git_check "$full_cmd" 0
+    _scimon_phase_end post_check
+  fi
+  _scimon_phase_start
+  _scimon_spool_trace
+  _scimon_phase_end spool
+  _scimon_write_metrics
+  SCIMON_COMMAND_PATTERN=""
+  SCIMON_FAST_PATH=0
   IS_COMMAND_IN_PROGRESS=0
   trap '_scimon_pre_exec_hook' DEBUG
 }
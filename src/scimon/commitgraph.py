@@ -0,0 +1,151 @@
+import sqlite3
+import subprocess
+from typing import Dict, List, Optional, Tuple
+from scimon.db import get_db, get_commit_graph as get_commit_graph_rows, insert_commit_graph, delete_commit_graph
+
+
+class CommitGraph:
+    '''
+    In-memory index of the commit DAG. Every commit stores its parents, a generation number
+    (1 + the largest generation of its parents) and a position in a topological order where
+    parents always come before their children, which lets most ancestry checks be answered
+    without walking the graph
+    '''
+
+    def __init__(self):
+        self.parents: Dict[str, Tuple[str, ...]] = {}
+        self.generation: Dict[str, int] = {}
+        self.position: Dict[str, int] = {}
+        # set when update had to drop the index and rebuild it from every commit in the repository
+        self.rebuilt = False
+
+    def __contains__(self, commit: str) -> bool:
+        return commit in self.position
+
+    def __len__(self) -> int:
+        return len(self.position)
+
+    def add(self, commit: str, parents: Tuple[str, ...], generation: Optional[int] = None, position: Optional[int] = None) -> Tuple[str, str, int, int]:
+        '''Adds a commit whose parents have already been added, returns its commit_graph row'''
+        if generation is None:
+            # parents missing from the index (e.g. in shallow clones) are treated as roots
+            generation = 1 + max((self.generation.get(p, 0) for p in parents), default=0)
+        if position is None:
+            position = len(self.position)
+        self.parents[commit] = parents
+        self.generation[commit] = generation
+        self.position[commit] = position
+        return (commit, " ".join(parents), generation, position)
+
+    def tips(self) -> List[str]:
+        '''Returns the commits that are not the parent of any other commit in the index'''
+        has_children = set()
+        for parents in self.parents.values():
+            has_children.update(parents)
+        return [c for c in self.position if c not in has_children]
+
+    def update(self) -> List[Tuple[str, str, int, int]]:
+        '''
+        Adds the commits that are not indexed yet with a single `git rev-list` call,
+        returns the rows of the newly added commits. Tips that no longer exist (e.g. after a rebase
+        and gc) are left out, and if rev-list still fails the index is rebuilt from scratch
+        '''
+        tips = existing_commits(self.tips())
+        try:
+            output = rev_list(tips)
+        except subprocess.CalledProcessError:
+            if not tips:
+                raise
+            print("Could not update the commit graph index, rebuilding it")
+            for index in (self.parents, self.generation, self.position):
+                index.clear()
+            self.rebuilt = True
+            output = rev_list([])
+
+        rows = []
+        # rev-list lists children before their parents, so walk it backwards
+        for line in reversed(output):
+            commit, *parents = line.split()
+            if commit not in self:
+                rows.append(self.add(commit, tuple(parents)))
+        return rows
+
+    def is_ancestor(self, ancestor: str, descendant: str) -> bool:
+        '''
+        Given 2 indexed commits, return True if ancestor is an ancestor of descendant (or the same commit) else False
+        '''
+        if ancestor == descendant:
+            return True
+        if ancestor not in self:
+            return False
+        ancestor_position, ancestor_generation = self.position[ancestor], self.generation[ancestor]
+        if ancestor_position > self.position[descendant] or ancestor_generation >= self.generation[descendant]:
+            return False
+
+        # walk back from the descendant, skipping commits that are too old to reach the ancestor
+        stack = [descendant]
+        seen = {descendant}
+        while stack:
+            commit = stack.pop()
+            for parent in self.parents[commit]:
+                if parent == ancestor:
+                    return True
+                if parent in seen or parent not in self:
+                    continue
+                if self.generation[parent] <= ancestor_generation or self.position[parent] < ancestor_position:
+                    continue
+                seen.add(parent)
+                stack.append(parent)
+        return False
+
+
+def existing_commits(commits: List[str]) -> List[str]:
+    '''Returns the given commits that still exist in the repository, checked with a single `git cat-file` call'''
+    if not commits:
+        return []
+    output = subprocess.run(
+        ["git", "cat-file", "--batch-check=%(objectname) %(objecttype)"],
+        input="".join(f"{c}\n" for c in commits),
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout.splitlines()
+    # missing objects are reported as "<commit> missing"
+    return [c for c, line in zip(commits, output) if line.split()[-1] == "commit"]
+
+
+def rev_list(exclude: List[str]) -> List[str]:
+    '''Returns `git rev-list --parents` lines of every commit that isn't reachable from the excluded ones, children first'''
+    cmd = ["git", "rev-list", "--parents", "--topo-order", "--all"]
+    if exclude:
+        cmd += ["--not", *exclude]
+    return subprocess.run(
+        cmd,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout.splitlines()
+
+
+def load_commit_graph(db: sqlite3.Connection) -> CommitGraph:
+    '''Loads the commit graph stored in the database and indexes any new commits from git'''
+    graph = CommitGraph()
+    for commit, parents, generation, position in get_commit_graph_rows(db):
+        graph.add(commit, tuple(parents.split()), generation, position)
+    rows = graph.update()
+    if rows or graph.rebuilt:
+        with db:
+            if graph.rebuilt:
+                delete_commit_graph(db)
+            insert_commit_graph(rows, db)
+    return graph
+
+
+_commit_graph: Optional[CommitGraph] = None
+
+def get_commit_graph() -> CommitGraph:
+    '''Returns the commit graph of the current repository, loading and updating it once per process'''
+    global _commit_graph
+    if _commit_graph is None:
+        _commit_graph = load_commit_graph(get_db())
+    return _commit_graph
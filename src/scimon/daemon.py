@@ -0,0 +1,178 @@
+import fcntl
+import os
+import shutil
+import signal
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from scimon.db import get_db, get_schema_version, migrate_db, is_trace_ingested, insert_ingested_trace, SCHEMA_VERSION
+from scimon.ingest import feed_lines, parse_targets, TraceTarget
+from scimon.provenance import refresh_provenance
+from scimon.utils import get_tracked_paths
+from scimon.archive import archive_trace, rotate_archive, ARCHIVE_DIR, ARCHIVE_MAX_BYTES, ARCHIVE_MAX_AGE_DAYS
+
+SPOOL_DIR = os.path.expanduser("~/.scimon/spool")
+DAEMON_PID = os.path.expanduser("~/.scimon/daemon.pid")
+
+# spool entries written per transaction
+BATCH_SIZE = 16
+# seconds between scans of an empty spool
+POLL_INTERVAL = 0.5
+
+LOG_SUFFIX = ".log"
+# written last by the hook, an entry is complete once its targets file exists
+TARGETS_SUFFIX = ".targets"
+
+
+class SpoolEntry(NamedTuple):
+    '''A finished trace waiting in the spool, with the directories and commits to ingest it into'''
+    name: str
+    log_path: str
+    targets: List[TraceTarget]
+
+
+def list_spool(spool: str = SPOOL_DIR) -> List[SpoolEntry]:
+    '''Returns the complete entries of the spool in the order they were queued'''
+    if not os.path.isdir(spool):
+        return []
+    entries = []
+    # names start with a nanosecond timestamp, so sorting them gives the queue order
+    for filename in sorted(os.listdir(spool)):
+        if not filename.endswith(TARGETS_SUFFIX):
+            continue
+        name = filename[:-len(TARGETS_SUFFIX)]
+        with open(os.path.join(spool, filename), "r") as f:
+            targets = parse_targets(f)
+        entries.append(SpoolEntry(name, os.path.join(spool, name + LOG_SUFFIX), targets))
+    return entries
+
+
+def remove_entry(entry: SpoolEntry, spool: str = SPOOL_DIR) -> None:
+    for suffix in (LOG_SUFFIX, TARGETS_SUFFIX):
+        path = os.path.join(spool, entry.name + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def retire_entry(entry: SpoolEntry, spool: str = SPOOL_DIR, archive: Optional[str] = ARCHIVE_DIR) -> None:
+    '''Takes an ingested entry off the queue, compressing it into the archive unless archive is None'''
+    if archive is None:
+        remove_entry(entry, spool)
+        return
+    archive_trace(entry.name, entry.log_path, os.path.join(spool, entry.name + TARGETS_SUFFIX), archive)
+
+
+def quarantine_entry(entry: SpoolEntry, spool: str = SPOOL_DIR) -> None:
+    '''Moves an entry that failed to ingest out of the queue so it doesn't block the entries after it'''
+    failed = os.path.join(spool, "failed")
+    os.makedirs(failed, exist_ok=True)
+    for suffix in (LOG_SUFFIX, TARGETS_SUFFIX):
+        path = os.path.join(spool, entry.name + suffix)
+        if os.path.exists(path):
+            shutil.move(path, os.path.join(failed, entry.name + suffix))
+
+
+def ingest_batch(entries: List[SpoolEntry]) -> None:
+    '''
+    Ingests the entries into the database of each of their directories, one transaction per directory.
+    Entries are recorded in the same transaction, so a batch interrupted halfway is resumed without
+    ingesting any trace twice. The provenance graph is updated after each transaction
+    '''
+    by_dir: Dict[str, List[Tuple[SpoolEntry, TraceTarget]]] = {}
+    for entry in entries:
+        for target in entry.targets:
+            by_dir.setdefault(target.directory, []).append((entry, target))
+
+    cwd = os.getcwd()
+    try:
+        for directory, pending in by_dir.items():
+            # tracked paths and the database are both resolved from the working directory
+            os.chdir(directory)
+            db = get_db()
+            if get_schema_version(db) < SCHEMA_VERSION:
+                migrate_db(db)
+            pending = [(entry, target) for entry, target in pending if not is_trace_ingested(entry.name, db)]
+            # git runs before the transaction, which would otherwise hold the write lock while it lists the trees
+            tracked = {}
+            for _, target in pending:
+                if target.commit_hash not in tracked:
+                    tracked[target.commit_hash] = get_tracked_paths(target.commit_hash)
+            ingested = []
+            with db:
+                for entry, target in pending:
+                    with open(entry.log_path, "r", errors="replace") as f:
+                        feed_lines(f, db, target.commit_hash, tracked[target.commit_hash], directory, target.cwd)
+                    insert_ingested_trace(entry.name, db)
+                    ingested.append(target.commit_hash)
+            refresh_provenance(ingested, db)
+    finally:
+        os.chdir(cwd)
+
+
+def process_spool(spool: str = SPOOL_DIR, batch_size: int = BATCH_SIZE, archive: Optional[str] = ARCHIVE_DIR) -> int:
+    '''
+    Ingests up to batch_size queued entries and moves them to the archive,
+    returns the number of entries taken off the queue
+    '''
+    entries = list_spool(spool)[:batch_size]
+    if not entries:
+        return 0
+    try:
+        ingest_batch(entries)
+    except Exception as e:
+        # retry the entries one by one to find the one that failed, the others still go in
+        print(f"Batch of {len(entries)} traces failed ({e}), retrying individually")
+        for entry in entries:
+            try:
+                ingest_batch([entry])
+            except Exception as e:
+                print(f"Failed to ingest {entry.name}: {e}, moving it to {os.path.join(spool, 'failed')}")
+                quarantine_entry(entry, spool)
+                continue
+            retire_entry(entry, spool, archive)
+        return len(entries)
+    for entry in entries:
+        retire_entry(entry, spool, archive)
+    print(f"Ingested {len(entries)} traces")
+    return len(entries)
+
+
+def run_daemon(spool: str = SPOOL_DIR, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL,
+               once: bool = False, pid_file: Optional[str] = DAEMON_PID, archive: Optional[str] = ARCHIVE_DIR,
+               archive_max_bytes: int = ARCHIVE_MAX_BYTES, archive_max_age_days: float = ARCHIVE_MAX_AGE_DAYS) -> None:
+    '''
+    Watches the spool and ingests finished traces as the only writer. Exits after draining the spool
+    when once is set, otherwise runs until SIGTERM or SIGINT, finishing the current batch first.
+    The archive is rotated every time the spool has been drained
+    '''
+    os.makedirs(spool, exist_ok=True)
+    lock = open(os.path.join(spool, ".lock"), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("Another scimon daemon is already watching the spool, exiting...")
+        lock.close()
+        return
+    if pid_file:
+        with open(pid_file, "w") as f:
+            f.write(str(os.getpid()))
+
+    stopping = []
+    handlers = {sig: signal.signal(sig, lambda *_: stopping.append(True)) for sig in (signal.SIGTERM, signal.SIGINT)}
+    rotate = archive is not None
+    try:
+        while not stopping:
+            if process_spool(spool, batch_size, archive):
+                rotate = archive is not None
+                continue
+            if rotate:
+                rotate_archive(archive, archive_max_bytes, archive_max_age_days)
+                rotate = False
+            if once:
+                break
+            time.sleep(poll_interval)
+    finally:
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+        if pid_file and os.path.exists(pid_file):
+            os.remove(pid_file)
+        lock.close()
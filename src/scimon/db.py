@@ -1,40 +1,185 @@
 import sqlite3
-from scimon.models import ProcessTrace, FileExecutionTrace, FileOpenTrace
-from typing import List, Tuple
+import json
+import os
+import atexit
+import hashlib
+from pathlib import Path
+from scimon.models import ProcessTrace, FileExecutionTrace, FileOpenTrace, ReproducePlan, ProvenanceEdge, CommandPattern
+from typing import List, Tuple, Iterable, Optional, Dict
 
 DB_NAME=".db"
+# gitignore pattern and git pathspec covering the database with its -wal and -shm files, which an open
+# connection keeps next to it and sqlite deletes once the last one closes
+DB_FILES = f"{DB_NAME}*"
 
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
+# must match the user_version set at the end of schema.sql
+SCHEMA_VERSION = 8
 
-def get_db() -> sqlite3.Connection:
-    con = sqlite3.connect(DB_NAME)
-    print("Database connection acquired")
+# O_* flags as printed by strace, with their Linux values
+OPEN_FLAGS = {
+    "O_RDONLY": 0o0,
+    "O_WRONLY": 0o1,
+    "O_RDWR": 0o2,
+    "O_CREAT": 0o100,
+    "O_EXCL": 0o200,
+    "O_NOCTTY": 0o400,
+    "O_TRUNC": 0o1000,
+    "O_APPEND": 0o2000,
+    "O_NONBLOCK": 0o4000,
+    "O_DSYNC": 0o10000,
+    "O_ASYNC": 0o20000,
+    "O_DIRECT": 0o40000,
+    "O_LARGEFILE": 0o100000,
+    "O_DIRECTORY": 0o200000,
+    "O_NOFOLLOW": 0o400000,
+    "O_NOATIME": 0o1000000,
+    "O_CLOEXEC": 0o2000000,
+    "O_SYNC": 0o4010000,
+    "O_PATH": 0o10000000,
+    "O_TMPFILE": 0o20200000,
+}
+# flags that mean the opened file is written to
+WRITE_OPEN_FLAGS = OPEN_FLAGS["O_WRONLY"] | OPEN_FLAGS["O_RDWR"] | OPEN_FLAGS["O_CREAT"] | OPEN_FLAGS["O_TRUNC"]
+
+def encode_open_flags(open_flag: Optional[str]) -> int:
+    '''Converts strace's textual flags such as O_WRONLY|O_CREAT|O_TRUNC into a bitmask'''
+    bits = 0
+    for flag in (open_flag or "").split("|"):
+        flag = flag.strip()
+        if flag in OPEN_FLAGS:
+            bits |= OPEN_FLAGS[flag]
+        else:
+            try:
+                bits |= int(flag, 0)
+            except ValueError:
+                pass
+    return bits
+
+def content_hash(content: str) -> bytes:
+    '''Digest used to deduplicate argv and envp blobs'''
+    return hashlib.blake2b(content.encode("utf-8", "surrogateescape"), digest_size=16).digest()
+
+# applied to every connection, journal_mode is persisted in the database file so only the writer sets it
+CONNECTION_PRAGMAS = {
+    "busy_timeout": 5000,
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+}
+WRITER_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+}
+# number of prepared statements kept per connection, keyed by their SQL text
+STATEMENT_CACHE_SIZE = 256
+
+_connections: Dict[Tuple[str, bool], sqlite3.Connection] = {}
+
+def _connect(path: str, read_only: bool) -> sqlite3.Connection:
+    if read_only:
+        con = sqlite3.connect(f"{Path(path).as_uri()}?mode=ro", uri=True, cached_statements=STATEMENT_CACHE_SIZE)
+        pragmas = CONNECTION_PRAGMAS
+    else:
+        con = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+        pragmas = {**WRITER_PRAGMAS, **CONNECTION_PRAGMAS}
+    for pragma, value in pragmas.items():
+        con.execute(f"PRAGMA {pragma}={value}")
+    return con
+
+def get_db(read_only: bool = False) -> sqlite3.Connection:
+    '''
+    Returns the connection to the database of the current directory, opening it on first use and reusing it
+    for the rest of the process. Read-only connections never block the hook while it ingests traces
+    '''
+    key = (os.path.abspath(DB_NAME), read_only)
+    con = _connections.get(key)
+    if con is None:
+        con = _connections[key] = _connect(key[0], read_only)
+        print("Database connection acquired")
     return con
 
+@atexit.register
+def close_db() -> None:
+    '''Closes every connection opened by get_db'''
+    while _connections:
+        _, con = _connections.popitem()
+        con.close()
+
 def get_processes_trace(commit_hash: str, db: sqlite3.Connection) -> List[ProcessTrace]:
     '''Returns a list of (parent_pid, pid, child_pid, syscall) for a given commit hash'''
-    db.row_factory = lambda cursor, row: ProcessTrace(*row)
     cursor = db.cursor()
-    processes_sql = '''SELECT DISTINCT parent_pid, pid, child_pid, syscall FROM processes WHERE commit_hash = ?'''
+    cursor.row_factory = lambda cursor, row: ProcessTrace(*row)
+    processes_sql = '''SELECT DISTINCT p.parent_pid, p.pid, p.child_pid, s.name FROM processes p
+    JOIN syscalls s ON s.id = p.syscall WHERE p.commit_hash = ?'''
     cursor.execute(processes_sql, (commit_hash,))
     return cursor.fetchall()
 
 
 def get_opened_files_trace(commit_hash: str, db: sqlite3.Connection) -> List[FileOpenTrace]:
-    '''Returns a list of (pid, filename, syscall, mode, open_flag) for a given commit hash'''
-    db.row_factory = lambda cursor, row: FileOpenTrace(*row)
+    '''Returns a list of (pid, filename, syscall, mode, open_flag bitmask) for a given commit hash'''
     cursor = db.cursor()
-    opened_files_sql = '''SELECT DISTINCT pid, filename, syscall, mode, open_flag FROM opened_files WHERE commit_hash = ?'''
+    cursor.row_factory = lambda cursor, row: FileOpenTrace(*row)
+    opened_files_sql = '''SELECT DISTINCT o.pid, p.path, s.name, o.mode, o.open_flag FROM opened_files o
+    JOIN paths p ON p.id = o.path_id JOIN syscalls s ON s.id = o.syscall WHERE o.commit_hash = ?'''
     cursor.execute(opened_files_sql, (commit_hash,))
     return cursor.fetchall()
 
 def get_executed_files_trace(commit_hash: str, db: sqlite3.Connection) -> List[FileExecutionTrace]:
     '''Returns a list of (pid, filename, syscall) for a given commit hash'''
-    db.row_factory = lambda cursor, row: FileExecutionTrace(*row)
     cursor = db.cursor()
-    executed_files_sql = '''SELECT pid, filename, syscall FROM executed_files WHERE commit_hash = ?'''
+    cursor.row_factory = lambda cursor, row: FileExecutionTrace(*row)
+    executed_files_sql = '''SELECT e.pid, p.path, s.name FROM executed_files e
+    JOIN paths p ON p.id = e.path_id JOIN syscalls s ON s.id = e.syscall WHERE e.commit_hash = ?'''
     cursor.execute(executed_files_sql, (commit_hash,))
     return cursor.fetchall()
 
+def get_lineage_pids(commit_hash: str, filename: str, db: sqlite3.Connection) -> List[int]:
+    '''
+    Returns the processes a file depends on at a given commit hash: the ones that wrote it and every process they
+    forked, transitively. Walked with a recursive query so only the file's ancestry is read
+    '''
+    lineage_sql = '''WITH RECURSIVE lineage(pid) AS (
+        SELECT pid FROM opened_files WHERE commit_hash = ? AND open_flag & ? != 0
+        AND path_id = (SELECT id FROM paths WHERE path = ?)
+        UNION
+        SELECT p.child_pid FROM lineage l JOIN processes p ON p.commit_hash = ? AND p.pid = l.pid WHERE p.child_pid IS NOT NULL
+        UNION
+        SELECT p.pid FROM lineage l JOIN processes p ON p.commit_hash = ? AND p.parent_pid = l.pid
+    ) SELECT pid FROM lineage'''
+    rows = db.execute(lineage_sql, (commit_hash, WRITE_OPEN_FLAGS, filename, commit_hash, commit_hash))
+    return [pid for pid, in rows]
+
+def get_lineage_trace(commit_hash: str, filename: str, db: sqlite3.Connection) -> Tuple[List[ProcessTrace], List[FileOpenTrace], List[FileExecutionTrace]]:
+    '''
+    Returns the trace rows of a given commit hash that lie upstream of a file: the writes to it, and the forks,
+    reads and executions of the processes returned by get_lineage_pids
+    '''
+    pids = json.dumps(get_lineage_pids(commit_hash, filename, db))
+    processes_cursor = db.cursor()
+    processes_cursor.row_factory = lambda cursor, row: ProcessTrace(*row)
+    # no DISTINCT here, it would make sqlite walk the commit in parent_pid order instead of looking the pids up
+    processes_sql = '''SELECT p.parent_pid, p.pid, p.child_pid, s.name FROM processes p
+    JOIN syscalls s ON s.id = p.syscall WHERE p.commit_hash = ? AND p.pid IN (SELECT value FROM json_each(?))'''
+    processes = processes_cursor.execute(processes_sql, (commit_hash, pids)).fetchall()
+
+    # writes to other files are never walked backwards from this one, only the reads of the lineage are kept
+    opened_files_cursor = db.cursor()
+    opened_files_cursor.row_factory = lambda cursor, row: FileOpenTrace(*row)
+    opened_files_sql = '''SELECT DISTINCT o.pid, p.path, s.name, o.mode, o.open_flag FROM opened_files o
+    JOIN paths p ON p.id = o.path_id JOIN syscalls s ON s.id = o.syscall
+    WHERE o.commit_hash = ? AND o.pid IN (SELECT value FROM json_each(?))
+    AND (o.open_flag & ? = 0 OR p.path = ?)'''
+    opened_files = opened_files_cursor.execute(opened_files_sql, (commit_hash, pids, WRITE_OPEN_FLAGS, filename)).fetchall()
+
+    executed_files_cursor = db.cursor()
+    executed_files_cursor.row_factory = lambda cursor, row: FileExecutionTrace(*row)
+    executed_files_sql = '''SELECT e.pid, p.path, s.name FROM executed_files e
+    JOIN paths p ON p.id = e.path_id JOIN syscalls s ON s.id = e.syscall
+    WHERE e.commit_hash = ? AND e.pid IN (SELECT value FROM json_each(?))'''
+    executed_files = executed_files_cursor.execute(executed_files_sql, (commit_hash, pids)).fetchall()
+    return processes, opened_files, executed_files
+
 def get_command(commit_hash: str, db: sqlite3.Connection) -> str:
     '''Returns the command associated where commit_hash is the post command commit hash in the commands table'''
     cursor = db.cursor()
@@ -42,57 +187,294 @@ def get_command(commit_hash: str, db: sqlite3.Connection) -> str:
     cursor.execute(get_command_sql, (commit_hash,))
     return cursor.fetchall()[0][0]
 
+def insert_command(pre_command_commit: str, post_command_commit: str, command: str, db: sqlite3.Connection) -> None:
+    '''Records a command along with the commits taken before and after it ran'''
+    insert_sql = '''INSERT INTO commands (pre_command_commit, post_command_commit, command) VALUES (?, ?, ?)'''
+    db.execute(insert_sql, (pre_command_commit, post_command_commit, command))
+
+def insert_file_changes(rows: Iterable[Tuple], db: sqlite3.Connection) -> None:
+    '''Inserts (commit_hash, filename) rows into the file_changes table'''
+    insert_sql = '''INSERT INTO file_changes (commit_hash, filename) VALUES (?, ?)'''
+    db.executemany(insert_sql, rows)
+
+def get_syscall_codes(db: sqlite3.Connection) -> Dict[str, int]:
+    '''Returns the integer code of every syscall name'''
+    return dict(db.execute('''SELECT name, id FROM syscalls''').fetchall())
+
+def intern_syscall(name: str, db: sqlite3.Connection) -> int:
+    '''Returns the code of the syscall, adding syscalls missing from the seeded list'''
+    cursor = db.execute('''INSERT OR IGNORE INTO syscalls (name) VALUES (?)''', (name,))
+    if cursor.rowcount:
+        return cursor.lastrowid
+    return db.execute('''SELECT id FROM syscalls WHERE name = ?''', (name,)).fetchone()[0]
+
+def intern_path(path: str, db: sqlite3.Connection) -> int:
+    '''Returns the id of the path in the paths table, adding it if needed'''
+    cursor = db.execute('''INSERT OR IGNORE INTO paths (path) VALUES (?)''', (path,))
+    if cursor.rowcount:
+        return cursor.lastrowid
+    return db.execute('''SELECT id FROM paths WHERE path = ?''', (path,)).fetchone()[0]
+
+def intern_blob(content: str, db: sqlite3.Connection) -> int:
+    '''Returns the id of the content in the blobs table, adding it if needed'''
+    digest = content_hash(content)
+    cursor = db.execute('''INSERT OR IGNORE INTO blobs (hash, content) VALUES (?, ?)''', (digest, content))
+    if cursor.rowcount:
+        return cursor.lastrowid
+    return db.execute('''SELECT id FROM blobs WHERE hash = ?''', (digest,)).fetchone()[0]
+
+def insert_processes(rows: Iterable[Tuple], db: sqlite3.Connection) -> None:
+    '''Inserts (pid, commit_hash, parent_pid, child_pid, syscall code) rows into the processes table'''
+    insert_sql = '''INSERT INTO processes (pid, commit_hash, parent_pid, child_pid, syscall) VALUES (?, ?, ?, ?, ?)'''
+    db.executemany(insert_sql, rows)
+
+def insert_opened_files(rows: Iterable[Tuple], db: sqlite3.Connection) -> None:
+    '''Inserts (commit_hash, path_id, mode, is_directory, pid, syscall code, open_flag bitmask) rows into the opened_files table'''
+    insert_sql = '''INSERT INTO opened_files (commit_hash, path_id, mode, is_directory, pid, syscall, open_flag) VALUES (?, ?, ?, ?, ?, ?, ?)'''
+    db.executemany(insert_sql, rows)
+
+def insert_executed_files(rows: Iterable[Tuple], db: sqlite3.Connection) -> None:
+    '''Inserts (path_id, commit_hash, pid, argv_id, envp_id, workingdir_id, syscall code) rows into the executed_files table'''
+    insert_sql = '''INSERT INTO executed_files (path_id, commit_hash, pid, argv_id, envp_id, workingdir_id, syscall) VALUES (?, ?, ?, ?, ?, ?, ?)'''
+    db.executemany(insert_sql, rows)
+
+def get_commit_graph(db: sqlite3.Connection) -> List[Tuple[str, str, int, int]]:
+    '''Returns every (commit_hash, parents, generation, position) row of the commit graph in topological order'''
+    cursor = db.cursor()
+    commit_graph_sql = '''SELECT commit_hash, parents, generation, position FROM commit_graph ORDER BY position'''
+    cursor.execute(commit_graph_sql)
+    return cursor.fetchall()
+
+def insert_commit_graph(rows: Iterable[Tuple], db: sqlite3.Connection) -> None:
+    '''Inserts (commit_hash, parents, generation, position) rows into the commit_graph table'''
+    insert_sql = '''INSERT OR REPLACE INTO commit_graph (commit_hash, parents, generation, position) VALUES (?, ?, ?, ?)'''
+    db.executemany(insert_sql, rows)
+
+def delete_commit_graph(db: sqlite3.Connection) -> None:
+    '''Deletes the stored commit graph index so it can be rebuilt'''
+    db.execute('''DELETE FROM commit_graph''')
+
+def get_reproduce_plan(filename: str, commit_hash: str, db: sqlite3.Connection) -> Optional[ReproducePlan]:
+    '''Returns the cached reproduce plan of the file at the given commit hash, or None if it hasn't been planned yet'''
+    cursor = db.cursor()
+    reproduce_plan_sql = '''SELECT prerequisites, recipe FROM reproduce_plans WHERE filename = ? AND commit_hash = ?'''
+    cursor.execute(reproduce_plan_sql, (filename, commit_hash))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    prerequisites, recipe = row
+    return ReproducePlan([tuple(p) for p in json.loads(prerequisites)], recipe)
+
+def insert_reproduce_plan(filename: str, commit_hash: str, plan: ReproducePlan, db: sqlite3.Connection) -> None:
+    '''Stores the reproduce plan of the file at the given commit hash'''
+    insert_sql = '''INSERT OR REPLACE INTO reproduce_plans (filename, commit_hash, prerequisites, recipe) VALUES (?, ?, ?, ?)'''
+    db.execute(insert_sql, (filename, commit_hash, json.dumps(plan.prerequisites), plan.recipe))
+
+def delete_reproduce_plans(commit_hash: str, db: sqlite3.Connection) -> None:
+    '''Invalidates the reproduce plans of every file at the given commit hash'''
+    delete_sql = '''DELETE FROM reproduce_plans WHERE commit_hash = ?'''
+    db.execute(delete_sql, (commit_hash,))
+
+def delete_traces(commit_hash: str, db: sqlite3.Connection) -> None:
+    '''Removes the trace rows of a commit so they can be ingested again'''
+    for table in ("processes", "opened_files", "executed_files"):
+        db.execute(f'''DELETE FROM {table} WHERE commit_hash = ?''', (commit_hash,))
+
+def is_trace_ingested(name: str, db: sqlite3.Connection) -> bool:
+    '''Returns True if the spooled trace with the given name has already been ingested into this database'''
+    return db.execute('''SELECT 1 FROM ingested_traces WHERE name = ?''', (name,)).fetchone() is not None
+
+def insert_ingested_trace(name: str, db: sqlite3.Connection) -> None:
+    db.execute('''INSERT OR IGNORE INTO ingested_traces (name) VALUES (?)''', (name,))
+
+def get_artifact_stats(db: sqlite3.Connection) -> Dict[str, Tuple[int, int, str]]:
+    '''Returns the (size, mtime_ns, digest) each artifact had when it was last stored, keyed by path'''
+    return {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in db.execute('''SELECT path, size, mtime_ns, digest FROM artifacts''')}
+
+def insert_artifact_stats(rows: Iterable[Tuple], db: sqlite3.Connection) -> None:
+    '''Inserts or replaces (path, size, mtime_ns, digest) rows in the artifacts table'''
+    db.executemany('''INSERT OR REPLACE INTO artifacts (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)''', rows)
+
+def delete_artifact_stats(paths: Iterable[str], db: sqlite3.Connection) -> None:
+    db.executemany('''DELETE FROM artifacts WHERE path = ?''', ((path,) for path in paths))
+
+def get_file_accesses(commit_hash: str, db: sqlite3.Connection) -> List[Tuple[int, str, int]]:
+    '''Returns a (pid, path, open_flag bitmask) row for every file opened or executed at a given commit hash, executions as reads'''
+    file_accesses_sql = '''SELECT o.pid, p.path, o.open_flag FROM opened_files o JOIN paths p ON p.id = o.path_id
+    WHERE o.commit_hash = ? AND NOT o.is_directory
+    UNION SELECT e.pid, p.path, 0 FROM executed_files e JOIN paths p ON p.id = e.path_id WHERE e.commit_hash = ?'''
+    return db.execute(file_accesses_sql, (commit_hash, commit_hash)).fetchall()
+
+def insert_provenance_edges(edges: Iterable[ProvenanceEdge], db: sqlite3.Connection) -> None:
+    insert_sql = '''INSERT OR REPLACE INTO provenance_edges (commit_hash, filename, input_commit, input_filename) VALUES (?, ?, ?, ?)'''
+    db.executemany(insert_sql, edges)
+
+def delete_provenance_edges(commit_hash: str, db: sqlite3.Connection) -> None:
+    '''Removes the edges into the file versions of a commit, so they can be recomputed from its traces'''
+    db.execute('''DELETE FROM provenance_edges WHERE commit_hash = ?''', (commit_hash,))
+
+def insert_provenance_commit(commit_hash: str, db: sqlite3.Connection) -> None:
+    db.execute('''INSERT OR IGNORE INTO provenance_commits (commit_hash) VALUES (?)''', (commit_hash,))
+
+def delete_provenance_commit(commit_hash: str, db: sqlite3.Connection) -> None:
+    '''Marks a commit whose traces changed as missing from the provenance graph until its edges are recomputed'''
+    db.execute('''DELETE FROM provenance_commits WHERE commit_hash = ?''', (commit_hash,))
+
+def get_provenance_inputs(commit_hash: str, db: sqlite3.Connection) -> Dict[str, str]:
+    '''Returns the version of every file read by the commands of a commit, as resolved in the provenance graph'''
+    inputs_sql = '''SELECT DISTINCT input_filename, input_commit FROM provenance_edges WHERE commit_hash = ?'''
+    return dict(db.execute(inputs_sql, (commit_hash,)).fetchall())
+
+def get_commands_missing_provenance(db: sqlite3.Connection) -> List[str]:
+    '''Returns the post command commits whose traces are not in the provenance graph yet'''
+    missing_sql = '''SELECT post_command_commit FROM commands
+    WHERE post_command_commit NOT IN (SELECT commit_hash FROM provenance_commits)'''
+    return [commit_hash for commit_hash, in db.execute(missing_sql)]
+
+def get_provenance_lineage(filename: str, commit_hash: str, db: sqlite3.Connection, downstream: bool = False) -> List[ProvenanceEdge]:
+    '''
+    Returns every provenance edge reachable from the file at the given commit hash, walking back to the versions it
+    was derived from, or forward to the versions derived from it when downstream is True. One recursive query,
+    however many commits the lineage spans
+    '''
+    if downstream:
+        near, far = ("input_commit", "input_filename"), ("commit_hash", "filename")
+    else:
+        near, far = ("commit_hash", "filename"), ("input_commit", "input_filename")
+    lineage_sql = f'''WITH RECURSIVE reached(commit_hash, filename) AS (
+        VALUES (?, ?)
+        UNION
+        SELECT e.{far[0]}, e.{far[1]} FROM reached r
+        JOIN provenance_edges e ON e.{near[0]} = r.commit_hash AND e.{near[1]} = r.filename
+    ) SELECT e.commit_hash, e.filename, e.input_commit, e.input_filename FROM reached r
+    JOIN provenance_edges e ON e.{near[0]} = r.commit_hash AND e.{near[1]} = r.filename'''
+    cursor = db.cursor()
+    cursor.row_factory = lambda cursor, row: ProvenanceEdge(*row)
+    cursor.execute(lineage_sql, (commit_hash, filename))
+    return cursor.fetchall()
+
+def record_command_runs(patterns: Iterable[str], wrote: bool, db: sqlite3.Connection) -> None:
+    '''Counts a traced run of each command pattern, a run changing the tree restarts its streak of clean runs'''
+    record_sql = '''INSERT INTO command_patterns (pattern, runs, writes, clean_streak) VALUES (?, 1, ?, ?)
+    ON CONFLICT (pattern) DO UPDATE SET runs = runs + 1, writes = writes + excluded.writes,
+        clean_streak = CASE WHEN excluded.writes THEN 0 ELSE clean_streak + 1 END'''
+    db.executemany(record_sql, ((pattern, int(wrote), int(not wrote)) for pattern in patterns))
+
+def set_command_rule(pattern: str, rule: Optional[str], db: sqlite3.Connection) -> None:
+    '''Sets the allow or deny rule of a command pattern, None going back to what its runs show'''
+    rule_sql = '''INSERT INTO command_patterns (pattern, rule) VALUES (?, ?)
+    ON CONFLICT (pattern) DO UPDATE SET rule = excluded.rule'''
+    db.execute(rule_sql, (pattern, rule))
+
+def get_command_patterns(db: sqlite3.Connection) -> List[CommandPattern]:
+    cursor = db.cursor()
+    cursor.row_factory = lambda cursor, row: CommandPattern(*row)
+    cursor.execute('''SELECT pattern, runs, writes, clean_streak, rule FROM command_patterns ORDER BY pattern''')
+    return cursor.fetchall()
+
+LEGACY_TABLES = ("processes", "opened_files", "executed_files")
+
+MIGRATE_V1_SQL = [
+    '''INSERT OR IGNORE INTO syscalls (name)
+    SELECT syscall FROM processes_v1 UNION SELECT syscall FROM opened_files_v1 UNION SELECT syscall FROM executed_files_v1''',
+    '''INSERT OR IGNORE INTO paths (path)
+    SELECT filename FROM opened_files_v1 UNION SELECT filename FROM executed_files_v1 UNION SELECT workingdir FROM executed_files_v1''',
+    '''INSERT OR IGNORE INTO blobs (hash, content)
+    SELECT content_hash(argv), argv FROM executed_files_v1 UNION SELECT content_hash(envp), envp FROM executed_files_v1''',
+    '''INSERT INTO processes (id, pid, commit_hash, parent_pid, child_pid, timestamp, syscall)
+    SELECT p.id, p.pid, p.commit_hash, p.parent_pid, p.child_pid, p.timestamp, s.id FROM processes_v1 p
+    JOIN syscalls s ON s.name = p.syscall''',
+    '''INSERT INTO opened_files (id, commit_hash, path_id, timestamp, mode, is_directory, pid, syscall, open_flag)
+    SELECT o.id, o.commit_hash, p.id, o.timestamp, o.mode, o.is_directory, o.pid, s.id, open_flags(o.open_flag) FROM opened_files_v1 o
+    JOIN paths p ON p.path = o.filename JOIN syscalls s ON s.name = o.syscall''',
+    '''INSERT INTO executed_files (id, path_id, commit_hash, timestamp, pid, argv_id, envp_id, workingdir_id, syscall)
+    SELECT e.id, f.id, e.commit_hash, e.timestamp, e.pid, a.id, v.id, w.id, s.id FROM executed_files_v1 e
+    JOIN paths f ON f.path = e.filename JOIN paths w ON w.path = e.workingdir
+    JOIN blobs a ON a.hash = content_hash(e.argv) JOIN blobs v ON v.hash = content_hash(e.envp)
+    JOIN syscalls s ON s.name = e.syscall''',
+]
+
+# databases older than this stored paths as strace printed them instead of relative to the repository
+NORMALIZED_PATHS_VERSION = 7
+
+def normalize_stored_paths(root: str, db: sqlite3.Connection) -> int:
+    '''
+    Rewrites paths stored as strace printed them the way the ingester stores them now: relative to root, the
+    directory the traces were ingested in, when inside it and absolute otherwise. Rows of paths that turn out to
+    be the same are merged. Returns the number of paths rewritten
+    '''
+    merges = []
+    rewritten = 0
+    for path_id, path in db.execute('''SELECT id, path FROM paths''').fetchall():
+        absolute = os.path.normpath(os.path.join(root, path))
+        inside = absolute == root or absolute.startswith(root + os.sep)
+        normalized = os.path.relpath(absolute, root) if inside else absolute
+        if normalized == path:
+            continue
+        rewritten += 1
+        existing = db.execute('''SELECT id FROM paths WHERE path = ?''', (normalized,)).fetchone()
+        if existing is None:
+            db.execute('''UPDATE paths SET path = ? WHERE id = ?''', (normalized, path_id))
+        else:
+            merges.append((path_id, existing[0]))
+    if merges:
+        db.execute('''CREATE TEMP TABLE path_merges (old INTEGER PRIMARY KEY, new INTEGER NOT NULL)''')
+        db.executemany('''INSERT INTO path_merges (old, new) VALUES (?, ?)''', merges)
+        for table, column in (("opened_files", "path_id"), ("executed_files", "path_id"), ("executed_files", "workingdir_id")):
+            db.execute(f'''UPDATE {table} SET {column} = (SELECT new FROM path_merges WHERE old = {column})
+            WHERE {column} IN (SELECT old FROM path_merges)''')
+        db.execute('''DELETE FROM paths WHERE id IN (SELECT old FROM path_merges)''')
+        db.execute('''DROP TABLE path_merges''')
+    return rewritten
+
+def get_schema_version(db: sqlite3.Connection) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def _table_columns(table: str, db: sqlite3.Connection) -> List[str]:
+    return [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+
+def migrate_db(db: sqlite3.Connection) -> bool:
+    '''
+    Brings the database up to the current schema, converting the trace tables of version 1 databases
+    (full paths, syscall names and flag strings on every row) into the normalized tables.
+    Returns True if any trace rows were migrated
+    '''
+    version = get_schema_version(db)
+    # rename the version 1 trace tables out of the way, their indexes would clash with the new ones
+    if "filename" in _table_columns("opened_files", db):
+        with db:
+            for table in LEGACY_TABLES:
+                db.execute(f"DROP INDEX IF EXISTS idx_{table}_git_hash")
+                db.execute(f"ALTER TABLE {table} RENAME TO {table}_v1")
+
+    with open(SCHEMA_PATH, "r") as f:
+        db.executescript(f.read())
+
+    migrated = False
+    if _table_columns("opened_files_v1", db):
+        print("Migrating trace tables to the normalized schema")
+        db.create_function("open_flags", 1, encode_open_flags)
+        db.create_function("content_hash", 1, content_hash)
+        with db:
+            for sql in MIGRATE_V1_SQL:
+                db.execute(sql)
+            for table in LEGACY_TABLES:
+                db.execute(f"DROP TABLE {table}_v1")
+        migrated = True
+
+    # traces were ingested from the directory holding the database
+    database = next(file for _, name, file in db.execute("PRAGMA database_list") if name == "main")
+    if version < NORMALIZED_PATHS_VERSION and database:
+        with db:
+            if normalize_stored_paths(os.path.dirname(database), db):
+                print("Normalized the stored paths relative to the repository")
+                migrated = True
+    # cached plans were built by an older scimon and may not match what this one would plan
+    if version < SCHEMA_VERSION:
+        with db:
+            db.execute('''DELETE FROM reproduce_plans''')
+    return migrated
+
 def initialize_db() -> None:
     '''Initializes the database with proper tables in the current working directory'''
-    db = get_db()
-    cursor = db.cursor()
-    create_tables_sql="""CREATE TABLE IF NOT EXISTS commands (
-    id INTEGER NOT NULL PRIMARY KEY, 
-    pre_command_commit TEXT,
-    post_command_commit TEXT,
-    command TEXT,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-CREATE INDEX IF NOT EXISTS idx_commands_pre_commit ON commands(pre_command_commit);
-CREATE INDEX IF NOT EXISTS idx_commands_post_commit on commands(post_command_commit);
-CREATE TABLE IF NOT EXISTS file_changes (
-    id INTEGER NOT NULL PRIMARY KEY,
-    commit_hash TEXT NOT NULL,
-    filename TEXT NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_changes_git_hash on file_changes(commit_hash);
-CREATE TABLE IF NOT EXISTS processes (
-    id INTEGER NOT NULL PRIMARY KEY,
-    pid INTEGER NOT NULL,
-    commit_hash TEXT NOT NULL,
-    parent_pid INTEGER,
-    child_pid INTEGER,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    syscall TEXT NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_processes_git_hash on processes(commit_hash);
-CREATE TABLE IF NOT EXISTS opened_files (
-    id INTEGER NOT NULL PRIMARY KEY,
-    commit_hash TEXT NOT NULL,
-    filename TEXT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    mode INTEGER NOT NULL,
-    is_directory BOOLEAN NOT NULL,
-    pid INTEGER NOT NULL,
-    syscall TEXT NOT NULL,
-    open_flag TEXT NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_opened_files_git_hash on opened_files(commit_hash);
-CREATE TABLE IF NOT EXISTS executed_files (
-    id INTEGER NOT NULL PRIMARY KEY,
-    filename TEXT NOT NULL,
-    commit_hash TEXT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    pid INTEGER NOT NULL,
-    argv TEXT NOT NULL,
-    envp TEXT NOT NULL,
-    workingdir TEXT NOT NULL,
-    syscall TEXT NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_executed_files_git_hash on executed_files(commit_hash);"""
-    cursor.executescript(create_tables_sql)
\ No newline at end of file
+    migrate_db(get_db())
@@ -0,0 +1,80 @@
+import os
+import re
+import sqlite3
+from typing import List, Optional
+from scimon.db import get_command_patterns, record_command_runs, set_command_rule
+from scimon.models import CommandPattern
+
+# clean traced runs in a row after which a pattern runs untraced
+READ_ONLY_MIN_RUNS = 5
+# read by the bash hook of each monitored directory, "+pattern" runs untraced and "-pattern" is always traced
+PROFILE_FILE = os.path.join(".git", "scimon-readonly")
+RULES = ("allow", "deny")
+ASSIGNMENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*=")
+
+
+def command_pattern(command: str) -> str:
+    '''
+    Returns the pattern a command line is learned under, like _scimon_command_pattern in commandhook.sh: the name
+    of the executable followed by its first argument that isn't an option, e.g. "git log" or "python plot.py"
+    '''
+    executable = ""
+    for word in command.split():
+        if not executable:
+            if ASSIGNMENT_RE.match(word):
+                continue
+            executable = os.path.basename(word)
+        elif not word.startswith("-"):
+            return f"{executable} {word}"
+    return executable
+
+
+def read_only_patterns(patterns: List[CommandPattern], min_runs: int = READ_ONLY_MIN_RUNS) -> List[str]:
+    '''
+    Returns the patterns that can run untraced: the allowed ones, and the ones whose last min_runs traced runs
+    all left the tree untouched, unless they or their executable are denied. The hook runs every command of a bare
+    executable untraced once it is in the profile, so only an allow rule puts one there
+    '''
+    rules = {p.pattern: p.rule for p in patterns}
+    return [
+        p.pattern for p in patterns
+        if p.rule == "allow" or (p.rule is None and " " in p.pattern and p.clean_streak >= min_runs
+                                 and rules.get(p.pattern.split(" ")[0]) != "deny")
+    ]
+
+
+def write_profile(db: sqlite3.Connection, path: str = PROFILE_FILE) -> Optional[List[str]]:
+    '''
+    Writes the read-only and denied patterns to the file the bash hook reads, replaced at once so the hook never
+    sees half of it. Returns its lines, or None outside of a git repository
+    '''
+    if not os.path.isdir(os.path.dirname(path)):
+        return None
+    patterns = get_command_patterns(db)
+    lines = [f"+{pattern}" for pattern in read_only_patterns(patterns)]
+    lines += [f"-{p.pattern}" for p in patterns if p.rule == "deny"]
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write("".join(f"{line}\n" for line in lines))
+    os.replace(tmp, path)
+    return lines
+
+
+def learn_command(pattern: str, wrote: bool, db: sqlite3.Connection) -> None:
+    '''Counts a traced run of the pattern and refreshes the hook's profile'''
+    with db:
+        record_command_runs([pattern], wrote, db)
+    write_profile(db)
+
+
+def set_rule(command: str, rule: Optional[str], db: sqlite3.Connection) -> str:
+    '''Allows or denies the pattern of a command line on the fast path, None clearing its rule. Returns the pattern'''
+    if rule is not None and rule not in RULES:
+        raise ValueError(f"Unknown rule {rule}, choose one of {', '.join(RULES)}")
+    pattern = command_pattern(command)
+    if not pattern:
+        raise ValueError("No command given")
+    with db:
+        set_command_rule(pattern, rule, db)
+    write_profile(db)
+    return pattern
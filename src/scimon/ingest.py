@@ -0,0 +1,276 @@
+import os
+import re
+import sqlite3
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from scimon.db import (
+    get_db, insert_processes, insert_opened_files, insert_executed_files, delete_reproduce_plans, delete_provenance_commit,
+    get_schema_version, migrate_db, get_syscall_codes, intern_syscall, intern_path, intern_blob,
+    encode_open_flags, SCHEMA_VERSION
+)
+from scimon.utils import TrackedPaths, get_head_commit, get_tracked_paths, normalize_path
+from scimon.provenance import refresh_provenance
+
+STRACE_LOG_DIR = os.path.expanduser("~/.scimon/strace.log")
+
+# number of rows buffered per table before they are written with executemany
+BATCH_SIZE = 5000
+
+STRACE_LINE_RE = re.compile(r'^([0-9]+) ([a-z0-9_]+)\((.*)\) = ([0-9-]+)')
+LAST_QUOTED_RE = re.compile(r'.*"([^"]+)"')
+FIRST_QUOTED_RE = re.compile(r'"([^"]+)"')
+OPEN_FLAG_RE = re.compile(r'"[^"]+",\s*([^,\)]+)')
+MODE_RE = re.compile(r',\s*([0-7]{3,4})')
+EXECVE_ARGV_RE = re.compile(r'"[^"]+",\s*(\[.*\]),\s*')
+EXECVEAT_ARGV_RE = re.compile(r'[^,]+,\s*"[^"]+",\s*(\[.*\]),\s*')
+ENVP_RE = re.compile(r'(\[.*\]),\s*(.*)')
+TRAILING_COMMENT_RE = re.compile(r'\s*/\*.*\*/\s*$')
+# directory fd passed right before the last quoted path of the *at syscalls, decorated with its path under strace -y
+DIRFD_RE = re.compile(r'(AT_FDCWD|-?\d+)(?:<([^>]*)>)?,\s*"[^"]*"[^"]*$')
+FCHDIR_RE = re.compile(r'^(\d+)(?:<([^>]*)>)?')
+
+PROCESS_SYSCALLS = frozenset({"fork", "clone", "clone3", "vfork"})
+FILE_OPEN_SYSCALLS = frozenset({
+    "open", "openat", "openat2", "creat", "access", "faccessat", "faccessat2",
+    "stat", "lstat", "stat64", "oldstat", "oldlstat", "fstatat64", "newfstatat", "statx",
+    "readlink", "readlinkat", "mkdir", "mkdirat", "chdir", "rename", "renameat", "renameat2",
+    "link", "linkat", "symlink", "symlinkat", "connect", "accept", "accept4", "socketcall"
+})
+FILE_EXECUTE_SYSCALLS = frozenset({"execve", "execveat"})
+# syscalls resolving their path against a directory fd rather than the working directory
+DIRFD_SYSCALLS = frozenset({
+    "openat", "openat2", "faccessat", "faccessat2", "fstatat64", "newfstatat", "statx", "readlinkat", "mkdirat",
+    "renameat", "renameat2", "linkat", "symlinkat", "fchownat", "fchmodat", "execveat"
+})
+# syscalls whose return value is a new file descriptor for the path
+FD_SYSCALLS = frozenset({"open", "openat", "openat2", "creat"})
+
+
+class TraceTarget(NamedTuple):
+    '''A directory and commit to ingest a trace into, with the directory the traced command started in when known'''
+    directory: str
+    commit_hash: str
+    cwd: Optional[str] = None
+
+
+def parse_targets(lines: Iterable[str]) -> List[TraceTarget]:
+    '''Parses the lines of a targets file, each holding a directory, a commit hash and optionally a cwd, tab separated'''
+    return [TraceTarget(*line.rstrip("\n").split("\t", 2)) for line in lines if "\t" in line]
+
+
+class StraceIngester:
+    '''
+    Parses strace lines one at a time and writes the relevant system calls into the
+    processes, opened_files and executed_files tables in batches. Paths are resolved against the working
+    directory and directory fds of the process that used them, and stored relative to workingdir when they
+    lie inside it, absolute otherwise. Processes start in cwd, the directory the traced command was run from,
+    until they change directory
+    '''
+
+    def __init__(self, db: sqlite3.Connection, commit_hash: str, tracked: TrackedPaths,
+                 workingdir: str, batch_size: int = BATCH_SIZE, cwd: Optional[str] = None):
+        self.db = db
+        self.commit_hash = commit_hash
+        self.tracked = tracked
+        self.workingdir = workingdir
+        self.cwd = cwd or workingdir
+        self.batch_size = batch_size
+        # child pid -> pid of the process that spawned it
+        self.parent_pids: Dict[int, int] = {}
+        # working directory and open fds of each pid, inherited by the processes it spawns
+        self.cwds: Dict[int, str] = {}
+        self.fds: Dict[int, Dict[int, str]] = {}
+        self.processes: List[Tuple] = []
+        self.opened_files: List[Tuple] = []
+        self.executed_files: List[Tuple] = []
+        # ids of the syscalls, paths and argv/envp blobs already interned by this ingester
+        self.syscall_codes: Dict[str, int] = get_syscall_codes(db)
+        self.path_ids: Dict[str, int] = {}
+        self.blob_ids: Dict[str, int] = {}
+
+    def syscall_code(self, syscall: str) -> int:
+        code = self.syscall_codes.get(syscall)
+        if code is None:
+            code = self.syscall_codes[syscall] = intern_syscall(syscall, self.db)
+        return code
+
+    def path_id(self, path: str) -> int:
+        path_id = self.path_ids.get(path)
+        if path_id is None:
+            path_id = self.path_ids[path] = intern_path(path, self.db)
+        return path_id
+
+    def blob_id(self, content: str) -> int:
+        blob_id = self.blob_ids.get(content)
+        if blob_id is None:
+            blob_id = self.blob_ids[content] = intern_blob(content, self.db)
+        return blob_id
+
+    def resolve(self, pid: int, syscall: str, args: str, path: str) -> Optional[str]:
+        '''
+        Returns the absolute path a process passed to a syscall, or None when it is relative to a directory fd
+        opened before tracing started
+        '''
+        if os.path.isabs(path):
+            return os.path.normpath(path)
+        base = self.cwds.get(pid, self.cwd)
+        if syscall in DIRFD_SYSCALLS:
+            match = DIRFD_RE.search(args)
+            if match and match.group(2):
+                base = match.group(2)
+            # AT_FDCWD is printed as -100 with -X raw
+            elif match and match.group(1) not in ("AT_FDCWD", "-100"):
+                base = self.fds.get(pid, {}).get(int(match.group(1)))
+                if base is None:
+                    return None
+        return os.path.normpath(os.path.join(base, path))
+
+    def stored_path(self, path: str) -> str:
+        '''Returns how an absolute path is stored: relative to workingdir when inside it, unchanged otherwise'''
+        return normalize_path(path, self.workingdir) or path
+
+    def feed(self, line: str) -> None:
+        '''Parses a single line of strace output'''
+        match = STRACE_LINE_RE.match(line)
+        if not match:
+            return
+        pid, syscall, args, retval = match.groups()
+        if syscall in PROCESS_SYSCALLS:
+            self.handle_process(int(pid), syscall, retval)
+        elif syscall in FILE_OPEN_SYSCALLS:
+            self.handle_file_open(int(pid), syscall, args, int(retval))
+        elif syscall in FILE_EXECUTE_SYSCALLS:
+            self.handle_file_execute(int(pid), syscall, args)
+        elif syscall == "fchdir" and retval == "0":
+            self.handle_fchdir(int(pid), args)
+
+    def handle_process(self, pid: int, syscall: str, retval: str) -> None:
+        child_pid = int(retval)
+        parent_pid = self.parent_pids.get(pid)
+        self.parent_pids[child_pid] = pid
+        if pid in self.cwds:
+            self.cwds[child_pid] = self.cwds[pid]
+        if pid in self.fds:
+            self.fds[child_pid] = dict(self.fds[pid])
+        self.processes.append((pid, self.commit_hash, parent_pid, child_pid, self.syscall_code(syscall)))
+        if len(self.processes) >= self.batch_size:
+            insert_processes(self.processes, self.db)
+            self.processes.clear()
+
+    def handle_fchdir(self, pid: int, args: str) -> None:
+        match = FCHDIR_RE.match(args)
+        if match:
+            directory = match.group(2) or self.fds.get(pid, {}).get(int(match.group(1)))
+            if directory:
+                self.cwds[pid] = directory
+
+    def handle_file_open(self, pid: int, syscall: str, args: str, retval: int = -1) -> None:
+        match = LAST_QUOTED_RE.match(args)
+        if not match:
+            return
+        resolved = self.resolve(pid, syscall, args, match.group(1))
+        if resolved is None:
+            return
+        if retval >= 0:
+            if syscall in FD_SYSCALLS:
+                self.fds.setdefault(pid, {})[retval] = resolved
+            elif syscall == "chdir":
+                self.cwds[pid] = resolved
+        path = normalize_path(resolved, self.workingdir)
+        if path is None or path not in self.tracked:
+            return
+
+        open_flag = 0
+        if syscall in ("open", "openat", "openat2"):
+            flag_match = OPEN_FLAG_RE.search(args)
+            if flag_match:
+                open_flag = encode_open_flags(flag_match.group(1))
+
+        mode = -1
+        mode_match = MODE_RE.search(args)
+        if mode_match:
+            mode = int(mode_match.group(1))
+
+        is_directory = int(path in self.tracked.directories)
+        self.opened_files.append((self.commit_hash, self.path_id(path), mode, is_directory, pid, self.syscall_code(syscall), open_flag))
+        if len(self.opened_files) >= self.batch_size:
+            insert_opened_files(self.opened_files, self.db)
+            self.opened_files.clear()
+
+    def handle_file_execute(self, pid: int, syscall: str, args: str) -> None:
+        match = FIRST_QUOTED_RE.search(args)
+        filename = match.group(1) if match else ""
+        resolved = self.resolve(pid, syscall, args[:match.end()] if match else args, filename) if filename else None
+
+        argv_re = EXECVE_ARGV_RE if syscall == "execve" else EXECVEAT_ARGV_RE
+        argv_match = argv_re.search(args)
+        if not argv_match:
+            print(f"Failed to extract argv from {syscall}: {args}")
+            return
+        argv = argv_match.group(1)
+
+        envp_match = ENVP_RE.search(args)
+        if envp_match:
+            # remove trailing comments from envp
+            envp = TRAILING_COMMENT_RE.sub("", envp_match.group(2))
+        else:
+            print(f"Failed to extract envp from: {args}")
+            envp = "(unknown environment)"
+
+        self.executed_files.append((
+            self.path_id(self.stored_path(resolved) if resolved else filename), self.commit_hash, pid,
+            self.blob_id(argv), self.blob_id(envp), self.path_id(self.stored_path(self.cwds.get(pid, self.cwd))),
+            self.syscall_code(syscall)
+        ))
+        if len(self.executed_files) >= self.batch_size:
+            insert_executed_files(self.executed_files, self.db)
+            self.executed_files.clear()
+
+    def flush(self) -> None:
+        '''Writes all buffered rows into the database'''
+        insert_processes(self.processes, self.db)
+        insert_opened_files(self.opened_files, self.db)
+        insert_executed_files(self.executed_files, self.db)
+        self.processes.clear()
+        self.opened_files.clear()
+        self.executed_files.clear()
+
+
+def feed_lines(lines: Iterable[str], db: sqlite3.Connection, commit_hash: str, tracked: TrackedPaths,
+               workingdir: Optional[str] = None, cwd: Optional[str] = None) -> None:
+    '''
+    Streams strace lines into the database as part of the caller's transaction, invalidating the
+    reproduce plans cached for the commit and its edges in the provenance graph, which the caller refreshes with
+    refresh_provenance once the transaction is committed. cwd is the directory the traced command ran from,
+    workingdir when unknown
+    '''
+    ingester = StraceIngester(db, commit_hash, tracked, workingdir or os.getcwd(), cwd=cwd)
+    delete_reproduce_plans(commit_hash, db)
+    delete_provenance_commit(commit_hash, db)
+    for line in lines:
+        ingester.feed(line)
+    ingester.flush()
+
+
+def ingest_lines(lines: Iterable[str], db: sqlite3.Connection, commit_hash: str, tracked: TrackedPaths,
+                 workingdir: Optional[str] = None, cwd: Optional[str] = None) -> None:
+    '''Streams strace lines into the database within a single transaction, then updates the provenance graph'''
+    with db:
+        feed_lines(lines, db, commit_hash, tracked, workingdir, cwd)
+    refresh_provenance([commit_hash], db)
+
+
+def ingest_strace(log_path: str = STRACE_LOG_DIR, git_hash: Optional[str] = None) -> None:
+    '''
+    Parses the strace log and stores the relevant system calls in the database of the
+    current directory, associated with the given commit hash (HEAD by default)
+    '''
+    print("Parsing strace")
+    if not git_hash:
+        git_hash = get_head_commit()
+    tracked = get_tracked_paths()
+    db = get_db()
+    if get_schema_version(db) < SCHEMA_VERSION:
+        migrate_db(db)
+    with open(log_path, "r", errors="replace") as f:
+        ingest_lines(f, db, git_hash, tracked)
+    print("Strace parsing completed.")
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+
+# every command appends its spans here when the directory exists, the bash hook appends its phases to the same file.
+# An empty SCIMON_METRICS turns both off
+METRICS_FILE = os.environ.get("SCIMON_METRICS", os.path.expanduser("~/.scimon/metrics.prom"))
+# past this size the file is moved to METRICS_FILE.1 before appending
+METRICS_MAX_BYTES = 4 * 1024 ** 2
+# counters shown in the profile and exported as scimon_span_<counter>_total, in this order
+COUNTERS = ("subprocesses", "rows", "nodes", "edges")
+
+F = TypeVar("F", bound=Callable)
+
+
+class SpanStats:
+    '''Calls, inclusive seconds and counters accumulated by every span of one name in this process'''
+    __slots__ = ("calls", "seconds", "counters")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.counters: Dict[str, int] = {}
+
+
+_stats: Dict[str, SpanStats] = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _open_spans() -> List[Dict[str, int]]:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    '''
+    Times the block under the given name. Counters added while it is open count towards it and every span
+    around it in the same thread, so like its time, a span's counters include those of the spans it contains
+    '''
+    counters: Dict[str, int] = {}
+    stack = _open_spans()
+    stack.append(counters)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            stats = _stats.get(name)
+            if stats is None:
+                stats = _stats[name] = SpanStats()
+            stats.calls += 1
+            stats.seconds += elapsed
+            for counter, value in counters.items():
+                stats.counters[counter] = stats.counters.get(counter, 0) + value
+
+
+def timed(func: F) -> F:
+    '''Records every call of the decorated function as a span named after it'''
+    name = func.__qualname__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def count(counter: str, value: int = 1) -> None:
+    '''Adds value to the counter of every span open in the current thread, a no-op outside of spans'''
+    for counters in _open_spans():
+        counters[counter] = counters.get(counter, 0) + value
+
+
+def get_stats() -> Dict[str, SpanStats]:
+    with _lock:
+        return dict(_stats)
+
+
+def reset() -> None:
+    '''Forgets the spans recorded so far'''
+    with _lock:
+        _stats.clear()
+
+
+def format_profile() -> str:
+    '''Returns a table of the spans recorded so far, the slowest first'''
+    stats = sorted(get_stats().items(), key=lambda item: item[1].seconds, reverse=True)
+    width = max([len(name) for name, _ in stats] + [len("span")])
+    lines = [f"{'span':<{width}} {'calls':>7} {'seconds':>9} " + " ".join(f"{c:>12}" for c in COUNTERS)]
+    for name, s in stats:
+        lines.append(f"{name:<{width}} {s.calls:>7} {s.seconds:>9.4f} " +
+                     " ".join(f"{s.counters.get(c, ''):>12}" for c in COUNTERS))
+    return "\n".join(lines)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_metrics(command: str, path: Optional[str] = None) -> bool:
+    '''
+    Appends the spans recorded so far to the metrics file as one OpenMetrics exposition labelled with the command,
+    the file being a log of expositions each ending in # EOF. Returns False without writing when there is nothing
+    to write, metrics are turned off or the file's directory doesn't exist
+    '''
+    path = METRICS_FILE if path is None else path
+    stats = get_stats()
+    if not stats or not path or not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        return False
+
+    timestamp = f"{time.time():.3f}"
+    labels = {name: f'command="{_label(command)}",span="{_label(name)}"' for name in stats}
+    lines = [
+        "# TYPE scimon_span_seconds summary",
+        "# UNIT scimon_span_seconds seconds",
+        "# HELP scimon_span_seconds Time spent in each instrumented span, including the spans it contains.",
+    ]
+    for name, s in stats.items():
+        lines.append(f"scimon_span_seconds_count{{{labels[name]}}} {s.calls} {timestamp}")
+        lines.append(f"scimon_span_seconds_sum{{{labels[name]}}} {s.seconds:.6f} {timestamp}")
+    for counter in COUNTERS:
+        lines.append(f"# TYPE scimon_span_{counter} counter")
+        lines.extend(f"scimon_span_{counter}_total{{{labels[name]}}} {s.counters[counter]} {timestamp}"
+                     for name, s in stats.items() if counter in s.counters)
+    lines.append("# EOF")
+
+    try:
+        if os.path.exists(path) and os.path.getsize(path) > METRICS_MAX_BYTES:
+            os.replace(path, path + ".1")
+        # a single append, so expositions written by concurrent commands don't interleave
+        with open(path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+    except OSError as e:
+        print(f"Could not write metrics to {path}: {e}")
+        return False
+    return True
@@ -1,11 +1,17 @@
-from typing import Optional, Set, Dict, NamedTuple
-import graphviz
+from typing import Optional, Set, Dict, List, NamedTuple, Tuple, Iterable, Iterator
+from array import array
+import sys
+from scimon.metrics import timed
 
 class Node:
+    __slots__ = ("git_hash",)
+
     def __init__(self, git_hash: str):
         self.git_hash = git_hash
 
 class Process(Node):
+    __slots__ = ("pid",)
+
     def __init__(self, git_hash: str, pid: int):
         super().__init__(git_hash)
         self.pid = pid
@@ -16,6 +22,8 @@ class Process(Node):
         return hash((self.git_hash, self.pid))
 
 class File(Node):
+    __slots__ = ("filename",)
+
     def __init__(self, git_hash: str, filename: str):
         super().__init__(git_hash)
         self.filename = filename
@@ -27,10 +35,12 @@ class File(Node):
         return hash((self.git_hash, self.filename))
     
 class Edge:
+    __slots__ = ("in_node", "out_node", "syscall")
+
     def __init__(self, in_node: Node, out_node: Node, syscall: str):
         self.in_node = in_node
         self.out_node = out_node
-        self.syscall = syscall
+        self.syscall = sys.intern(syscall)
     
     def __eq__(self, other):
         return isinstance(other, Edge) and self.in_node == other.in_node and self.out_node == other.out_node and self.syscall == other.syscall
@@ -38,35 +48,168 @@ class Edge:
     def __hash__(self):
         return hash((self.in_node, self.out_node, self.syscall))
 
+class CSR(NamedTuple):
+    '''Compressed sparse row adjacency, the neighbours of node i are targets[offsets[i]:offsets[i + 1]]'''
+    offsets: array
+    targets: array
+
+    def neighbours(self, node_id: int) -> array:
+        return self.targets[self.offsets[node_id]:self.offsets[node_id + 1]]
+
+def build_csr(sources: array, targets: array, node_count: int) -> CSR:
+    '''Builds the CSR adjacency of the edges sources[i] -> targets[i] with a counting sort'''
+    offsets = array('q', bytes(8 * (node_count + 1)))
+    for s in sources:
+        offsets[s + 1] += 1
+    for i in range(node_count):
+        offsets[i + 1] += offsets[i]
+    ordered = array('i', bytes(4 * len(targets)))
+    cursor = offsets[:-1]
+    for s, t in zip(sources, targets):
+        ordered[cursor[s]] = t
+        cursor[s] += 1
+    return CSR(offsets, ordered)
+
+class NodeView:
+    '''Read-only set-like view over the nodes of a graph'''
+
+    def __init__(self, graph: "Graph"):
+        self._graph = graph
+
+    def __len__(self) -> int:
+        return len(self._graph._nodes)
+
+    def __iter__(self) -> Iterator[Node]:
+        return iter(self._graph._nodes)
+
+    def __contains__(self, node: Node) -> bool:
+        return node in self._graph._node_ids
+
+class EdgeView:
+    '''Read-only set-like view over the edges of a graph, materializing Edge objects on demand'''
+
+    def __init__(self, graph: "Graph"):
+        self._graph = graph
+
+    def __len__(self) -> int:
+        return len(self._graph._edge_in)
+
+    def __iter__(self) -> Iterator[Edge]:
+        g = self._graph
+        for i, o, s in zip(g._edge_in, g._edge_out, g._edge_syscall):
+            yield Edge(g._nodes[i], g._nodes[o], g._syscalls[s])
+
+    def __contains__(self, edge: Edge) -> bool:
+        g = self._graph
+        in_id, out_id, syscall_id = g._node_ids.get(edge.in_node), g._node_ids.get(edge.out_node), g._syscall_ids.get(edge.syscall)
+        if in_id is None or out_id is None or syscall_id is None:
+            return False
+        return Graph._edge_key(in_id, out_id, syscall_id) in g._edge_keys
+
 class Graph:
+    '''
+    Provenance graph where every distinct node is interned to an integer id and edges are stored
+    as parallel arrays of (in node id, out node id, syscall id), with CSR adjacency built on demand
+    '''
 
-    def __init__(self, nodes: Optional[Set[Node]] = None, edges: Optional[Set[Edge]] = None):
-        self.nodes = set() if not nodes else nodes
-        self.edges = set() if not edges else edges
-        
+    def __init__(self, nodes: Optional[Iterable[Node]] = None, edges: Optional[Iterable[Edge]] = None):
+        self._nodes: List[Node] = []
+        self._node_ids: Dict[Node, int] = {}
+        self._syscalls: List[str] = []
+        self._syscall_ids: Dict[str, int] = {}
+        self._edge_in = array('i')
+        self._edge_out = array('i')
+        self._edge_syscall = array('i')
+        self._edge_keys: Set[int] = set()
+        self._forward: Optional[CSR] = None
+        self._reverse: Optional[CSR] = None
+        for node in nodes or ():
+            self.add_node(node)
+        for edge in edges or ():
+            self.add_edge(edge)
+
+    @property
+    def nodes(self) -> NodeView:
+        return NodeView(self)
+
+    @property
+    def edges(self) -> EdgeView:
+        return EdgeView(self)
+
+    @staticmethod
+    def _edge_key(in_id: int, out_id: int, syscall_id: int) -> int:
+        return (syscall_id << 64) | (in_id << 32) | out_id
+
+    def add_node(self, node: Node) -> int:
+        '''Adds the provided node into the collection of nodes in the graph if it doesn't exist yet, returns its id'''
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            node_id = len(self._nodes)
+            self._nodes.append(node)
+            self._node_ids[node] = node_id
+            self._forward = self._reverse = None
+        return node_id
+
+    def get_node(self, node_id: int) -> Node:
+        return self._nodes[node_id]
+
+    def get_node_id(self, node: Node) -> Optional[int]:
+        return self._node_ids.get(node)
 
-    def add_node(self, node: Node) -> None:
-        '''Adds the provided node into the collection of nodes in the graph, if it already exists then perform update if possible'''
-        if node not in self.nodes:
-            self.nodes.add(node)
-    
     def add_edge(self, edge: Edge) -> None:
         '''
         Adds the provided edge into the collection of edges in the graph
         If one of in-node or out-node is not part of the graph, we add it into the graph as well
         '''
-        
-        self.add_node(edge.in_node)
-        
-        self.add_node(edge.out_node)
-        
-        self.edges.add(edge)
+        self.add_edge_by_id(self.add_node(edge.in_node), self.add_node(edge.out_node), edge.syscall)
+
+    def add_edge_by_id(self, in_id: int, out_id: int, syscall: str) -> None:
+        '''Adds an edge between 2 nodes already in the graph, ignoring duplicates'''
+        syscall_id = self._syscall_ids.get(syscall)
+        if syscall_id is None:
+            syscall_id = len(self._syscalls)
+            self._syscalls.append(sys.intern(syscall))
+            self._syscall_ids[syscall] = syscall_id
+        key = self._edge_key(in_id, out_id, syscall_id)
+        if key in self._edge_keys:
+            return
+        self._edge_keys.add(key)
+        self._edge_in.append(in_id)
+        self._edge_out.append(out_id)
+        self._edge_syscall.append(syscall_id)
+        self._forward = self._reverse = None
+
+    def forward_csr(self) -> CSR:
+        '''Adjacency from the in-node to the out-node of every edge'''
+        if self._forward is None:
+            self._forward = build_csr(self._edge_in, self._edge_out, len(self._nodes))
+        return self._forward
 
+    def reverse_csr(self) -> CSR:
+        '''Adjacency from the out-node to the in-node of every edge'''
+        if self._reverse is None:
+            self._reverse = build_csr(self._edge_out, self._edge_in, len(self._nodes))
+        return self._reverse
 
+    def successors(self, node: Node) -> List[Node]:
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            return []
+        return [self._nodes[i] for i in self.forward_csr().neighbours(node_id)]
+
+    def predecessors(self, node: Node) -> List[Node]:
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            return []
+        return [self._nodes[i] for i in self.reverse_csr().neighbours(node_id)]
+
+    @timed
     def render(self, output_name="prov"):
         '''
         Generates a DOT graph visualization.
         '''
+        # imported here, graphviz is only needed to render and costs every other command its import time
+        import graphviz
         dot = graphviz.Digraph(
             format='png', 
             graph_attr={
@@ -124,16 +267,18 @@ class Graph:
         dot.render(output_name, format='png', cleanup=True)
         
 
+    @timed
     def get_adj_list(self) -> Dict:
         '''
         Returns an adjacency list with all the edges reversed
         '''
+        csr = self.forward_csr()
+        offsets, targets, nodes = csr.offsets, csr.targets, self._nodes
         res = {}
-        for e in self.edges:
-            if e.in_node in res:
-                res[e.in_node].append(e.out_node)
-            else:
-                res[e.in_node] = [e.out_node]
+        for node_id, node in enumerate(nodes):
+            start, end = offsets[node_id], offsets[node_id + 1]
+            if start != end:
+                res[node] = [nodes[i] for i in targets[start:end]]
         return res
     
 class ProcessTrace(NamedTuple):
@@ -147,7 +292,7 @@ class FileOpenTrace(NamedTuple):
     filename: str
     syscall: str
     mode: int
-    open_flag: str
+    open_flag: int
 
 class FileExecutionTrace(NamedTuple):
     pid: int
@@ -155,3 +300,29 @@ class FileExecutionTrace(NamedTuple):
     syscall:str
 
 
+
+
+class ReproducePlan(NamedTuple):
+    prerequisites: List[Tuple[str, str]]
+    recipe: str
+
+class MakeRule(NamedTuple):
+    target: str
+    git_hash: str
+    prerequisites: List[str]
+    recipe: str
+
+class ProvenanceEdge(NamedTuple):
+    '''filename at commit_hash was written by a command that read input_filename at input_commit'''
+    commit_hash: str
+    filename: str
+    input_commit: str
+    input_filename: str
+
+class CommandPattern(NamedTuple):
+    '''Traced runs of a command pattern in one directory, how many changed the tree, and its fast path rule'''
+    pattern: str
+    runs: int
+    writes: int
+    clean_streak: int
+    rule: Optional[str]
@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import subprocess
+from typing import Dict, Iterable, List, Set
+from scimon.db import (
+    get_processes_trace, get_file_accesses, insert_provenance_edges, delete_provenance_edges, insert_provenance_commit,
+    get_commands_missing_provenance, get_provenance_lineage, WRITE_OPEN_FLAGS
+)
+from scimon.models import ProvenanceEdge
+from scimon.utils import get_latest_commits_for_files
+
+
+def commit_provenance(commit_hash: str, db: sqlite3.Connection) -> List[ProvenanceEdge]:
+    '''
+    Returns the edges from every file written at the given commit hash to the versions of the files read or executed
+    by its writers and the processes they spawned. Inputs resolve to the last commit changing them up to commit_hash,
+    like the prerequisites of a reproduce plan, with a single walk of the history for the whole commit
+    '''
+    children: Dict[int, Set[int]] = {}
+    for trace in get_processes_trace(commit_hash, db):
+        children.setdefault(trace.pid, set()).add(trace.child_pid)
+        if trace.parent_pid:
+            children.setdefault(trace.parent_pid, set()).add(trace.pid)
+
+    reads: Dict[int, Set[str]] = {}
+    writers: Dict[str, Set[int]] = {}
+    for pid, filename, open_flag in get_file_accesses(commit_hash, db):
+        # paths outside the repository are stored absolute
+        if os.path.isabs(filename) or filename == ".":
+            continue
+        if open_flag & WRITE_OPEN_FLAGS:
+            writers.setdefault(filename, set()).add(pid)
+        else:
+            reads.setdefault(pid, set()).add(filename)
+
+    # files read by a process and everything it spawned, shared by all the files it wrote
+    upstream: Dict[int, Set[str]] = {}
+    def upstream_reads(pid: int) -> Set[str]:
+        if pid not in upstream:
+            files, stack, seen = set(), [pid], {pid}
+            while stack:
+                current = stack.pop()
+                files |= reads.get(current, set())
+                for child in children.get(current, ()):
+                    if child not in seen:
+                        seen.add(child)
+                        stack.append(child)
+            upstream[pid] = files
+        return upstream[pid]
+
+    inputs = {filename: set().union(*(upstream_reads(pid) for pid in pids)) for filename, pids in writers.items()}
+    versions = get_latest_commits_for_files(sorted(set().union(*inputs.values())), commit_hash)
+    return [
+        ProvenanceEdge(commit_hash, filename, versions[input_filename], input_filename)
+        for filename, input_filenames in inputs.items()
+        for input_filename in sorted(input_filenames)
+        # untracked inputs have no version, and a file read back after being written is not its own input
+        if input_filename in versions and (input_filename, versions[input_filename]) != (filename, commit_hash)
+    ]
+
+
+def write_provenance(commit_hash: str, edges: List[ProvenanceEdge], db: sqlite3.Connection) -> None:
+    '''
+    Replaces the provenance edges of the commit and marks it as part of the graph, as part of the caller's
+    transaction. Only this commit is touched, the rest of the graph stays as it is
+    '''
+    delete_provenance_edges(commit_hash, db)
+    insert_provenance_edges(edges, db)
+    insert_provenance_commit(commit_hash, db)
+
+
+def update_provenance(commit_hash: str, db: sqlite3.Connection) -> int:
+    '''
+    Recomputes the provenance edges of the commit from its committed traces. The input versions are resolved with
+    git before the transaction writing the edges starts, so git never runs while the database is locked.
+    Returns the number of edges
+    '''
+    edges = commit_provenance(commit_hash, db)
+    with db:
+        write_provenance(commit_hash, edges, db)
+    return len(edges)
+
+
+def refresh_provenance(commit_hashes: Iterable[str], db: sqlite3.Connection) -> None:
+    '''
+    Updates the provenance edges of each commit once its traces are committed. A commit whose update fails stays
+    missing from the graph, for the next backfill to retry
+    '''
+    for commit_hash in dict.fromkeys(commit_hashes):
+        try:
+            update_provenance(commit_hash, db)
+        except subprocess.CalledProcessError as e:
+            print(f"Could not add {commit_hash} to the provenance graph: {e.stderr or e}")
+
+
+def backfill_provenance(db: sqlite3.Connection) -> int:
+    '''Adds the commands recorded before the provenance graph existed, or whose update failed, returns how many'''
+    missing = get_commands_missing_provenance(db)
+    if missing:
+        print(f"Adding {len(missing)} commits to the provenance graph")
+    refresh_provenance(missing, db)
+    return len(missing)
+
+
+def get_lineage(filename: str, git_hash: str, db: sqlite3.Connection, downstream: bool = False) -> List[ProvenanceEdge]:
+    '''
+    Returns the provenance edges the file at the given version was derived from, going back through every recorded
+    commit, or the edges derived from it when downstream is True. A version that didn't change the file refers to
+    the last commit before it that did
+    '''
+    backfill_provenance(db)
+    version = get_latest_commits_for_files([filename], git_hash).get(filename)
+    if version is None:
+        raise ValueError(f"No commit up to {git_hash} changed {filename}")
+    return get_provenance_lineage(filename, version, db, downstream)
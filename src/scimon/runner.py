@@ -0,0 +1,122 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, NamedTuple, Optional, Set
+from scimon.models import MakeRule
+from scimon.cache import BuildCache
+from scimon.utils import get_changed_files
+
+# git restore takes the index lock even when it only writes the working tree, so restores run one at a time
+GIT_RESTORE_PREFIX = "git restore"
+# recipes that check a recorded version out rather than run a command, there is nothing to cache for them
+RESTORE_PREFIXES = (GIT_RESTORE_PREFIX, "scimon materialize")
+
+
+class RunResult(NamedTuple):
+    '''Outcome of running a reproduction plan, each list holds the rules in plan order'''
+    succeeded: List[MakeRule]
+    failed: List[MakeRule]
+    cancelled: List[MakeRule]
+    # the succeeded rules whose outputs were restored from the build cache instead of running the recipe
+    cached: List[MakeRule]
+
+
+def rule_dependencies(rules: List[MakeRule]) -> List[Set[int]]:
+    '''
+    Returns the indices of the rules each rule has to wait for. Rules are in dependency order, so a prerequisite
+    is built by the closest rule before it with that target. Rules writing the same target also run in plan order
+    '''
+    latest: Dict[str, int] = {}
+    dependencies = []
+    for i, rule in enumerate(rules):
+        deps = {latest[p] for p in rule.prerequisites if p in latest}
+        if rule.target in latest:
+            deps.add(latest[rule.target])
+        dependencies.append(deps)
+        latest[rule.target] = i
+    return dependencies
+
+
+def run_rules(rules: List[MakeRule], jobs: int = os.cpu_count() or 1, cache: Optional[BuildCache] = None) -> RunResult:
+    '''
+    Runs the recipes of the rules on up to jobs workers, starting each one as soon as the rules it depends on
+    have succeeded. A failed recipe cancels every rule depending on it while independent branches keep running.
+    With a cache, recipes already run on byte-identical prerequisites restore their recorded outputs instead
+    '''
+    dependencies = rule_dependencies(rules)
+    dependents: List[List[int]] = [[] for _ in rules]
+    for i, deps in enumerate(dependencies):
+        for d in deps:
+            dependents[d].append(i)
+    waiting = [len(deps) for deps in dependencies]
+    status: Dict[int, str] = {}
+    git_lock = threading.Lock()
+    cached = set()
+    start = time.perf_counter()
+
+    def execute(i: int) -> subprocess.CompletedProcess:
+        rule = rules[i]
+        if rule.recipe.startswith(GIT_RESTORE_PREFIX):
+            with git_lock:
+                return subprocess.run(rule.recipe, shell=True, capture_output=True, text=True)
+        if cache is None or rule.recipe.startswith(RESTORE_PREFIXES):
+            return subprocess.run(rule.recipe, shell=True, capture_output=True, text=True)
+
+        # prerequisites are in place by now, so the key covers the exact bytes the recipe reads
+        try:
+            key = cache.key(rule.recipe, rule.prerequisites)
+            if cache.restore(key) is not None:
+                cached.add(i)
+                return subprocess.CompletedProcess(rule.recipe, 0, "", "")
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Build cache lookup failed for {rule.target}, running the recipe: {e}")
+            key = None
+        result = subprocess.run(rule.recipe, shell=True, capture_output=True, text=True)
+        if result.returncode == 0 and key is not None:
+            try:
+                # the outputs are the files the command changed when it was recorded
+                cache.store(key, get_changed_files(rule.git_hash))
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Could not cache the outputs of {rule.target}: {e}")
+        return result
+
+    def cancel(i: int) -> None:
+        stack = list(dependents[i])
+        while stack:
+            j = stack.pop()
+            if j not in status:
+                status[j] = "cancelled"
+                print(f"Cancelled {rules[j].target} ({rules[j].git_hash[:7]}), {rules[i].target} failed")
+                stack.extend(dependents[j])
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        running = {}
+        ready = [i for i, count in enumerate(waiting) if count == 0]
+        while ready or running:
+            for i in ready:
+                running[pool.submit(execute, i)] = i
+            ready = []
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                rule = rules[i]
+                result = future.result()
+                elapsed = time.perf_counter() - start
+                if result.returncode != 0:
+                    status[i] = "failed"
+                    print(f"[{len(status)}/{len(rules)}] {elapsed:.1f}s failed {rule.target} ({rule.git_hash[:7]}): {rule.recipe}")
+                    print(result.stdout + result.stderr, end="")
+                    cancel(i)
+                    continue
+                status[i] = "succeeded"
+                action = "restored from cache" if i in cached else "built"
+                print(f"[{len(status)}/{len(rules)}] {elapsed:.1f}s {action} {rule.target} ({rule.git_hash[:7]})")
+                for j in dependents[i]:
+                    waiting[j] -= 1
+                    if waiting[j] == 0 and j not in status:
+                        ready.append(j)
+
+    by_status = {s: [rules[i] for i in sorted(status) if status[i] == s] for s in ("succeeded", "failed", "cancelled")}
+    return RunResult(by_status["succeeded"], by_status["failed"], by_status["cancelled"], [rules[i] for i in sorted(cached)])
@@ -0,0 +1,140 @@
+-- Database schema shared by scimon/db.py and commandhook.sh, bump user_version (and db.SCHEMA_VERSION) on every change
+PRAGMA journal_mode=WAL;
+
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER NOT NULL PRIMARY KEY,
+    pre_command_commit TEXT,
+    post_command_commit TEXT,
+    command TEXT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_commands_pre_commit ON commands(pre_command_commit);
+CREATE INDEX IF NOT EXISTS idx_commands_post_commit on commands(post_command_commit);
+CREATE TABLE IF NOT EXISTS file_changes (
+    id INTEGER NOT NULL PRIMARY KEY,
+    commit_hash TEXT NOT NULL,
+    filename TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_changes_git_hash on file_changes(commit_hash);
+
+-- every distinct path (opened files, executables, working directories) is stored once, relative to the
+-- repository when inside it and absolute otherwise
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER NOT NULL PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+-- argv and envp strings, deduplicated by their blake2b digest
+CREATE TABLE IF NOT EXISTS blobs (
+    id INTEGER NOT NULL PRIMARY KEY,
+    hash BLOB NOT NULL UNIQUE,
+    content TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS syscalls (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+INSERT OR IGNORE INTO syscalls (id, name) VALUES
+    (1, 'fork'), (2, 'vfork'), (3, 'clone'), (4, 'clone3'),
+    (5, 'execve'), (6, 'execveat'),
+    (7, 'open'), (8, 'openat'), (9, 'openat2'), (10, 'creat'),
+    (11, 'access'), (12, 'faccessat'), (13, 'faccessat2'),
+    (14, 'stat'), (15, 'lstat'), (16, 'stat64'), (17, 'oldstat'), (18, 'oldlstat'),
+    (19, 'fstatat64'), (20, 'newfstatat'), (21, 'statx'), (22, 'fstat'),
+    (23, 'readlink'), (24, 'readlinkat'), (25, 'mkdir'), (26, 'mkdirat'), (27, 'chdir'),
+    (28, 'rename'), (29, 'renameat'), (30, 'renameat2'),
+    (31, 'link'), (32, 'linkat'), (33, 'symlink'), (34, 'symlinkat'),
+    (35, 'connect'), (36, 'accept'), (37, 'accept4'), (38, 'socketcall'),
+    (39, 'fchownat'), (40, 'fchmodat');
+
+CREATE TABLE IF NOT EXISTS processes (
+    id INTEGER NOT NULL PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    commit_hash TEXT NOT NULL,
+    parent_pid INTEGER,
+    child_pid INTEGER,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    syscall INTEGER NOT NULL REFERENCES syscalls(id)
+);
+CREATE INDEX IF NOT EXISTS idx_processes_git_hash on processes(commit_hash);
+-- lineage queries walk the process tree of one commit in both directions
+CREATE INDEX IF NOT EXISTS idx_processes_pid on processes(commit_hash, pid);
+CREATE INDEX IF NOT EXISTS idx_processes_parent_pid on processes(commit_hash, parent_pid);
+-- open_flag is the bitmask of the O_* flags passed to the syscall
+CREATE TABLE IF NOT EXISTS opened_files (
+    id INTEGER NOT NULL PRIMARY KEY,
+    commit_hash TEXT NOT NULL,
+    path_id INTEGER NOT NULL REFERENCES paths(id),
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    mode INTEGER NOT NULL,
+    is_directory BOOLEAN NOT NULL,
+    pid INTEGER NOT NULL,
+    syscall INTEGER NOT NULL REFERENCES syscalls(id),
+    open_flag INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_opened_files_git_hash on opened_files(commit_hash);
+CREATE INDEX IF NOT EXISTS idx_opened_files_path on opened_files(commit_hash, path_id);
+CREATE INDEX IF NOT EXISTS idx_opened_files_pid on opened_files(commit_hash, pid);
+CREATE TABLE IF NOT EXISTS executed_files (
+    id INTEGER NOT NULL PRIMARY KEY,
+    path_id INTEGER NOT NULL REFERENCES paths(id),
+    commit_hash TEXT NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    pid INTEGER NOT NULL,
+    argv_id INTEGER NOT NULL REFERENCES blobs(id),
+    envp_id INTEGER NOT NULL REFERENCES blobs(id),
+    workingdir_id INTEGER NOT NULL REFERENCES paths(id),
+    syscall INTEGER NOT NULL REFERENCES syscalls(id)
+);
+CREATE INDEX IF NOT EXISTS idx_executed_files_git_hash on executed_files(commit_hash);
+CREATE INDEX IF NOT EXISTS idx_executed_files_pid on executed_files(commit_hash, pid);
+
+CREATE TABLE IF NOT EXISTS commit_graph (
+    commit_hash TEXT NOT NULL PRIMARY KEY,
+    parents TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reproduce_plans (
+    filename TEXT NOT NULL,
+    commit_hash TEXT NOT NULL,
+    prerequisites TEXT NOT NULL,
+    recipe TEXT NOT NULL,
+    PRIMARY KEY (commit_hash, filename)
+);
+-- spool entries already written by the ingestion daemon, so a restart never ingests a trace twice
+CREATE TABLE IF NOT EXISTS ingested_traces (
+    name TEXT NOT NULL PRIMARY KEY,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- files kept in the artifact store instead of git, with the stat they had when they were last hashed
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT NOT NULL PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+
+-- file versions linked across commits: filename at commit_hash was derived from input_filename at input_commit
+CREATE TABLE IF NOT EXISTS provenance_edges (
+    commit_hash TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    input_commit TEXT NOT NULL,
+    input_filename TEXT NOT NULL,
+    PRIMARY KEY (commit_hash, filename, input_filename)
+);
+CREATE INDEX IF NOT EXISTS idx_provenance_edges_input on provenance_edges(input_commit, input_filename);
+-- commits whose traces have been folded into provenance_edges
+CREATE TABLE IF NOT EXISTS provenance_commits (
+    commit_hash TEXT NOT NULL PRIMARY KEY
+);
+-- every traced run of a command pattern ("git log", "python plot.py", or a bare executable like "ls" run without arguments),
+-- whether its latest runs left the tree untouched, and the user's allow/deny rule for the hook's untraced fast path
+CREATE TABLE IF NOT EXISTS command_patterns (
+    pattern TEXT NOT NULL PRIMARY KEY,
+    runs INTEGER NOT NULL DEFAULT 0,
+    writes INTEGER NOT NULL DEFAULT 0,
+    clean_streak INTEGER NOT NULL DEFAULT 0,
+    rule TEXT
+);
+
+PRAGMA user_version=8;
@@ -1,8 +1,14 @@
-from typing import Optional, List, Tuple
-from scimon.models import Graph, Node, Edge, Process, File, ProcessTrace, FileOpenTrace, FileExecutionTrace
-from scimon.db import get_db, get_processes_trace, get_opened_files_trace, get_executed_files_trace, get_command
-from scimon.utils import is_file_tracked_by_git, is_git_hash_on_file, get_latest_commit_for_file, get_closest_ancestor_hash
+from typing import Optional, List, Tuple, Callable, Any, Dict
+from scimon.models import Graph, Node, Process, File, ProcessTrace, FileOpenTrace, FileExecutionTrace, ReproducePlan, MakeRule
+from scimon.db import get_db, get_processes_trace, get_opened_files_trace, get_executed_files_trace, get_lineage_trace, get_command, get_reproduce_plan, insert_reproduce_plan, get_provenance_inputs, WRITE_OPEN_FLAGS, CONNECTION_PRAGMAS
+from scimon.artifacts import restore_recipe
+from scimon.runner import run_rules, RunResult
+from scimon.cache import BuildCache
+from scimon.metrics import timed, count
+from scimon.utils import get_changed_files, get_latest_commits_for_files, is_file_tracked_by_git, is_git_hash_on_file, get_latest_commit_for_file, get_closest_ancestor_hash, get_tracked_paths, normalize_path
+import glob
 import os
+import sqlite3
 from jinja2 import Template
 from pathlib import Path
 
@@ -13,101 +19,116 @@ MAKE_FILE_RULE_TEMPLATE = Template("""
 
 MAKE_FILE_NAME='reproduce.mk'
 
+@timed
 def get_trace_data(git_hash: str, db) -> Tuple[List[ProcessTrace], List[FileOpenTrace], List[FileExecutionTrace]]:
     """Retrieve all trace data for a given git hash."""
     print("Getting trace data")
     processes_trace = get_processes_trace(git_hash, db)
     open_files_trace = get_opened_files_trace(git_hash, db)
     executed_files_trace = get_executed_files_trace(git_hash, db)
+    count("rows", len(processes_trace) + len(open_files_trace) + len(executed_files_trace))
     return processes_trace, open_files_trace, executed_files_trace
 
 
+@timed
+def get_lineage_trace_data(filename: str, git_hash: str, db) -> Tuple[List[ProcessTrace], List[FileOpenTrace], List[FileExecutionTrace]]:
+    """Retrieve only the trace data upstream of a file for a given git hash."""
+    print(f"Getting trace data upstream of {filename}")
+    traces = get_lineage_trace(git_hash, filename, db)
+    count("rows", sum(len(trace) for trace in traces))
+    return traces
+
+
+def node_id_cache(graph: Graph, make_node: Callable[[Any], Node]) -> Callable[[Any], int]:
+    """Returns a lookup from a pid or filename to its interned node id, only allocating a node the first time it is seen."""
+    ids = {}
+
+    def node_id(value) -> int:
+        result = ids.get(value)
+        if result is None:
+            result = ids[value] = graph.add_node(make_node(value))
+        return result
+
+    return node_id
+
+
+def count_graph_growth(graph: Graph, nodes: int, edges: int) -> None:
+    """Adds the nodes and edges created since the graph had the given sizes to the open spans."""
+    count("nodes", len(graph.nodes) - nodes)
+    count("edges", len(graph.edges) - edges)
+
+
+@timed
 def build_process_nodes_and_edges(graph: Graph, processes_trace: List[ProcessTrace], git_hash: str):
     """Build process nodes and their relationships in the graph."""
     print("Building process nodes and edges")
+    nodes, edges = len(graph.nodes), len(graph.edges)
+    process_id = node_id_cache(graph, lambda pid: Process(git_hash=git_hash, pid=pid))
 
     for trace in processes_trace:
 
-       
-        process_node = Process(git_hash=git_hash, pid=trace.pid)
-        child_process_node = Process(git_hash=git_hash, pid=trace.child_pid)
-        
-        child_edge = Edge(process_node, child_process_node, trace.syscall)
-
-        graph.add_node(process_node)
-        graph.add_node(child_process_node)
-        graph.add_edge(child_edge)
+        process_node = process_id(trace.pid)
+        child_process_node = process_id(trace.child_pid)
+        graph.add_edge_by_id(process_node, child_process_node, trace.syscall)
         
         if trace.parent_pid:
-            parent_process_node = Process(git_hash=git_hash, pid=trace.parent_pid)
-            parent_edge = Edge(parent_process_node, process_node, trace.syscall)
-            graph.add_node(parent_process_node)
-            graph.add_edge(parent_edge)
+            parent_process_node = process_id(trace.parent_pid)
+            graph.add_edge_by_id(parent_process_node, process_node, trace.syscall)
+    count_graph_growth(graph, nodes, edges)
 
+@timed
 def build_file_read_write_nodes_and_edges(graph: Graph, file_traces: List[FileOpenTrace], git_hash: str, is_execution: bool = False):
     """Build file nodes and their relationships to processes."""
     print("Building file read write nodes and edges")
+    nodes, edges = len(graph.nodes), len(graph.edges)
+    tracked = get_tracked_paths(git_hash)
+    process_id = node_id_cache(graph, lambda pid: Process(git_hash=git_hash, pid=pid))
+    file_id = node_id_cache(graph, lambda filename: File(git_hash, filename))
     for trace in file_traces:
 
-        # filter files not part of the git repository
-        if not is_file_tracked_by_git(trace.filename):
+        # paths are stored relative to the repository, filter directories and files not part of it
+        if trace.filename not in tracked.files:
             continue
-        if os.path.isdir(trace.filename):
-            continue
-        # normalize filename
-        cwd = Path(os.getcwd())
-        abs_path = Path(trace.filename).resolve()
-        filename = str(abs_path.relative_to(cwd))
-
-        file_node = File(git_hash, filename)
-        # if file with same path already in the graph, fetch that node in the graph
-        # TODO:
-        process_node = Process(git_hash=git_hash, pid=trace.pid)
-        if "O_WRONLY" in trace.open_flag or "O_CREAT" in trace.open_flag or "O_RDWR" in trace.open_flag or "O_TRUNC" in trace.open_flag:
-            process_to_file_edge = Edge(file_node, process_node, trace.syscall)
+
+        file_node = file_id(trace.filename)
+        process_node = process_id(trace.pid)
+        if trace.open_flag & WRITE_OPEN_FLAGS:
+            graph.add_edge_by_id(file_node, process_node, trace.syscall)
         else:
-            process_to_file_edge = Edge(process_node, file_node, trace.syscall)
-        graph.add_node(file_node)
-        graph.add_node(process_node)
-        graph.add_edge(process_to_file_edge)
+            graph.add_edge_by_id(process_node, file_node, trace.syscall)
+    count_graph_growth(graph, nodes, edges)
 
 
+@timed
 def build_file_execution_nodes_and_edges(graph: Graph, file_traces: List[FileExecutionTrace], git_hash: str, is_execution: bool = False):
     """Build file nodes and their relationships to processes."""
     print("Building file execution nodes and edges")
+    nodes, edges = len(graph.nodes), len(graph.edges)
+    tracked = get_tracked_paths(git_hash)
+    process_id = node_id_cache(graph, lambda pid: Process(git_hash=git_hash, pid=pid))
+    file_id = node_id_cache(graph, lambda filename: File(git_hash, filename))
     for trace in file_traces:
-        # filter files not part of the git repository
-        if not is_file_tracked_by_git(trace.filename):
+        # paths are stored relative to the repository, filter directories and files not part of it
+        if trace.filename not in tracked.files:
             continue
-        if os.path.isdir(trace.filename):
-            continue
-        # normalize filename
-        cwd = Path(os.getcwd())
-        abs_path = Path(trace.filename).resolve()
-        filename = str(abs_path.relative_to(cwd))
-
-
-        file_node = File(git_hash, filename)
-        
-        process_node = Process(git_hash=git_hash, pid=trace.pid)
-        process_to_file_edge = Edge(process_node, file_node, trace.syscall)
 
-        graph.add_node(file_node)
-        graph.add_node(process_node)
-        graph.add_edge(process_to_file_edge)
+        graph.add_edge_by_id(process_id(trace.pid), file_id(trace.filename), trace.syscall)
+    count_graph_growth(graph, nodes, edges)
 
 
+@timed
 def generate_graph(filename: str, git_hash: str) -> Graph:
     '''
-    Produce a provenance graph for a given file at a version of the given githash, 
+    Produce the provenance graph upstream of a given file at a version of the given githash, loading only the
+    trace rows reachable backwards from the file rather than everything its commit did
     '''
     # Initialize
     graph = Graph()
-    db = get_db()
+    db = get_db(read_only=True)
     
     print(f"Preparing to generate graph for file {filename} with version {git_hash}")
 
-    processes_trace, open_files_trace, executed_files_trace = get_trace_data(git_hash, db)
+    processes_trace, open_files_trace, executed_files_trace = get_lineage_trace_data(filename, git_hash, db)
 
     build_process_nodes_and_edges(graph, processes_trace, git_hash)
     build_file_read_write_nodes_and_edges(graph, open_files_trace, git_hash)
@@ -140,61 +161,237 @@ def check_file_validity(file: str, git_hash: Optional[str]) -> bool:
         return False
     return True
 
-def reproduce(file: str, git_hash: Optional[str]):
+class PlanningContext:
+    """Graphs, commands and git lookups shared by every target planned in one pass"""
 
-    if not check_file_validity(file, git_hash):
-        return
-    
-    if not git_hash: 
-        git_hash = get_latest_commit_for_file(file)
+    def __init__(self):
+        self.graphs: Dict[Tuple[str, str], Graph] = {}
+        self.commands: Dict[str, str] = {}
+        self.inputs: Dict[str, Dict[str, str]] = {}
+        self.ancestors: Dict[Tuple[str, str], str] = {}
+
+    def graph(self, file: str, git_hash: str) -> Graph:
+        # graphs only hold the lineage of their file, each output of a commit loads its own
+        if (file, git_hash) not in self.graphs:
+            self.graphs[(file, git_hash)] = generate_graph(file, git_hash)
+        return self.graphs[(file, git_hash)]
+
+    def command(self, git_hash: str) -> str:
+        if git_hash not in self.commands:
+            print("Fetching command from database")
+            self.commands[git_hash] = get_command(git_hash, get_db(read_only=True))
+        return self.commands[git_hash]
+
+    def closest_ancestor(self, filename: str, git_hash: str) -> str:
+        # the provenance graph already holds the versions of the files the commit read, git resolves the others
+        if git_hash not in self.inputs:
+            self.inputs[git_hash] = get_provenance_inputs(git_hash, get_db(read_only=True))
+        if filename in self.inputs[git_hash]:
+            return self.inputs[git_hash][filename]
+        if (filename, git_hash) not in self.ancestors:
+            self.ancestors[(filename, git_hash)] = get_closest_ancestor_hash(filename, git_hash)
+        return self.ancestors[(filename, git_hash)]
+
+def plan_reproduction(file: str, git_hash: str, context: Optional[PlanningContext] = None) -> ReproducePlan:
+    """
+    Returns the prerequisite (file, git_hash) pairs and the recipe needed to reproduce the file at the given version.
+    Plans never change for a given commit, so they are cached in the database until the commit's traces are re-ingested
+    """
+    context = context or PlanningContext()
+    db = get_db()
+    plan = get_reproduce_plan(file, git_hash, db)
+    if plan is not None:
+        print(f"Using cached plan for {file} with version {git_hash}")
+        return plan
 
     # generate a file dependency graph containing the current node
-    graph = generate_graph(file, git_hash)
+    graph = context.graph(file, git_hash)
     # traverse up the graph to get parents
     adj = graph.get_adj_list()
 
-    # for k,v in adj.items():
-    #     if isinstance(k, File):
-    #         print(k.filename, ":", end=" ")
-    #     else:
-    #         print(k.pid, ":", end=" ")
-    #     for n in v:
-    #         if isinstance(n, File):
-    #             print(n.filename, end=" ")
-    #         else:
-    #             print(n.pid, end=" ")
-    #     print()
-    
     if File(git_hash, file) not in adj:
         print(f"The current file {file} has no dependencies, directly checking the version {git_hash} out from git...")
-        rule = MAKE_FILE_RULE_TEMPLATE.render(target=file, prerequisites="", recipe=f"git restore --source={git_hash} -- {file}")
-        with open(MAKE_FILE_NAME, 'a') as f:
-            f.write(rule)
-        return
-
-    dependencies = set()
-
-    def dfs(node: Node):
-        if node in adj:
-            for parent in adj[node]:
+        plan = ReproducePlan([], restore_recipe(file, git_hash))
+    else:
+        dependencies = {}
+        seen = set()
+        # walk up through the processes to the files they read, each node's parents visited in order
+        stack = [iter(adj[File(git_hash, file)])]
+        while stack:
+            for parent in stack[-1]:
                 if isinstance(parent, File):
                     if parent.filename not in dependencies:
-                        print(f"Parent file {parent.filename} of {file} located, calling reproduce on it...")
-                        target_hash = get_closest_ancestor_hash(parent.filename, git_hash)
-                        # call reproduce on that version
-                        dependencies.add(parent.filename)
-                        reproduce(parent.filename, target_hash)
-                else:
+                        print(f"Parent file {parent.filename} of {file} located")
+                        dependencies[parent.filename] = context.closest_ancestor(parent.filename, git_hash)
+                elif parent not in seen:
+                    seen.add(parent)
                     print(f"Process {parent.pid} located from traversing the provenance graph, continuing traversing")
-                    dfs(parent)
-        
-    dfs(File(git_hash, file))
-    print("Fetching command from database")
-    command = get_command(git_hash, get_db())
-    # create the make rule
-    rule = MAKE_FILE_RULE_TEMPLATE.render(target=file, prerequisites=" ".join(dependencies), recipe=command)
-    with open(MAKE_FILE_NAME, 'a') as f:
-        f.write(rule)
+                    stack.append(iter(adj.get(parent, ())))
+                    break
+            else:
+                stack.pop()
+        plan = ReproducePlan(list(dependencies.items()), context.command(git_hash))
+
+    # the cache only saves work, so it is skipped rather than waiting for the daemon's ingest transaction
+    db.execute("PRAGMA busy_timeout=0")
+    try:
+        with db:
+            insert_reproduce_plan(file, git_hash, plan, db)
+    except sqlite3.OperationalError as e:
+        print(f"Not caching the plan for {file} with version {git_hash}: {e}")
+    finally:
+        db.execute(f"PRAGMA busy_timeout={CONNECTION_PRAGMAS['busy_timeout']}")
+    return plan
+
+def plan_rules(file: str, git_hash: str) -> List[MakeRule]:
+    """
+    Walks the prerequisites of the file at the given version iteratively and returns one make rule per
+    distinct (file, git_hash) pair, ordered so that every rule comes after the rules of its prerequisites.
+    Prerequisites that would close a cycle are dropped from the rule
+    """
+    return plan_targets([(file, git_hash)])
+
+def plan_targets(targets: List[Tuple[str, str]]) -> List[MakeRule]:
+    """
+    Plans every (file, git_hash) target in one pass, sharing graphs, git lookups and plans between them.
+    Rules needed by several targets are emitted once, after the rules of their prerequisites
+    """
+    context = PlanningContext()
+    done = set()
+    rules = []
+
+    for root in targets:
+        if root in done:
+            continue
+        visiting = {root}
+        plan = plan_reproduction(*root, context)
+        # each entry holds a (file, git_hash) pair, its plan, the prerequisites left to visit and the ones kept in its rule
+        stack = [(root, plan, iter(plan.prerequisites), [])]
+
+        while stack:
+            node, plan, remaining, kept = stack[-1]
+            for prerequisite in remaining:
+                prerequisite = tuple(prerequisite)
+                if prerequisite in visiting:
+                    print(f"Cycle detected between {node[0]} ({node[1]}) and {prerequisite[0]} ({prerequisite[1]}), dropping the dependency")
+                    continue
+                kept.append(prerequisite[0])
+                if prerequisite not in done:
+                    visiting.add(prerequisite)
+                    prerequisite_plan = plan_reproduction(*prerequisite, context)
+                    stack.append((prerequisite, prerequisite_plan, iter(prerequisite_plan.prerequisites), []))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(node)
+                done.add(node)
+                rules.append(MakeRule(node[0], node[1], kept, plan.recipe))
+
+    return rules
+
+def write_makefile(rules: List[MakeRule]) -> bool:
+    """
+    Writes the rules to the Makefile, returns whether it was written. make keeps one rule per target, so nothing
+    is written when the plan needs a file at several versions, run_rules builds those one after the other instead
+    """
+    versions: Dict[str, List[str]] = {}
+    for rule in rules:
+        versions.setdefault(rule.target, []).append(rule.git_hash)
+    conflicts = {target: hashes for target, hashes in versions.items() if len(hashes) > 1}
+    if conflicts:
+        for target, hashes in conflicts.items():
+            print(f"{target} is needed at {len(hashes)} versions: {', '.join(h[:7] for h in hashes)}")
+        print(f"A Makefile holds a single rule per target, not writing {MAKE_FILE_NAME}. `scimon run` reproduces every version in order")
+        return False
+    makefile = "".join(
+        MAKE_FILE_RULE_TEMPLATE.render(target=rule.target, prerequisites=" ".join(rule.prerequisites), recipe=rule.recipe)
+        for rule in rules
+    )
+    with open(MAKE_FILE_NAME, 'w') as f:
+        f.write(makefile)
+    return True
+
+def reproduce(file: str, git_hash: Optional[str]):
+
+    if not check_file_validity(file, git_hash):
+        return
+    
+    if not git_hash: 
+        git_hash = get_latest_commit_for_file(file)
+
+    # create the make rules
+    write_makefile(plan_rules(file, git_hash))
+
+def resolve_targets(patterns: List[str], all_outputs_of: Optional[str] = None) -> List[str]:
+    """
+    Expands the paths and glob patterns (** matches any depth) relative to the working directory, and adds the files
+    changed by the all_outputs_of commit. Returns the files in order, without duplicates
+    """
+    cwd = os.getcwd()
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print(f"No files match {pattern}")
+        files.extend(matches)
+    if all_outputs_of:
+        files.extend(get_changed_files(all_outputs_of))
+    normalized = (normalize_path(f, cwd) for f in files)
+    return list(dict.fromkeys(f for f in normalized if f is not None))
+
+def reproduce_targets(patterns: List[str], git_hash: Optional[str], all_outputs_of: Optional[str] = None) -> List[MakeRule]:
+    """
+    Reproduces several files in one planning pass and writes a single Makefile holding each rule once, returns its
+    rules. Files are checked with one git call each for the tracked paths, the files changed by git_hash and the
+    latest commits
+    """
+    files = resolve_targets(patterns, all_outputs_of)
+    tracked = get_tracked_paths()
+    changed = set(get_changed_files(git_hash)) if git_hash else set()
+    outputs = set(get_changed_files(all_outputs_of)) if all_outputs_of else set()
+
+    targets = []
+    for file in files:
+        if os.path.isdir(file):
+            print(f"{file} is a directory, skipping...")
+        elif file not in tracked.files:
+            print(f"{file} is not being tracked by the git repository")
+        elif file in outputs:
+            targets.append((file, all_outputs_of))
+        elif git_hash and file not in changed:
+            print(f"The provided git commit hash {git_hash} does not have any changes related to the file {file}")
+        else:
+            targets.append((file, git_hash))
+
+    latest = get_latest_commits_for_files([file for file, h in targets if not h])
+    targets = [(file, h or latest[file]) for file, h in targets if h or file in latest]
+    if not targets:
+        print("Nothing to reproduce")
+        return []
+
+    print(f"Planning {len(targets)} targets")
+    rules = plan_targets(targets)
+    if not write_makefile(rules):
+        return []
+    return rules
+
+def run(file: str, git_hash: Optional[str], jobs: int = os.cpu_count() or 1, cache: Optional[BuildCache] = None) -> Optional[RunResult]:
+    """
+    Plans the reproduction of the file at the given version and runs it directly, restores and recipes running
+    concurrently on up to jobs workers wherever the provenance graph allows. Recipes found in the cache are not run
+    """
+    if not check_file_validity(file, git_hash):
+        return None
+
+    if not git_hash:
+        git_hash = get_latest_commit_for_file(file)
+
+    rules = plan_rules(file, git_hash)
+    print(f"Running {len(rules)} rules on {jobs} workers")
+    result = run_rules(rules, jobs, cache)
+    print(f"{len(result.succeeded) - len(result.cached)} built, {len(result.cached)} restored from cache, "
+          f"{len(result.failed)} failed, {len(result.cancelled)} cancelled")
+    return result
 
 def visualize(file: str, git_hash: Optional[str]):
     
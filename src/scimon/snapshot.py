@@ -0,0 +1,84 @@
+import os
+import subprocess
+from typing import List, NamedTuple, Optional, Tuple
+from scimon.utils import run_git
+from scimon.artifacts import stage_artifacts, ARTIFACT_THRESHOLD, ARTIFACT_DIR
+from scimon.db import get_db, get_schema_version, migrate_db, insert_command, insert_file_changes, SCHEMA_VERSION, DB_FILES
+from scimon.fastpath import learn_command
+
+
+class Snapshot(NamedTuple):
+    '''A commit taken of the working tree, with the commit it was taken on top of and the files it changed'''
+    parent: Optional[str]
+    commit: str
+    changed: List[str]
+
+
+def _head() -> Tuple[Optional[str], Optional[str]]:
+    '''Returns the commit HEAD points to and its tree, both None on a branch without commits'''
+    result = subprocess.run(["git", "rev-parse", "HEAD", "HEAD^{tree}"], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, None
+    commit, tree = result.stdout.split()
+    return commit, tree
+
+
+def commit_working_tree(message: str) -> Optional[Snapshot]:
+    '''
+    Commits every change of the working tree with git plumbing (write-tree, commit-tree, update-ref),
+    returns None without committing when the tree matches HEAD. The database files are taken back out of the index,
+    even when they aren't ignored, since open connections keep its -wal and -shm files around until they close
+    '''
+    run_git("add", "-A")
+    run_git("rm", "-r", "-q", "--cached", "--ignore-unmatch", "--", DB_FILES)
+    tree = run_git("write-tree").strip()
+    parent, parent_tree = _head()
+    if tree == parent_tree:
+        return None
+
+    if parent is None:
+        commit = run_git("commit-tree", tree, "-F", "-", input=message).strip()
+        run_git("update-ref", "-m", "commit (initial)", "HEAD", commit)
+        base = ["--root"]
+    else:
+        commit = run_git("commit-tree", tree, "-p", parent, "-F", "-", input=message).strip()
+        # only moves HEAD if nothing else committed in between
+        run_git("update-ref", "-m", "commit", "HEAD", commit, parent)
+        base = [parent]
+
+    # a single diff-tree lists the changed files, NUL separated so any filename survives
+    changes = run_git("diff-tree", "-r", "-z", "--no-commit-id", "--name-only", *base, commit)
+    return Snapshot(parent, commit, [name for name in changes.split("\0") if name])
+
+
+def snapshot(command: str, is_pre_command: bool = False, pending: Optional[str] = None,
+             artifact_threshold: int = ARTIFACT_THRESHOLD, artifact_store: str = ARTIFACT_DIR,
+             pattern: Optional[str] = None, trace_cwd: Optional[str] = None) -> Optional[Snapshot]:
+    '''
+    Commits the changes of the working tree after (or before) a command and records them in one transaction:
+    the command row with its pre and post command commits, unless it is a pre-command snapshot, and a file_changes
+    row per changed file. The directory and new commit are appended to pending, where the bash hook collects
+    the databases the command's trace is ingested into, along with trace_cwd, the directory the traced command
+    ran from. Files of at least artifact_threshold bytes are committed
+    as pointers to the artifact store. The run is counted towards the command's pattern for the hook's read-only
+    fast path when one is given, whether it changed anything or not
+    '''
+    db = get_db()
+    if get_schema_version(db) < SCHEMA_VERSION:
+        migrate_db(db)
+    stage_artifacts(db, artifact_threshold, artifact_store)
+    taken = commit_working_tree(command)
+    if pattern and not is_pre_command:
+        learn_command(pattern, taken is not None, db)
+    if taken is None:
+        return None
+
+    with db:
+        if not is_pre_command:
+            insert_command(taken.parent, taken.commit, command, db)
+        insert_file_changes(((taken.commit, name) for name in taken.changed), db)
+
+    if pending and not is_pre_command:
+        with open(pending, "a") as f:
+            f.write(f"{os.getcwd()}\t{taken.commit}" + (f"\t{trace_cwd}\n" if trace_cwd else "\n"))
+    return taken
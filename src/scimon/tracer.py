@@ -0,0 +1,183 @@
+import os
+import re
+from abc import ABC, abstractmethod
+import shlex
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+TRACER_CONFIG = os.path.expanduser("~/.scimon/.tracers")
+
+# every system call scimon ingests, keep in sync with SCIMON_DEFAULT_TRACER in commandhook.sh
+TRACED_SYSCALLS = (
+    "openat", "openat2", "open", "creat", "access", "faccessat", "faccessat2", "statx", "stat", "lstat", "fstat",
+    "readlink", "readlinkat", "rename", "renameat", "renameat2", "link", "linkat", "symlink", "symlinkat",
+    "mkdir", "mkdirat", "chdir", "fchdir", "execve", "execveat", "fork", "vfork", "clone", "clone3",
+    "connect", "accept", "accept4", "fchownat", "fchmodat"
+)
+# high frequency probes that only tell us a path was looked at, not read or written
+STAT_SYSCALLS = frozenset({"access", "faccessat", "faccessat2", "statx", "stat", "lstat", "fstat", "readlink", "readlinkat"})
+
+# connections only matter for unix sockets, which rarely live in a project
+SOCKET_SYSCALLS = frozenset({"connect", "accept", "accept4"})
+
+STRACE_VERSION_RE = re.compile(r'version\s+([0-9]+)\.([0-9]+)')
+
+
+class TracingProfile(NamedTuple):
+    '''
+    The system calls a tracer records and whether its output is scoped to the monitored directories, in which case
+    the bash hook drops the lines whose paths are all absolute and outside of every monitored directory before they
+    reach the log. Relative paths, working directory changes and lines without paths are always kept
+    '''
+    name: str
+    description: str
+    syscalls: Tuple[str, ...]
+    scoped: bool
+
+
+PROFILES: Dict[str, TracingProfile] = {profile.name: profile for profile in (
+    TracingProfile("full", "every ingested system call on every path (default)", TRACED_SYSCALLS, False),
+    TracingProfile("project", "every ingested system call, only on paths in monitored directories", TRACED_SYSCALLS, True),
+    TracingProfile("io", "opens, executions and processes without the stat family or sockets, only on paths in "
+                   "monitored directories", tuple(s for s in TRACED_SYSCALLS if s not in STAT_SYSCALLS | SOCKET_SYSCALLS), True),
+)}
+DEFAULT_PROFILE = "full"
+
+
+class Tracer(ABC):
+    '''
+    A way of running a command under a system call tracer that writes a log `scimon ingest` can parse
+    '''
+    name = ""
+    executable = ""
+    description = ""
+
+    @abstractmethod
+    def arguments(self, profile: TracingProfile = PROFILES[DEFAULT_PROFILE]) -> List[str]:
+        '''Returns the tracer invocation recording the system calls of the profile, without the log path and the traced command'''
+
+    def command(self, log_path: str, argv: List[str], profile: TracingProfile = PROFILES[DEFAULT_PROFILE]) -> List[str]:
+        '''Returns the full command tracing argv into log_path'''
+        return [*self.arguments(profile), "-o", log_path, "--", *argv]
+
+    def available(self) -> bool:
+        return shutil.which(self.executable) is not None
+
+
+class StraceTracer(Tracer):
+    '''Traces every system call scimon knows about with ptrace, two stops per traced call'''
+    name = "strace"
+    executable = "strace"
+    description = "strace with every ingested system call (default)"
+
+    def arguments(self, profile: TracingProfile = PROFILES[DEFAULT_PROFILE]) -> List[str]:
+        return ["strace", "-f", "-e", "trace=" + ",".join(profile.syscalls)]
+
+
+class SeccompStraceTracer(StraceTracer):
+    '''
+    Lets a seccomp-bpf filter drop untraced system calls in the kernel so only the traced ones stop the process,
+    skips the stat family and failed calls, and prints flags as raw numbers to keep the log small
+    '''
+    name = "strace-seccomp"
+    description = "strace --seccomp-bpf without the stat family, compact output"
+    # --seccomp-bpf needs 5.3, -X raw needs 5.6
+    min_version = (5, 6)
+
+    def arguments(self, profile: TracingProfile = PROFILES[DEFAULT_PROFILE]) -> List[str]:
+        syscalls = [s for s in profile.syscalls if s not in STAT_SYSCALLS]
+        return [
+            "strace", "-f", "--seccomp-bpf", "-qq", "-z", "-X", "raw", "-e", "signal=none",
+            "-e", "trace=" + ",".join(syscalls)
+        ]
+
+    def available(self) -> bool:
+        if not super().available():
+            return False
+        output = subprocess.run([self.executable, "-V"], capture_output=True, text=True).stdout
+        match = STRACE_VERSION_RE.search(output)
+        return bool(match) and (int(match.group(1)), int(match.group(2))) >= self.min_version
+
+
+TRACERS: Dict[str, Tracer] = {tracer.name: tracer for tracer in (StraceTracer(), SeccompStraceTracer())}
+DEFAULT_TRACER = StraceTracer.name
+
+
+def get_tracer(name: str) -> Tracer:
+    if name not in TRACERS:
+        raise ValueError(f"Unknown tracer {name}, choose one of {', '.join(TRACERS)}")
+    return TRACERS[name]
+
+
+def get_profile(name: str) -> TracingProfile:
+    if name not in PROFILES:
+        raise ValueError(f"Unknown tracing profile {name}, choose one of {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+
+def _relative_to_home(directory: str) -> str:
+    # monitored directories are stored relative to HOME, like ~/.scimon/.dirs
+    path = Path(directory).resolve()
+    home = Path(os.path.expanduser("~")).resolve()
+    return str(path.relative_to(home)) if path.is_relative_to(home) else str(path)
+
+
+def _read_tracer_config(config: str) -> List[Tuple[str, ...]]:
+    '''
+    Returns the (directory, tracer, arguments, profile, scoped) entries of the config, entries written before
+    profiles existed use the full profile
+    '''
+    if not os.path.exists(config):
+        return []
+    entries = []
+    with open(config, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t", 4)
+            if len(fields) == 3:
+                fields += [DEFAULT_PROFILE, "0"]
+            if len(fields) == 5:
+                entries.append(tuple(fields))
+    return entries
+
+
+def _closest_entry(directory: str, config: str) -> Optional[Tuple[str, ...]]:
+    # the entry of the directory or its closest configured parent
+    directory = _relative_to_home(directory)
+    best = None
+    for entry in _read_tracer_config(config):
+        configured = entry[0]
+        if directory == configured or directory.startswith(configured + os.sep):
+            if best is None or len(configured) > len(best[0]):
+                best = entry
+    return best
+
+
+def get_tracer_for_dir(directory: str, config: str = TRACER_CONFIG) -> Tracer:
+    '''Returns the tracer configured for the directory or its closest configured parent'''
+    entry = _closest_entry(directory, config)
+    return get_tracer(entry[1] if entry else DEFAULT_TRACER)
+
+
+def get_profile_for_dir(directory: str, config: str = TRACER_CONFIG) -> TracingProfile:
+    '''Returns the tracing profile configured for the directory or its closest configured parent'''
+    entry = _closest_entry(directory, config)
+    return get_profile(entry[3] if entry else DEFAULT_PROFILE)
+
+
+def set_tracer_for_dir(directory: str, name: str, config: str = TRACER_CONFIG, profile: str = DEFAULT_PROFILE) -> None:
+    '''
+    Records the tracer and tracing profile used for commands run in the directory and its subdirectories. The tracer
+    arguments and whether the profile is scoped are stored alongside the names so the bash hook can launch it
+    without starting python
+    '''
+    tracer = get_tracer(name)
+    tracing_profile = get_profile(profile)
+    directory = _relative_to_home(directory)
+    entries = [entry for entry in _read_tracer_config(config) if entry[0] != directory]
+    entries.append((directory, tracer.name, shlex.join(tracer.arguments(tracing_profile)), tracing_profile.name,
+                    str(int(tracing_profile.scoped))))
+    with open(config, "w") as f:
+        for entry in entries:
+            f.write("\t".join(entry) + "\n")
@@ -1,8 +1,108 @@
 import subprocess
 from pathlib import Path
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, NamedTuple, Optional
 import os
+from scimon.commitgraph import get_commit_graph
+from scimon.metrics import timed, count
 
+class TrackedPaths(NamedTuple):
+    '''Snapshot of the paths known to git, relative to the repository root'''
+    files: FrozenSet[str]
+    directories: FrozenSet[str]
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.files or path in self.directories
+
+@timed
+def run_git(*args: str, input: Optional[str] = None) -> str:
+    '''Runs a git command in the current directory and returns its output, raising CalledProcessError if it fails'''
+    count("subprocesses")
+    return subprocess.run(["git", *args], input=input, capture_output=True, text=True, check=True).stdout
+
+@timed
+def get_head_commit() -> str:
+    '''Returns the commit hash that HEAD currently points to'''
+    count("subprocesses")
+    return subprocess.check_output(
+        ["git", "rev-parse", "HEAD"],
+        text=True
+    ).strip()
+
+@timed
+def get_tracked_paths(git_hash: Optional[str] = None) -> TrackedPaths:
+    '''
+    Returns every file tracked by git along with the directories containing them, listed with a
+    single git call. Uses the tree of the given commit if provided, otherwise the current index
+    '''
+    if git_hash:
+        return _get_tracked_paths_at_commit(git_hash)
+    return _list_tracked_paths(["git", "ls-files", "-z"])
+
+@lru_cache(maxsize=32)
+def _get_tracked_paths_at_commit(git_hash: str) -> TrackedPaths:
+    # commits are immutable, so the snapshot can be shared by every lookup on the same hash
+    return _list_tracked_paths(["git", "ls-tree", "-r", "-z", "--name-only", git_hash])
+
+def _list_tracked_paths(cmd: List[str]) -> TrackedPaths:
+    count("subprocesses")
+    output = subprocess.run(
+        cmd,
+        capture_output=True,
+        check=True
+    ).stdout
+    files = frozenset(os.fsdecode(f) for f in output.split(b"\0") if f)
+    directories = {"."} if files else set()
+    for f in files:
+        parent = os.path.dirname(f)
+        while parent and parent not in directories:
+            directories.add(parent)
+            parent = os.path.dirname(parent)
+    return TrackedPaths(files, frozenset(directories))
+
+@timed
+def get_changed_files(git_hash: str) -> List[str]:
+    '''Returns the files changed by the given commit, relative to the repository root'''
+    return [f for f in run_git("diff-tree", "-r", "-z", "--no-commit-id", "--name-only", "--root", git_hash).split("\0") if f]
+
+@timed
+def get_latest_commits_for_files(filenames: List[str], revision: Optional[str] = None) -> Dict[str, str]:
+    '''
+    Returns the last commit changing each of the files, found in a single walk of the history of revision (HEAD by
+    default). Files no commit in that history changed are left out
+    '''
+    latest: Dict[str, str] = {}
+    pending = set(filenames)
+    if not pending:
+        return latest
+    output = run_git("log", "--format=%x00%H", "--name-only", "-z", *([revision] if revision else []), "--", *filenames)
+    git_hash = None
+    for field in output.split("\0"):
+        field = field.strip("\n")
+        if len(field) == 40 and all(c in "0123456789abcdef" for c in field) and field not in pending:
+            git_hash = field
+        elif field in pending:
+            latest[field] = git_hash
+            pending.discard(field)
+            if not pending:
+                break
+    return latest
+
+def normalize_path(filename: str, root: str) -> Optional[str]:
+    '''
+    Returns the path of filename relative to the absolute directory root without touching the filesystem,
+    or None if it lies outside of root
+    '''
+    path = os.path.normpath(os.path.join(root, filename))
+    if path == root:
+        return "."
+    if not path.startswith(root + os.sep):
+        return None
+    return path[len(root) + 1:]
+
+@timed
 def get_latest_commit_for_file(filename: str) -> str:
+    count("subprocesses")
     try:
         git_hash = subprocess.check_output(
             ["git", "log", "-n", "1", "--pretty=format:%H", "--", filename],
@@ -16,7 +116,9 @@ def get_latest_commit_for_file(filename: str) -> str:
             raise
         raise ValueError(f"Error retrieving git history for {filename}")
 
+@timed
 def is_file_tracked_by_git(filename: str) -> bool:
+    count("subprocesses")
     try:
         result = subprocess.run(
             ["git", "ls-files", "--error-unmatch", filename],
@@ -26,9 +128,11 @@ def is_file_tracked_by_git(filename: str) -> bool:
         return False
     return True
 
+@timed
 def is_git_hash_on_file(filename: str, git_hash: str) -> bool:
     if not git_hash: return True
 
+    count("subprocesses")
     change_list = subprocess.run(
         ["git", "log", "--pretty=format:%H", "--", filename],
         capture_output=True,
@@ -39,10 +143,12 @@ def is_git_hash_on_file(filename: str, git_hash: str) -> bool:
     return git_hash in change_list
     
 
+@timed
 def is_ancestor(commit1: str, commit2: str) -> bool:
     '''
     Given an 2 commits, return True if commit1 is an ancestor of commit2 else False
     '''
+    count("subprocesses")
     try:
         result = subprocess.run(
             ["git", "merge-base", "--is-ancestor", commit1, commit2],
@@ -58,23 +164,32 @@ def is_ancestor(commit1: str, commit2: str) -> bool:
 
 
 
+@timed
 def get_closest_ancestor_hash(filename: str, git_hash: str) -> str:
     '''
     Given a filename and git_hash, return the hash that last changed the file which is right before the provided hash
     '''
     print(f"Locating closest commit for {filename} that is right before the commit {git_hash}")
     # get a list of git-hashes that changed the supplied file
+    count("subprocesses")
     change_list = subprocess.run(
         ["git", "log", "--pretty=format:%H", "--", filename],
         capture_output=True,
         text=True,
         check=True
     ).stdout.splitlines()
+
+    # answer ancestry checks from the commit graph index when it knows the commit
+    commit_graph = get_commit_graph()
+    if git_hash in commit_graph:
+        ancestor_check = commit_graph.is_ancestor
+    else:
+        ancestor_check = is_ancestor
     
     # loop through the hashes
     for i in range(len(change_list)):
         # if current hash is before the specified git_hash and the previous one wasn't, then return it
-        if is_ancestor(change_list[i], git_hash):
+        if ancestor_check(change_list[i], git_hash):
             return change_list[i]
     raise ValueError("Provided git_hash is invalid")
 
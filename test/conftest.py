@@ -0,0 +1,57 @@
+import pytest
+import subprocess
+from scimon.db import close_db, DB_FILES
+
+
+def git(*args, cwd):
+    return subprocess.run(
+        ["git", "-c", "user.name=scimon", "-c", "user.email=scimon@example.com", *args],
+        cwd=cwd, capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def init_repo(path):
+    """Creates a git repository at path ignoring the database the way `scimon init` does, without committing."""
+    git("init", "-q", "-b", "main", cwd=path)
+    with open(path / ".gitignore", "a") as f:
+        f.write(f"{DB_FILES}\n")
+    return path
+
+
+@pytest.fixture
+def identity(monkeypatch):
+    for var, value in (("NAME", "scimon"), ("EMAIL", "scimon@example.com")):
+        monkeypatch.setenv(f"GIT_AUTHOR_{var}", value)
+        monkeypatch.setenv(f"GIT_COMMITTER_{var}", value)
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch, identity):
+    """A repository holding script.py in its first commit, and the working directory of the test."""
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    init_repo(repo)
+    (repo / "script.py").write_text("print(1)\n")
+    git("add", "-A", cwd=repo)
+    git("commit", "-q", "-m", "init", cwd=repo)
+    monkeypatch.chdir(repo)
+    yield repo
+    close_db()
+
+
+@pytest.fixture
+def initialized(tmp_path, monkeypatch, identity):
+    """A directory set up by `scimon init` alone, with whatever .gitignore it writes."""
+    from typer.testing import CliRunner
+    from scimon import cli
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / ".scimon").mkdir()
+    (tmp_path / ".scimon" / ".dirs").touch()
+    monkeypatch.setattr(cli, "MONITORED_DIR", str(tmp_path / ".scimon" / ".dirs"))
+    repo = tmp_path / "project"
+    repo.mkdir()
+    (repo / "script.py").write_text("print(1)\n")
+    monkeypatch.chdir(repo)
+    assert CliRunner().invoke(cli.app, ["init"]).exit_code == 0
+    yield repo
+    close_db()
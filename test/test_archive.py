@@ -0,0 +1,77 @@
+import gzip
+import os
+import pytest
+from conftest import git
+from scimon import archive
+from scimon.db import get_db, initialize_db, get_opened_files_trace
+from scimon.ingest import ingest_lines, TraceTarget
+from scimon.utils import get_tracked_paths
+
+DAY = 86400
+
+
+def archived(directory, name, lines, targets=()):
+    log, targets_path = directory / f"{name}.log", directory / f"{name}.targets"
+    log.write_text("".join(line + "\n" for line in lines))
+    targets_path.write_text("".join(f"{d}\t{c}\n" for d, c in targets))
+    return archive.archive_trace(name, str(log), str(targets_path), str(directory / "archive"))
+
+
+class TestArchive:
+
+    def test_archive_trace_round_trip(self, tmp_path):
+        """Test that archived traces are compressed and streamed back line by line."""
+        path = archived(tmp_path, "1000000000-abc", ["1 fork() = 2"], [("/repo", "abc123")])
+
+        assert not (tmp_path / "1000000000-abc.log").exists()
+        with gzip.open(path, "rt") as f:
+            assert f.read() == "1 fork() = 2\n"
+        [trace] = archive.list_archive(str(tmp_path / "archive"))
+        assert trace.timestamp == 1.0
+        assert trace.targets == [TraceTarget("/repo", "abc123")]
+        assert list(archive.read_archived_trace(trace)) == ["1 fork() = 2\n"]
+
+    def test_rotate_by_age_and_size(self, tmp_path):
+        """Test that rotation drops traces past the age limit, then the oldest until the size limit is met."""
+        now = 100 * DAY
+        for day in (1, 95, 98, 99):
+            archived(tmp_path, f"{day * DAY * 10 ** 9}-abc", ["x" * 100])
+        directory = str(tmp_path / "archive")
+        sizes = [os.path.getsize(trace.path) for trace in archive.list_archive(directory)]
+
+        assert archive.rotate_archive(directory, max_bytes=sum(sizes), max_age_days=30, now=now) == [f"{DAY * 10 ** 9}-abc"]
+        assert archive.rotate_archive(directory, max_bytes=sum(sizes[2:]), max_age_days=30, now=now) == [f"{95 * DAY * 10 ** 9}-abc"]
+        assert [t.name for t in archive.list_archive(directory)] == [f"{98 * DAY * 10 ** 9}-abc", f"{99 * DAY * 10 ** 9}-abc"]
+        assert len(os.listdir(directory)) == 4
+
+    def test_parse_since(self):
+        """Test relative ages and ISO dates."""
+        assert archive.parse_since("12h", now=DAY) == DAY - 12 * 3600
+        assert archive.parse_since("2d", now=3 * DAY) == DAY
+        with pytest.raises(ValueError):
+            archive.parse_since("yesterday")
+
+
+def test_reingest_archive(repo, tmp_path):
+    """Test that reingesting replaces the rows of every commit with a recent trace, including its older traces."""
+    (repo / "a.txt").write_text("a")
+    (repo / "b.txt").write_text("b")
+    git("add", "-A", cwd=repo)
+    git("commit", "-q", "-m", "data", cwd=repo)
+    commit = git("rev-parse", "HEAD", cwd=repo)
+
+    archived(tmp_path, f"{1 * DAY * 10 ** 9}-old", ['1 openat(AT_FDCWD, "a.txt", O_RDONLY) = 3'], [(repo, commit)])
+    archived(tmp_path, f"{9 * DAY * 10 ** 9}-new", ['2 openat(AT_FDCWD, "b.txt", O_RDONLY) = 3'], [(repo, commit)])
+    archived(tmp_path, f"{9 * DAY * 10 ** 9}-other", ['3 openat(AT_FDCWD, "a.txt", O_RDONLY) = 3'], [(tmp_path, commit)])
+    # rows left by an older parser
+    initialize_db()
+    db = get_db()
+    ingest_lines(['9 openat(AT_FDCWD, "a.txt", O_WRONLY) = 3'], db, commit, get_tracked_paths(commit), str(repo))
+
+    assert archive.reingest_archive(since=5 * DAY, archive=str(tmp_path / "archive")) == 1
+    assert sorted(get_opened_files_trace(commit, db)) == [(1, "a.txt", "openat", -1, 0), (2, "b.txt", "openat", -1, 0)]
+    assert archive.reingest_archive(since=10 * DAY, archive=str(tmp_path / "archive")) == 0
+
+
+if __name__ == "__main__":
+    pytest.main()
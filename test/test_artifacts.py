@@ -0,0 +1,91 @@
+import os
+import pytest
+from conftest import git
+from scimon import artifacts
+from scimon.snapshot import snapshot
+from scimon.db import get_db, initialize_db
+
+
+def take(command, store):
+    return snapshot(command, artifact_threshold=1024, artifact_store=str(store))
+
+
+class TestArtifacts:
+
+    def test_large_file_is_committed_as_pointer(self, repo, tmp_path):
+        """Test that a file above the threshold is stored by digest and git only records a pointer to it."""
+        content = os.urandom(4096)
+        (repo / "model.ckpt").write_bytes(content)
+        (repo / "small.txt").write_text("small\n")
+        taken = take("python train.py", tmp_path / "objects")
+
+        assert sorted(taken.changed) == ["model.ckpt", "small.txt"]
+        pointer = artifacts.parse_pointer(git("show", f"{taken.commit}:model.ckpt", cwd=repo) + "\n")
+        assert pointer == (artifacts.hash_file(str(repo / "model.ckpt")), 4096)
+        with open(artifacts.object_path(pointer[0], str(tmp_path / "objects")), "rb") as f:
+            assert f.read() == content
+        assert git("show", f"{taken.commit}:small.txt", cwd=repo) == "small"
+        assert (repo / "model.ckpt").read_bytes() == content
+
+    def test_unchanged_artifact_is_not_rehashed(self, repo, tmp_path, monkeypatch):
+        """Test that later snapshots skip stored files whose size and mtime are unchanged, and pick up rewrites."""
+        (repo / "model.ckpt").write_bytes(os.urandom(4096))
+        take("python train.py", tmp_path / "objects")
+
+        hashed = []
+        hash_file = artifacts.hash_file
+        monkeypatch.setattr(artifacts, "hash_file", lambda path: hashed.append(path) or hash_file(path))
+        (repo / "notes.txt").write_text("notes\n")
+        assert take("vim notes.txt", tmp_path / "objects").changed == ["notes.txt"]
+        assert hashed == []
+
+        (repo / "model.ckpt").write_bytes(os.urandom(4096))
+        assert take("python train.py", tmp_path / "objects").changed == ["model.ckpt"]
+        assert hashed == ["model.ckpt"]
+        assert get_db().execute("SELECT COUNT(*) FROM artifacts").fetchone()[0] == 1
+
+    def test_stats_committed_on_their_own(self, repo, tmp_path):
+        """Test that staging artifacts commits their stats rather than leaving them to the snapshot's transaction."""
+        initialize_db()
+        (repo / "model.ckpt").write_bytes(os.urandom(4096))
+        db = get_db()
+        artifacts.stage_artifacts(db, 1024, str(tmp_path / "objects"))
+        assert not db.in_transaction
+        assert db.execute("SELECT path FROM artifacts").fetchall() == [("model.ckpt",)]
+
+    def test_restore_from_commit(self, repo, tmp_path):
+        """Test that an older version of an artifact is written back from the store, and its recipe uses the store."""
+        store = tmp_path / "objects"
+        first = os.urandom(4096)
+        (repo / "model.ckpt").write_bytes(first)
+        old = take("python train.py", store).commit
+        (repo / "model.ckpt").write_bytes(os.urandom(4096))
+        take("python train.py", store)
+
+        assert artifacts.restore_recipe("model.ckpt", old) == f"scimon materialize --source={old} -- model.ckpt"
+        assert artifacts.restore_recipe("script.py", old) == f"git restore --source={old} -- script.py"
+        artifacts.restore_from_commit("model.ckpt", old, str(store))
+        assert (repo / "model.ckpt").read_bytes() == first
+
+    def test_materialize_pointer_file(self, repo, tmp_path):
+        """Test that a pointer left in the working tree is replaced by the stored content."""
+        store = tmp_path / "objects"
+        content = os.urandom(4096)
+        (repo / "model.ckpt").write_bytes(content)
+        artifact = artifacts.store_file("model.ckpt", str(store))
+        (repo / "model.ckpt").write_text(artifacts.format_pointer(artifact))
+
+        assert artifacts.materialize_pointers(["model.ckpt", "script.py"], str(store)) == ["model.ckpt"]
+        assert (repo / "model.ckpt").read_bytes() == content
+
+    def test_deleted_artifact_is_removed(self, repo, tmp_path):
+        """Test that deleting a stored file removes its pointer from the next commit."""
+        (repo / "model.ckpt").write_bytes(os.urandom(4096))
+        take("python train.py", tmp_path / "objects")
+        (repo / "model.ckpt").unlink()
+        assert take("rm model.ckpt", tmp_path / "objects").changed == ["model.ckpt"]
+        assert git("ls-files", cwd=repo).splitlines() == [".gitignore", "script.py"]
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,83 @@
+import pytest
+from conftest import git
+from scimon.cache import BuildCache, recipe_key
+from scimon.runner import run_rules
+from scimon.models import MakeRule
+
+
+@pytest.fixture
+def repo(repo):
+    (repo / "in.txt").write_text("1\n")
+    git("add", "-A", cwd=repo)
+    git("commit", "-q", "-m", "add in.txt", cwd=repo)
+    (repo / "out.txt").write_text("1\n1\n")
+    git("add", "-A", cwd=repo)
+    git("commit", "-q", "-m", "cat in.txt in.txt > out.txt", cwd=repo)
+    return repo
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = BuildCache(str(tmp_path / "cache"))
+    yield cache
+    cache.close()
+
+
+def rules_for(repo, recipe):
+    c1, c2 = git("rev-parse", "HEAD^", cwd=repo), git("rev-parse", "HEAD", cwd=repo)
+    return [
+        MakeRule("in.txt", c1, [], f"git restore --source={c1} -- in.txt"),
+        MakeRule("out.txt", c2, ["in.txt"], recipe),
+    ]
+
+
+class TestBuildCache:
+
+    def test_recipe_key(self):
+        """Test that the key depends on the recipe and the input blobs but not on their order."""
+        inputs = [("a.csv", "1" * 40), ("b.py", "2" * 40)]
+        assert recipe_key("python b.py", inputs) == recipe_key("python b.py", inputs[::-1])
+        assert recipe_key("python b.py", inputs) != recipe_key("python b.py", [("a.csv", "3" * 40), inputs[1]])
+        assert recipe_key("python b.py", inputs) != recipe_key("python c.py", inputs)
+
+    def test_hit_restores_outputs_without_running(self, repo, cache):
+        """Test that a recipe run again on identical inputs restores its outputs instead of running."""
+        recipe = "echo run >> runs.log; cat in.txt in.txt > out.txt"
+        first = run_rules(rules_for(repo, recipe), cache=cache)
+        assert first.cached == []
+        (repo / "out.txt").unlink()
+
+        second = run_rules(rules_for(repo, recipe), cache=cache)
+        assert second.cached == [second.succeeded[1]]
+        assert (repo / "out.txt").read_text() == "1\n1\n"
+        assert (repo / "runs.log").read_text() == "run\n"
+
+    def test_changed_input_misses(self, repo, cache):
+        """Test that different input bytes run the recipe again and cache the new outputs locally."""
+        recipe = "echo run >> runs.log; cat in.txt in.txt > out.txt"
+        run_rules(rules_for(repo, recipe), cache=cache)
+        rules = rules_for(repo, recipe)
+        rules[0] = rules[0]._replace(recipe="echo 2 > in.txt")
+
+        assert run_rules(rules, cache=cache).cached == []
+        assert (repo / "runs.log").read_text() == "run\nrun\n"
+        (repo / "out.txt").unlink()
+        assert run_rules(rules, cache=cache).cached == rules
+        assert (repo / "out.txt").read_text() == "2\n2\n"
+
+    def test_lru_eviction(self, repo, tmp_path):
+        """Test that the least recently used outputs are evicted first, turning their entries into misses."""
+        cache = BuildCache(str(tmp_path / "cache"), max_bytes=250)
+        for name in ("a", "b", "c"):
+            (repo / f"{name}.bin").write_text(name * 100)
+            cache.store(name, [f"{name}.bin"])
+            if name == "b":
+                assert cache.restore("a") == ["a.bin"]
+        assert cache.restore("b") is None
+        assert cache.restore("a") == ["a.bin"]
+        assert cache.restore("c") == ["c.bin"]
+        cache.close()
+
+
+if __name__ == "__main__":
+    pytest.main()
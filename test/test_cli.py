@@ -1,6 +1,7 @@
 from typer.testing import CliRunner
 import os
 import subprocess
+import sys
 from pathlib import Path
 from unittest.mock import patch, mock_open, call
 import pytest
@@ -51,7 +52,7 @@ class TestInit:
         result = runner.invoke(app, ["init"])
         assert result.exit_code == 0
         
-        mock_add_gitignore.assert_called_once_with(".db")
+        mock_add_gitignore.assert_called_once_with(".db*")
         mock_init_db.assert_called_once()
         assert mock_run.call_count == 3  # git init, git add, git commit
         mock_file.assert_any_call(MONITORED_DIR, "r")
@@ -144,5 +145,24 @@ def test_setup(mock_file, mock_os):
     assert "Bash hook already installed" in result.stdout
     assert "App directory already exists" in result.stdout
 
+# modules only the commands that plan, render or run reproductions may import
+HEAVY_MODULES = ("jinja2", "graphviz", "scimon.scimon", "scimon.runner", "concurrent.futures")
+
+def test_cli_import_skips_heavy_modules():
+    """Test that importing the CLI leaves the planner's dependencies unloaded."""
+    code = f"import sys, scimon.cli; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    loaded = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+    assert loaded == []
+
+def test_profile(tmp_path, monkeypatch):
+    """Test that --profile prints the command's spans and they are appended to the metrics file."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("scimon.metrics.METRICS_FILE", str(tmp_path / "metrics.prom"))
+    result = runner.invoke(app, ["--profile", "migrate"])
+    assert result.exit_code == 0
+    assert result.output.splitlines()[-2].split()[:2] == ["migrate", "1"]
+    assert 'scimon_span_seconds_count{command="migrate",span="migrate"} 1' in (tmp_path / "metrics.prom").read_text()
+
+
 if __name__ == "__main__":
     pytest.main()
\ No newline at end of file
@@ -0,0 +1,228 @@
+import os
+import pytest
+import subprocess
+from conftest import git, init_repo
+from scimon import __file__ as scimon_init
+
+HOOK = os.path.join(os.path.dirname(scimon_init), "commandhook.sh")
+
+
+def run_hook(home, cwd, script):
+    env = {**os.environ, "HOME": str(home), "GIT_AUTHOR_NAME": "scimon", "GIT_AUTHOR_EMAIL": "scimon@example.com",
+           "GIT_COMMITTER_NAME": "scimon", "GIT_COMMITTER_EMAIL": "scimon@example.com"}
+    result = subprocess.run(["bash", "-c", f'source "{HOOK}"\n{script}'], cwd=cwd, env=env,
+                            capture_output=True, text=True)
+    return result.stdout
+
+
+@pytest.fixture
+def home(tmp_path):
+    for name in ("a", "b", "nested/c"):
+        (tmp_path / name).mkdir(parents=True)
+    (tmp_path / "a" / "sub").mkdir()
+    (tmp_path / ".scimon").mkdir()
+    (tmp_path / ".scimon" / ".dirs").write_text("a\nb\nnested/c\n")
+    return tmp_path
+
+
+def scoped(home, cwd, msg, is_pre_command=1, trace=None):
+    script = f'_scimon_load_dirs\nSCIMON_TRACE_LOG="{trace or ""}"\n_scimon_scope_dirs "{msg}" {is_pre_command}\nprintf "%s\\n" "${{!SCIMON_CHECK[@]}}"'
+    return sorted(line for line in run_hook(home, cwd, script).splitlines() if line)
+
+
+class TestScopeDirs:
+
+    def test_cwd_scopes_to_containing_directory(self, home):
+        """Test that only the monitored directory containing the working directory is checked."""
+        assert scoped(home, home / "a" / "sub", "ls") == [str(home / "a")]
+        assert scoped(home, home, "ls") == []
+
+    def test_command_paths(self, home):
+        """Test that paths on the command line scope in the monitored directories they point into."""
+        assert scoped(home, home / "a" / "sub", "python3 ../../b/run.py --out=~/nested/c/x.csv") == [
+            str(home / "a"), str(home / "b"), str(home / "nested" / "c")
+        ]
+
+    def test_trace_paths(self, home):
+        """Test that directories touched in the trace are checked after the command."""
+        trace = home / "trace.log"
+        trace.write_text(f'1 openat(AT_FDCWD, "{home}/b/out.csv", O_WRONLY|O_CREAT, 0666) = 3\n')
+        assert scoped(home, home, "make", is_pre_command=0, trace=trace) == [str(home / "b")]
+        assert scoped(home, home, "make", is_pre_command=1, trace=trace) == []
+
+
+def test_git_check_only_commits_scoped_directories(home):
+    """Test that a check commits the dirty directories in scope, concurrently, and leaves the others alone."""
+    for name in ("a", "b", "nested/c"):
+        init_repo(home / name)
+        (home / name / "file.txt").write_text(name)
+        run_hook(home, home / name, "_scimon_initialize_db")
+    trace = home / "trace.log"
+    trace.write_text(f'1 openat(AT_FDCWD, "{home}/nested/c/file.txt", O_WRONLY) = 3\n')
+
+    run_hook(home, home / "a", f'SCIMON_TRACE_LOG="{trace}"\n_scimon_git_check "touch file.txt" 1')
+    assert git("status", "--porcelain", cwd=home / "a") == ""
+    assert git("status", "--porcelain", cwd=home / "b") != ""
+    assert git("status", "--porcelain", cwd=home / "nested" / "c") != ""
+
+    run_hook(home, home / "b", 'SCIMON_CHECK_WORKERS=1\n_scimon_git_check "cp x ../nested/c" 1')
+    assert git("status", "--porcelain", cwd=home / "b") == ""
+    assert git("status", "--porcelain", cwd=home / "nested" / "c") == ""
+
+
+class TestFastPath:
+
+    def test_command_pattern_matches_python(self, home):
+        """Test that the hook learns commands under the same patterns as scimon/fastpath.py."""
+        from scimon.fastpath import command_pattern
+        commands = ["git log --oneline", "ls -la", "FOO=1 /usr/bin/python3 -u plot.py --out x.png"]
+        script = "".join(f'_scimon_command_pattern "{c}"\necho "$SCIMON_COMMAND_PATTERN"\n' for c in commands)
+        assert run_hook(home, home, script).splitlines() == [command_pattern(c) for c in commands]
+
+    def test_read_only_in_every_directory(self, home):
+        """Test that a pattern runs untraced only when every directory in scope has it read-only and not denied."""
+        for name, lines in (("a", "+git\n-git commit\n"), ("b", "+git log\n")):
+            (home / name / ".git").mkdir()
+            (home / name / ".git" / "scimon-readonly").write_text(lines)
+
+        def read_only(cwd, pattern, extra=""):
+            script = f'_scimon_load_dirs\n_scimon_scope_dirs "{pattern} {extra}" 1\n_scimon_is_read_only "{pattern}" && echo yes'
+            return run_hook(home, cwd, script).strip() == "yes"
+
+        assert read_only(home / "a", "git log")
+        assert read_only(home / "a", "git status")
+        assert not read_only(home / "a", "git commit")
+        assert read_only(home / "b", "git log")
+        assert not read_only(home / "b", "git status")
+        assert not read_only(home / "a", "git log", "../b/x ../nested/c/y")
+        assert not read_only(home, "git log")
+
+    def test_fast_post_check_only_commits_changed_directories(self, home):
+        """Test that after an untraced command only the directories whose tree changed get a full check."""
+        for name in ("a", "b"):
+            init_repo(home / name)
+            git("add", "-A", cwd=home / name)
+            git("commit", "-q", "-m", "init", cwd=home / name)
+        (home / "b" / "new.txt").write_text("x\n")
+        script = ('echo "$$"\nSCIMON_CHECK=(["$HOME/a"]=1 ["$HOME/b"]=1)\nscimon() { echo "$PWD $*"; }\n'
+                  'SCIMON_COMMAND_PATTERN="cat new.txt"\n_scimon_fast_post_check "cat new.txt"')
+        pid, *lines = run_hook(home, home, script).splitlines()
+        snapshots = [line for line in lines if " snapshot " in line]
+        assert snapshots == [f'{home / "b"} snapshot --pending {home}/.scimon/.pending.{pid} --pattern cat new.txt cat new.txt']
+
+    def test_scope_clean(self, home):
+        """Test that the fast path needs trees without uncommitted changes or artifacts, which git status can't see."""
+        for name in ("a", "b"):
+            git("init", "-q", "-b", "main", cwd=home / name)
+            (home / name / "model.ckpt").write_text("pointer\n")
+            git("add", "-A", cwd=home / name)
+            git("commit", "-q", "-m", "init", cwd=home / name)
+
+        def clean(*names):
+            checks = " ".join(f'["$HOME/{name}"]=1' for name in names)
+            return run_hook(home, home, f'SCIMON_CHECK=({checks})\n_scimon_scope_clean && echo yes').strip() == "yes"
+
+        assert clean("a", "b")
+        (home / "b" / "notes.txt").write_text("x\n")
+        assert clean("a")
+        assert not clean("a", "b")
+        git("update-index", "--skip-worktree", "model.ckpt", cwd=home / "a")
+        assert not clean("a")
+
+    def test_tree_clean_after_init(self, initialized, tmp_path):
+        """Test that a tree set up by scimon init counts as clean with the database open and artifacts stored."""
+        from scimon.snapshot import snapshot
+        (initialized / "model.ckpt").write_bytes(b"0" * 2048)
+        assert snapshot("python script.py", artifact_threshold=1024, artifact_store=str(tmp_path / "objects"))
+
+        def clean():
+            return run_hook(tmp_path, initialized, f'_scimon_tree_clean "{initialized}" && echo yes').strip() == "yes"
+
+        assert any(name.startswith(".db-") for name in os.listdir(initialized))
+        assert clean()
+        (initialized / "model.ckpt").write_bytes(b"1" * 2048)
+        assert not clean()
+
+
+def test_check_dir_records_trace_cwd(home):
+    """Test that the directory a traced command ran from is passed on to the snapshot of each directory."""
+    script = ('echo "$$"\nscimon() { echo "$PWD $*"; }\n_scimon_new_trace_log\ncd /\n'
+              '_scimon_check_dir "$HOME/b" "python run.py" 0')
+    pid, *lines = run_hook(home, home / "a" / "sub", script).splitlines()
+    snapshots = [line for line in lines if " snapshot " in line]
+    assert snapshots == [f'{home / "b"} snapshot --pending {home}/.scimon/.pending.{pid} --trace-cwd {home / "a" / "sub"} python run.py']
+
+
+def test_spool_leaves_other_shells_pending(home):
+    """Test that spooling a trace only moves or drops the pending commits of its own shell."""
+    other = run_hook(home, home, 'printf "%s\\tabc\\n" "$HOME/b" > "$SCIMON_PENDING"\necho "$SCIMON_PENDING"').strip()
+    script = ('_scimon_ensure_daemon() { :; }\n_scimon_new_trace_log\necho x > "$SCIMON_TRACE_LOG"\n'
+              'printf "%s\\tdef\\n" "$HOME/a" > "$SCIMON_PENDING"\n_scimon_spool_trace\n'
+              '_scimon_new_trace_log\n_scimon_spool_trace')
+    run_hook(home, home, script)
+    assert open(other).read() == f"{home / 'b'}\tabc\n"
+    assert [path.read_text() for path in (home / ".scimon" / "spool").glob("*.targets")] == [f"{home / 'a'}\tdef\n"]
+
+
+FAKE_STRACE = """#!/bin/sh
+# writes a canned trace to the -o target, through sh -c when it is a pipe like strace does, and the environment
+# the traced command would get next to it
+env > "$TRACE.env"
+while [ "$1" != "-o" ]; do shift; done
+case "$2" in
+  "|"*) cat "$TRACE" | sh -c "${2#|}" ;;
+  *) cat "$TRACE" > "$2" ;;
+esac
+"""
+
+
+def test_scoped_tracing_profile(home):
+    """Test that a scoped profile only writes the lines that can concern a monitored directory to the log."""
+    tracer = home / "fake-strace"
+    tracer.write_text(FAKE_STRACE)
+    tracer.chmod(0o755)
+    (home / "it's \\d").mkdir()
+    (home / ".scimon" / ".dirs").write_text("a\nb\nnested/c\nit's \\d\n")
+    lines = [
+        '1 execve("/usr/bin/python3", ["python3", "run.py"], 0x7ffc /* 20 vars */) = 0',
+        '1 openat(AT_FDCWD, "/usr/lib/python3.10/os.py", O_RDONLY|O_CLOEXEC) = 3',
+        f'1 stat("{home}/ab/x", {{st_mode=S_IFREG|0644}}) = 0',
+        f'1 openat(AT_FDCWD, "{home}/b/data.csv", O_RDONLY) = 4',
+        '1 openat(AT_FDCWD, "rel.txt", O_RDONLY) = 5',
+        '1 chdir("/tmp") = 0',
+        f'1 rename("/tmp/x", "{home}/nested/c/y") = 0',
+        f'1 openat(AT_FDCWD, "{home}/it\'s \\d/z", O_RDONLY) = 6',
+        '1 connect(3, {sa_family=AF_UNIX, sun_path="/var/run/nscd/socket"}, 110) = -1 ENOENT',
+        '1 +++ exited with 0 +++',
+    ]
+    (home / "trace.in").write_text("\n".join(lines) + "\n")
+    (home / ".scimon" / ".tracers").write_text(f"a\tstrace-seccomp\t{tracer} -f\tio\t1\n")
+
+    script = ('_scimon_tracer_command\nread -r -a tracer <<< "$SCIMON_TRACER_ARGS"\nSCIMON_TRACE_LOG="$HOME/out.log"\n'
+              f'TRACE="{home}/trace.in" _scimon_trace true "${{tracer[@]}}"')
+    run_hook(home, home / "a", script)
+    assert (home / "out.log").read_text().splitlines() == [lines[0], lines[3], lines[4], lines[5], lines[6], lines[7], lines[9]]
+    assert "SCIMON" not in (home / "trace.in.env").read_text()
+
+    # outside of the configured directory the default tracer is unscoped
+    assert run_hook(home, home / "b", '_scimon_tracer_command\necho "$SCIMON_TRACER_SCOPED $SCIMON_TRACER_ARGS"').startswith("0 strace -f")
+
+
+def test_hook_phase_metrics(home):
+    """Test that timed hook phases are appended to the metrics file as one exposition per command."""
+    script = "_scimon_phase_start\n_scimon_phase_end pre_check\n_scimon_phase_start\n_scimon_phase_end spool\n_scimon_write_metrics"
+    run_hook(home, home, script)
+    run_hook(home, home, "_scimon_write_metrics")
+
+    lines = (home / ".scimon" / "metrics.prom").read_text().splitlines()
+    assert lines[0] == "# TYPE scimon_hook_phase_seconds gauge"
+    assert [line.split(" ")[0] for line in lines[2:4]] == [
+        'scimon_hook_phase_seconds{phase="pre_check"}', 'scimon_hook_phase_seconds{phase="spool"}'
+    ]
+    assert all(float(line.split(" ")[1]) >= 0 for line in lines[2:4])
+    # nothing was timed by the second command
+    assert lines[4:] == ["# EOF"]
+
+
+if __name__ == "__main__":
+    pytest.main()
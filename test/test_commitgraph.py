@@ -0,0 +1,140 @@
+import pytest
+import sqlite3
+import subprocess
+from conftest import git, init_repo
+from scimon import commitgraph
+from scimon.commitgraph import CommitGraph, load_commit_graph
+from scimon.db import migrate_db
+
+
+def commit(repo, message):
+    git("commit", "--allow-empty", "-m", message, cwd=repo)
+    return git("rev-parse", "HEAD", cwd=repo)
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    init_repo(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+class TestCommitGraph:
+
+    def test_generation_and_position(self):
+        """Test that generations count the longest path from a root and parents precede children."""
+        graph = CommitGraph()
+        graph.add("a", ())
+        graph.add("b", ("a",))
+        graph.add("c", ("a",))
+        graph.add("d", ("b", "c"))
+
+        assert [graph.generation[c] for c in "abcd"] == [1, 2, 2, 3]
+        assert [graph.position[c] for c in "abcd"] == [0, 1, 2, 3]
+        assert graph.tips() == ["d"]
+
+    def test_is_ancestor(self):
+        """Test ancestry checks across branches and merges."""
+        graph = CommitGraph()
+        graph.add("a", ())
+        graph.add("b", ("a",))
+        graph.add("c", ("a",))
+        graph.add("d", ("b",))
+        graph.add("e", ("d", "c"))
+        graph.add("f", ("c",))
+
+        assert graph.is_ancestor("a", "e")
+        assert graph.is_ancestor("c", "e")
+        assert graph.is_ancestor("e", "e")
+        assert not graph.is_ancestor("b", "c")
+        assert not graph.is_ancestor("d", "f")
+        assert not graph.is_ancestor("e", "a")
+        assert not graph.is_ancestor("unknown", "e")
+
+    def test_update_matches_git(self, repo):
+        """Test that the index built from rev-list agrees with git merge-base."""
+        root = commit(repo, "root")
+        git("checkout", "-q", "-b", "side", cwd=repo)
+        side = commit(repo, "side")
+        git("checkout", "-q", "main", cwd=repo)
+        main = commit(repo, "main")
+        git("merge", "-q", "--no-edit", "side", cwd=repo)
+        merge = git("rev-parse", "HEAD", cwd=repo)
+
+        graph = CommitGraph()
+        rows = graph.update()
+        assert len(rows) == 4
+
+        commits = [root, side, main, merge]
+        for c1 in commits:
+            for c2 in commits:
+                expected = subprocess.run(["git", "merge-base", "--is-ancestor", c1, c2], cwd=repo).returncode == 0
+                assert graph.is_ancestor(c1, c2) == expected
+
+
+def test_load_commit_graph_is_incremental(repo):
+    """Test that the commit graph is persisted and later loads only index new commits."""
+    first = commit(repo, "first")
+    db = sqlite3.connect(".db")
+    migrate_db(db)
+
+    graph = load_commit_graph(db)
+    assert first in graph
+
+    second = commit(repo, "second")
+    graph = load_commit_graph(db)
+    assert graph.is_ancestor(first, second)
+    assert db.execute("SELECT commit_hash, generation, position FROM commit_graph ORDER BY position").fetchall() == [
+        (first, 1, 0), (second, 2, 1)
+    ]
+    assert graph.update() == []
+    db.close()
+
+
+def rewrite_history(repo):
+    """Replaces the last commit and prunes it, so it no longer exists in the repository."""
+    git("reset", "-q", "--hard", "HEAD^", cwd=repo)
+    rewritten = commit(repo, "rewritten")
+    git("reflog", "expire", "--expire=now", "--all", cwd=repo)
+    git("gc", "-q", "--prune=now", cwd=repo)
+    return rewritten
+
+
+def test_load_commit_graph_after_rewrite(repo):
+    """Test that tips rewritten out of the repository are skipped when updating an existing index."""
+    first = commit(repo, "first")
+    second = commit(repo, "second")
+    db = sqlite3.connect(".db")
+    migrate_db(db)
+    load_commit_graph(db)
+
+    rewritten = rewrite_history(repo)
+    assert subprocess.run(["git", "cat-file", "-e", second], cwd=repo).returncode != 0
+    graph = load_commit_graph(db)
+    assert not graph.rebuilt
+    assert graph.is_ancestor(first, rewritten)
+    assert not graph.is_ancestor(second, rewritten)
+    db.close()
+
+
+def test_load_commit_graph_rebuilds(repo, monkeypatch):
+    """Test that the index is rebuilt from scratch when rev-list fails on its tips."""
+    first = commit(repo, "first")
+    commit(repo, "second")
+    db = sqlite3.connect(".db")
+    migrate_db(db)
+    load_commit_graph(db)
+
+    rewritten = rewrite_history(repo)
+    monkeypatch.setattr(commitgraph, "existing_commits", lambda commits: commits)
+    graph = load_commit_graph(db)
+    assert graph.rebuilt
+    assert graph.is_ancestor(first, rewritten)
+    assert db.execute("SELECT commit_hash, generation, position FROM commit_graph ORDER BY position").fetchall() == [
+        (first, 1, 0), (rewritten, 2, 1)
+    ]
+    db.close()
+
+
+if __name__ == "__main__":
+    pytest.main()
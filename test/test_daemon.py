@@ -0,0 +1,108 @@
+import pytest
+from conftest import git
+from scimon import daemon
+from scimon.db import get_db, insert_ingested_trace, initialize_db
+
+
+@pytest.fixture
+def repo(repo, tmp_path, monkeypatch):
+    # the daemon runs outside of the directories it ingests
+    monkeypatch.chdir(tmp_path)
+    return repo
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return tmp_path / "spool"
+
+
+def queue(spool, name, repo, lines, cwd=None):
+    spool.mkdir(exist_ok=True)
+    (spool / f"{name}.log").write_text("".join(line + "\n" for line in lines))
+    target = f"{repo}\t{git('rev-parse', 'HEAD', cwd=repo)}"
+    (spool / f"{name}.targets").write_text(target + (f"\t{cwd}\n" if cwd else "\n"))
+
+
+def opened_count(repo, monkeypatch):
+    monkeypatch.chdir(repo)
+    return get_db().execute("SELECT COUNT(*) FROM opened_files").fetchone()[0]
+
+
+class TestDaemon:
+
+    def test_process_spool_in_batches(self, repo, spool, tmp_path, monkeypatch):
+        """Test that queued traces are ingested in order, batch_size at a time, and removed afterwards."""
+        for i in range(3):
+            queue(spool, f"100{i}-1", repo, [f'{i} openat(AT_FDCWD, "script.py", O_RDONLY) = 3'])
+        (spool / "1003-1.log").write_text("")  # still being moved in by the hook
+
+        archive = tmp_path / "archive"
+        assert daemon.process_spool(str(spool), batch_size=2, archive=str(archive)) == 2
+        assert [e.name for e in daemon.list_spool(str(spool))] == ["1002-1"]
+        assert daemon.process_spool(str(spool), batch_size=2, archive=str(archive)) == 1
+        assert daemon.process_spool(str(spool), batch_size=2, archive=str(archive)) == 0
+        assert sorted(p.name for p in spool.iterdir()) == ["1003-1.log"]
+        assert opened_count(repo, monkeypatch) == 3
+        assert sorted(p.name for p in archive.iterdir() if p.suffix == ".gz") == [f"100{i}-1.log.gz" for i in range(3)]
+
+    def test_resume_skips_ingested_traces(self, repo, spool, monkeypatch):
+        """Test that an entry whose transaction committed before a crash isn't ingested again."""
+        queue(spool, "1000-1", repo, ['1 openat(AT_FDCWD, "script.py", O_RDONLY) = 3'])
+        queue(spool, "1001-1", repo, ['2 openat(AT_FDCWD, "script.py", O_RDONLY) = 3'])
+        monkeypatch.chdir(repo)
+        initialize_db()
+        with get_db() as db:
+            insert_ingested_trace("1000-1", db)
+
+        daemon.process_spool(str(spool), archive=None)
+        assert opened_count(repo, monkeypatch) == 1
+        assert daemon.list_spool(str(spool)) == []
+
+    def test_failed_entry_is_quarantined(self, repo, spool, tmp_path, monkeypatch):
+        """Test that an entry that can't be ingested is moved aside and the rest of the batch still goes in."""
+        queue(spool, "1000-1", repo, ['1 openat(AT_FDCWD, "script.py", O_RDONLY) = 3'])
+        (spool / "1001-1.targets").write_text(f"{tmp_path / 'missing'}\tabc123\n")
+
+        assert daemon.process_spool(str(spool), archive=None) == 2
+        assert (spool / "failed" / "1001-1.targets").exists()
+        assert opened_count(repo, monkeypatch) == 1
+
+    def test_relative_paths_from_command_cwd(self, repo, spool, monkeypatch):
+        """Test that relative paths resolve against the directory the command ran from, recorded with the trace."""
+        (repo / "src").mkdir()
+        queue(spool, "1000-1", repo, ['1 openat(AT_FDCWD, "../script.py", O_RDONLY) = 3'], cwd=repo / "src")
+
+        daemon.process_spool(str(spool), archive=None)
+        monkeypatch.chdir(repo)
+        assert get_db().execute("SELECT path FROM opened_files JOIN paths p ON p.id = path_id").fetchall() == [("script.py",)]
+
+    def test_git_runs_outside_transaction(self, repo, spool, monkeypatch):
+        """Test that the tracked paths of a batch are listed by git before the ingest transaction takes the write lock."""
+        queue(spool, "1000-1", repo, ['1 openat(AT_FDCWD, "script.py", O_RDONLY) = 3'])
+        queue(spool, "1001-1", repo, ['2 openat(AT_FDCWD, "script.py", O_RDONLY) = 3'])
+        get_tracked_paths = daemon.get_tracked_paths
+        in_transaction = []
+
+        def tracked(commit_hash):
+            in_transaction.append(get_db().in_transaction)
+            return get_tracked_paths(commit_hash)
+
+        monkeypatch.setattr(daemon, "get_tracked_paths", tracked)
+        daemon.process_spool(str(spool), archive=None)
+        assert in_transaction == [False]
+        assert opened_count(repo, monkeypatch) == 2
+
+    def test_run_daemon_once(self, repo, spool, tmp_path, monkeypatch):
+        """Test that the daemon drains the spool and cleans up its pid file."""
+        queue(spool, "1000-1", repo, ['1 openat(AT_FDCWD, "script.py", O_RDONLY) = 3'])
+        pid_file = tmp_path / "daemon.pid"
+
+        daemon.run_daemon(str(spool), once=True, pid_file=str(pid_file), archive=str(tmp_path / "archive"))
+
+        assert daemon.list_spool(str(spool)) == []
+        assert not pid_file.exists()
+        assert opened_count(repo, monkeypatch) == 1
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,193 @@
+import os
+import pytest
+import sqlite3
+from scimon import db as scimon_db
+from scimon.db import (
+    get_db, close_db, initialize_db, get_processes_trace, insert_processes, get_opened_files_trace,
+    get_executed_files_trace, get_schema_version, migrate_db, encode_open_flags, SCHEMA_VERSION,
+    get_lineage_pids, get_lineage_trace, insert_opened_files, insert_executed_files, intern_path, intern_blob
+)
+from scimon.models import ProcessTrace, FileOpenTrace, FileExecutionTrace, ReproducePlan
+
+# codes of clone, execve and openat in the seeded syscalls table
+CLONE = 3
+EXECVE = 5
+OPENAT = 8
+WRITE = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+
+# trace tables as created by version 1 databases
+V1_SCHEMA = """
+CREATE TABLE processes (id INTEGER NOT NULL PRIMARY KEY, pid INTEGER NOT NULL, commit_hash TEXT NOT NULL,
+    parent_pid INTEGER, child_pid INTEGER, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, syscall TEXT NOT NULL);
+CREATE INDEX idx_processes_git_hash on processes(commit_hash);
+CREATE TABLE opened_files (id INTEGER NOT NULL PRIMARY KEY, commit_hash TEXT NOT NULL, filename TEXT NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, mode INTEGER NOT NULL, is_directory BOOLEAN NOT NULL,
+    pid INTEGER NOT NULL, syscall TEXT NOT NULL, open_flag TEXT NOT NULL);
+CREATE INDEX idx_opened_files_git_hash on opened_files(commit_hash);
+CREATE TABLE executed_files (id INTEGER NOT NULL PRIMARY KEY, filename TEXT NOT NULL, commit_hash TEXT NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, pid INTEGER NOT NULL, argv TEXT NOT NULL, envp TEXT NOT NULL,
+    workingdir TEXT NOT NULL, syscall TEXT NOT NULL);
+CREATE INDEX idx_executed_files_git_hash on executed_files(commit_hash);
+INSERT INTO processes (pid, commit_hash, parent_pid, child_pid, syscall) VALUES (2, 'abc123', 1, 3, 'clone');
+INSERT INTO opened_files (commit_hash, filename, mode, is_directory, pid, syscall, open_flag) VALUES
+    ('abc123', 'out.txt', 666, 0, 3, 'openat', 'O_WRONLY|O_CREAT|O_TRUNC'),
+    ('abc123', 'in.txt', -1, 0, 3, 'stat', '');
+INSERT INTO executed_files (filename, commit_hash, pid, argv, envp, workingdir, syscall) VALUES
+    ('/usr/bin/python3', 'abc123', 3, '["python3"]', '0x7ffc', '/work', 'execve'),
+    ('/usr/bin/python3', 'abc123', 4, '["python3"]', '0x7ffc', '/work', 'execve');
+"""
+
+
+@pytest.fixture(autouse=True)
+def tmp_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    initialize_db()
+    yield tmp_path
+    close_db()
+
+
+class TestGetDb:
+
+    def test_get_db_reuses_connection(self):
+        """Test that one connection is kept per database and mode."""
+        assert get_db() is get_db()
+        assert get_db(read_only=True) is get_db(read_only=True)
+        assert get_db() is not get_db(read_only=True)
+
+    def test_get_db_per_directory(self, tmp_path, monkeypatch):
+        """Test that changing directory opens the database of the new directory."""
+        writer = get_db()
+        other = tmp_path / "other"
+        other.mkdir()
+        monkeypatch.chdir(other)
+        assert get_db() is not writer
+
+    def test_get_db_pragmas(self):
+        """Test that the writer uses WAL and every connection gets the tuning pragmas."""
+        writer, reader = get_db(), get_db(read_only=True)
+        assert writer.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert writer.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        for con in (writer, reader):
+            assert con.execute("PRAGMA busy_timeout").fetchone()[0] == scimon_db.CONNECTION_PRAGMAS["busy_timeout"]
+            assert con.execute("PRAGMA cache_size").fetchone()[0] == scimon_db.CONNECTION_PRAGMAS["cache_size"]
+
+    def test_get_db_read_only(self):
+        """Test that read-only connections see committed rows but can't write."""
+        writer = get_db()
+        with writer:
+            insert_processes([(2, "abc123", 1, 3, CLONE)], writer)
+
+        reader = get_db(read_only=True)
+        assert get_processes_trace("abc123", reader) == [ProcessTrace(1, 2, 3, "clone")]
+        with pytest.raises(sqlite3.OperationalError):
+            reader.execute("DELETE FROM processes")
+
+    def test_row_factory_is_per_cursor(self):
+        """Test that trace getters don't change how other queries on the shared connection return rows."""
+        writer = get_db()
+        with writer:
+            insert_processes([(2, "abc123", 1, 3, CLONE)], writer)
+
+        get_processes_trace("abc123", writer)
+        assert writer.execute("SELECT pid FROM processes").fetchone() == (2,)
+
+
+class TestLineage:
+
+    @pytest.fixture
+    def traced(self):
+        """make (1) forks a shell (2) that runs python (3) writing out.txt from in.txt, and an unrelated job (4)."""
+        db = get_db()
+        with db:
+            path = {p: intern_path(p, db) for p in ("in.txt", "out.txt", "other.txt", "/usr/bin/python3", ".")}
+            blob = intern_blob("[]", db)
+            insert_processes([(1, "abc123", None, 2, CLONE), (2, "abc123", 1, 3, CLONE), (1, "abc123", None, 4, CLONE),
+                              (3, "other", None, 5, CLONE)], db)
+            insert_opened_files([("abc123", path["in.txt"], 0, 0, 3, OPENAT, 0),
+                                 ("abc123", path["out.txt"], 0o666, 0, 2, OPENAT, WRITE),
+                                 ("abc123", path["other.txt"], 0o666, 0, 3, OPENAT, WRITE),
+                                 ("abc123", path["in.txt"], 0, 0, 4, OPENAT, 0),
+                                 ("abc123", path["other.txt"], 0o666, 0, 4, OPENAT, WRITE)], db)
+            insert_executed_files([(path["/usr/bin/python3"], "abc123", 3, blob, blob, path["."], EXECVE),
+                                   (path["/usr/bin/python3"], "abc123", 4, blob, blob, path["."], EXECVE)], db)
+        return db
+
+    def test_lineage_pids(self, traced):
+        """Test that the lineage holds the writers of the file and their descendants, not their siblings."""
+        assert sorted(get_lineage_pids("abc123", "out.txt", traced)) == [2, 3]
+        assert sorted(get_lineage_pids("abc123", "other.txt", traced)) == [3, 4]
+        assert get_lineage_pids("abc123", "in.txt", traced) == []
+
+    def test_lineage_trace(self, traced):
+        """Test that only the forks, reads, executions and target writes of the lineage are loaded."""
+        processes, opened_files, executed_files = get_lineage_trace("abc123", "out.txt", traced)
+        assert processes == [ProcessTrace(1, 2, 3, "clone")]
+        assert sorted(opened_files) == [FileOpenTrace(2, "out.txt", "openat", 0o666, WRITE),
+                                        FileOpenTrace(3, "in.txt", "openat", 0, 0)]
+        assert executed_files == [FileExecutionTrace(3, "/usr/bin/python3", "execve")]
+
+
+def test_encode_open_flags():
+    """Test that strace flag strings become the kernel's bitmask."""
+    assert encode_open_flags("O_WRONLY|O_CREAT|O_TRUNC") == os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    assert encode_open_flags("O_RDONLY|O_CLOEXEC") == os.O_CLOEXEC
+    assert encode_open_flags("O_RDONLY|0x80000") == 0x80000
+    assert encode_open_flags("") == 0
+
+
+class TestMigrateDb:
+
+    def test_new_database_is_current(self):
+        """Test that initialize_db creates the current schema version."""
+        assert get_schema_version(get_db()) == SCHEMA_VERSION
+
+    def test_migrate_v1(self, tmp_path):
+        """Test that version 1 trace tables are converted to the normalized tables."""
+        db = sqlite3.connect(str(tmp_path / "v1.db"))
+        db.executescript(V1_SCHEMA)
+
+        assert migrate_db(db)
+        assert get_schema_version(db) == SCHEMA_VERSION
+        assert get_processes_trace("abc123", db) == [ProcessTrace(1, 2, 3, "clone")]
+        assert sorted(get_opened_files_trace("abc123", db)) == [
+            FileOpenTrace(3, "in.txt", "stat", -1, 0),
+            FileOpenTrace(3, "out.txt", "openat", 666, os.O_WRONLY | os.O_CREAT | os.O_TRUNC),
+        ]
+        assert get_executed_files_trace("abc123", db) == [
+            FileExecutionTrace(3, "/usr/bin/python3", "execve"), FileExecutionTrace(4, "/usr/bin/python3", "execve")
+        ]
+        assert db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 2
+        assert not db.execute("SELECT name FROM sqlite_master WHERE name LIKE '%_v1'").fetchall()
+        assert not migrate_db(db)
+        db.close()
+
+    def test_normalize_stored_paths(self, tmp_path):
+        """Test that paths stored as strace printed them become repository-relative, merging duplicates."""
+        db = get_db()
+        with db:
+            ids = [intern_path(p, db) for p in ("./in.txt", f"{tmp_path}/in.txt", "/usr/bin/python3", "sub/../out.txt")]
+            insert_opened_files([("abc123", path_id, 0, 0, 1, OPENAT, 0) for path_id in ids], db)
+            db.execute("PRAGMA user_version=6")
+
+        assert migrate_db(db)
+        assert sorted(p for p, in db.execute("SELECT path FROM paths")) == ["/usr/bin/python3", "in.txt", "out.txt"]
+        assert sorted(get_opened_files_trace("abc123", db)) == [
+            FileOpenTrace(1, "/usr/bin/python3", "openat", 0, 0), FileOpenTrace(1, "in.txt", "openat", 0, 0),
+            FileOpenTrace(1, "out.txt", "openat", 0, 0),
+        ]
+
+    def test_upgrade_clears_reproduce_plans(self):
+        """Test that plans cached before an upgrade are dropped, and kept while the schema is current."""
+        db = get_db()
+        with db:
+            scimon_db.insert_reproduce_plan("out.txt", "abc123", ReproducePlan([("in.txt", "abc123")], "python make.py"), db)
+        migrate_db(db)
+        assert db.execute("SELECT COUNT(*) FROM reproduce_plans").fetchone()[0] == 1
+
+        db.execute(f"PRAGMA user_version={SCHEMA_VERSION - 1}")
+        migrate_db(db)
+        assert db.execute("SELECT COUNT(*) FROM reproduce_plans").fetchone()[0] == 0
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,84 @@
+import pytest
+from conftest import git
+from scimon.db import get_db, initialize_db, get_command_patterns
+from scimon.fastpath import command_pattern, read_only_patterns, set_rule, PROFILE_FILE, READ_ONLY_MIN_RUNS
+from scimon.models import CommandPattern
+from scimon.snapshot import snapshot
+
+
+@pytest.fixture
+def repo(repo):
+    initialize_db()
+    return repo
+
+
+def profile(repo):
+    return (repo / PROFILE_FILE).read_text().splitlines()
+
+
+def test_command_pattern():
+    """Test that a command line is learned under its executable and first argument that isn't an option."""
+    assert command_pattern("git log --oneline") == "git log"
+    assert command_pattern("ls -la") == "ls"
+    assert command_pattern("FOO=1 /usr/bin/python3 -u plot.py --out x.png") == "python3 plot.py"
+    assert command_pattern("") == ""
+
+
+def test_read_only_patterns():
+    """Test that allowed patterns and long enough clean streaks run untraced, unless denied or a bare executable."""
+    patterns = [
+        CommandPattern("cat", 0, 0, 0, "allow"),
+        CommandPattern("git log", 6, 0, 6, None),
+        CommandPattern("git status", 1, 0, 1, "allow"),
+        CommandPattern("ls", 9, 0, 9, None),
+        CommandPattern("python", 9, 0, 9, "deny"),
+        CommandPattern("python check.py", 9, 0, 9, None),
+        CommandPattern("pwd", 2, 0, 2, None),
+    ]
+    assert read_only_patterns(patterns) == ["cat", "git log", "git status"]
+
+
+class TestLearning:
+
+    def test_learns_clean_runs(self, repo):
+        """Test that traced runs leaving the tree untouched make the exact pattern read-only, not its executable."""
+        for _ in range(READ_ONLY_MIN_RUNS - 1):
+            snapshot("git log", pattern="git log")
+        assert profile(repo) == []
+        snapshot("git log", pattern="git log")
+        assert profile(repo) == ["+git log"]
+        for _ in range(READ_ONLY_MIN_RUNS):
+            snapshot("ls", pattern="ls")
+        assert profile(repo) == ["+git log"]
+
+    def test_write_unlearns(self, repo):
+        """Test that a run changing the tree restarts the streak of its pattern only."""
+        for _ in range(READ_ONLY_MIN_RUNS):
+            snapshot("git add", pattern="git add")
+            snapshot("git log", pattern="git log")
+        (repo / "notes.txt").write_text("x\n")
+        snapshot("git add notes.txt", pattern="git add")
+        assert profile(repo) == ["+git log"]
+        assert get_command_patterns(get_db()) == [
+            CommandPattern("git add", READ_ONLY_MIN_RUNS + 1, 1, 0, None),
+            CommandPattern("git log", READ_ONLY_MIN_RUNS, 0, READ_ONLY_MIN_RUNS, None),
+        ]
+
+    def test_pre_command_not_counted(self, repo):
+        """Test that only post-command snapshots count towards the pattern."""
+        snapshot("ls", is_pre_command=True, pattern="ls")
+        assert get_command_patterns(get_db()) == []
+
+    def test_rules(self, repo):
+        """Test that allow and deny rules are written for the hook right away, and can be cleared."""
+        assert set_rule("less -S data.csv", "allow", get_db()) == "less data.csv"
+        assert set_rule("python", "deny", get_db()) == "python"
+        assert profile(repo) == ["+less data.csv", "-python"]
+        set_rule("python", None, get_db())
+        assert profile(repo) == ["+less data.csv"]
+        with pytest.raises(ValueError):
+            set_rule("ls", "maybe", get_db())
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,173 @@
+import os
+import pytest
+import sqlite3
+from scimon import ingest
+from scimon.db import initialize_db, DB_NAME, get_reproduce_plan, insert_reproduce_plan
+from scimon.models import ReproducePlan
+from scimon.utils import TrackedPaths
+
+COMMIT = "abc123"
+TRACKED = TrackedPaths(frozenset({"script.py", "data/in.csv", "out/plot.png"}), frozenset({".", "data", "out"}))
+
+STRACE_LOG = """100 execve("/usr/bin/python3", ["python3", "script.py"], 0x7ffc /* 20 vars */) = 0
+100 openat(AT_FDCWD, "/usr/lib/python3.10/os.py", O_RDONLY|O_CLOEXEC) = 3
+100 openat(AT_FDCWD, "script.py", O_RDONLY|O_CLOEXEC) = 3
+100 clone(child_stack=NULL, flags=CLONE_CHILD_CLEARTID|SIGCHLD) = 101
+101 clone(child_stack=NULL, flags=CLONE_CHILD_CLEARTID|SIGCHLD) = 102
+101 openat(AT_FDCWD, "data/in.csv", O_RDONLY) = 4
+102 openat(AT_FDCWD, "{workingdir}/out/plot.png", O_WRONLY|O_CREAT|O_TRUNC, 0666) = 5
+102 openat(AT_FDCWD, "data", O_RDONLY|O_DIRECTORY) = 6
+102 write(5, "abc", 3) = 3
+100 +++ exited with 0 +++
+"""
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    initialize_db()
+    con = sqlite3.connect(DB_NAME)
+    yield con
+    con.close()
+
+
+class TestStraceIngester:
+
+    def test_ingest_lines(self, db, tmp_path):
+        """Test that relevant system calls on tracked files are stored in their tables."""
+        log = STRACE_LOG.format(workingdir=tmp_path)
+        ingest.ingest_lines(log.splitlines(), db, COMMIT, TRACKED, str(tmp_path))
+
+        processes = db.execute('''SELECT pid, commit_hash, parent_pid, child_pid, s.name FROM processes
+            JOIN syscalls s ON s.id = syscall ORDER BY processes.id''').fetchall()
+        assert processes == [(100, COMMIT, None, 101, "clone"), (101, COMMIT, 100, 102, "clone")]
+
+        opened = db.execute('''SELECT commit_hash, p.path, mode, is_directory, pid, s.name, open_flag FROM opened_files
+            JOIN paths p ON p.id = path_id JOIN syscalls s ON s.id = syscall ORDER BY opened_files.id''').fetchall()
+        assert opened == [
+            (COMMIT, "script.py", -1, 0, 100, "openat", os.O_RDONLY | os.O_CLOEXEC),
+            (COMMIT, "data/in.csv", -1, 0, 101, "openat", os.O_RDONLY),
+            (COMMIT, "out/plot.png", 666, 0, 102, "openat", os.O_WRONLY | os.O_CREAT | os.O_TRUNC),
+            (COMMIT, "data", -1, 1, 102, "openat", os.O_RDONLY | os.O_DIRECTORY),
+        ]
+
+        executed = db.execute('''SELECT f.path, commit_hash, pid, a.content, v.content, w.path, s.name FROM executed_files
+            JOIN paths f ON f.id = path_id JOIN paths w ON w.id = workingdir_id
+            JOIN blobs a ON a.id = argv_id JOIN blobs v ON v.id = envp_id JOIN syscalls s ON s.id = syscall''').fetchall()
+        assert executed == [("/usr/bin/python3", COMMIT, 100, '["python3", "script.py"]', "0x7ffc", ".", "execve")]
+
+    def test_ingest_lines_interns_paths_and_blobs(self, db, tmp_path):
+        """Test that repeated paths and argv/envp strings are only stored once."""
+        lines = [
+            '100 openat(AT_FDCWD, "script.py", O_RDONLY) = 3',
+            '101 openat(AT_FDCWD, "script.py", O_RDONLY) = 3',
+            '100 execve("/usr/bin/python3", ["python3"], 0x7ffc /* 20 vars */) = 0',
+            '101 execve("/usr/bin/python3", ["python3"], 0x7ffc /* 20 vars */) = 0',
+        ]
+        ingest.ingest_lines(lines, db, COMMIT, TRACKED, str(tmp_path))
+        ingest.ingest_lines(lines, db, "def456", TRACKED, str(tmp_path))
+
+        assert db.execute("SELECT COUNT(*) FROM opened_files").fetchone()[0] == 4
+        assert db.execute("SELECT COUNT(*) FROM paths").fetchone()[0] == 3
+        assert db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 2
+
+    def test_ingest_lines_raw_flags(self, db, tmp_path):
+        """Test that logs written with numeric flags (strace -X raw) store the same bitmask."""
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        ingest.ingest_lines([f'102 openat(-100, "out/plot.png", {hex(flags)}, 0666) = 5'], db, COMMIT, TRACKED, str(tmp_path))
+        assert db.execute("SELECT mode, open_flag FROM opened_files").fetchall() == [(666, flags)]
+
+    def test_ingest_lines_invalidates_reproduce_plans(self, db, tmp_path):
+        """Test that re-ingesting a commit drops the reproduce plans cached for it."""
+        insert_reproduce_plan("out/plot.png", COMMIT, ReproducePlan([], "python3 script.py"), db)
+        insert_reproduce_plan("out/plot.png", "def456", ReproducePlan([("script.py", "c0")], "python3 script.py"), db)
+        db.commit()
+
+        ingest.ingest_lines([], db, COMMIT, TRACKED, str(tmp_path))
+
+        assert get_reproduce_plan("out/plot.png", COMMIT, db) is None
+        assert get_reproduce_plan("out/plot.png", "def456", db) == ReproducePlan([("script.py", "c0")], "python3 script.py")
+
+    def test_ingest_lines_flushes_in_batches(self, db, tmp_path):
+        """Test that rows are written once the batch size is reached."""
+        ingester = ingest.StraceIngester(db, COMMIT, TRACKED, str(tmp_path), batch_size=2)
+        for pid in range(3):
+            ingester.feed(f"{pid} fork() = {pid + 1}")
+
+        assert db.execute("SELECT COUNT(*) FROM processes").fetchone()[0] == 2
+        assert len(ingester.processes) == 1
+        ingester.flush()
+        assert db.execute("SELECT COUNT(*) FROM processes").fetchone()[0] == 3
+
+    def test_ingest_lines_ignores_files_outside_working_directory(self, db, tmp_path):
+        """Test that paths escaping the working directory are never considered tracked."""
+        ingest.ingest_lines(['100 openat(AT_FDCWD, "../script.py", O_RDONLY) = 3'], db, COMMIT, TRACKED, str(tmp_path))
+        assert db.execute("SELECT COUNT(*) FROM opened_files").fetchone()[0] == 0
+
+    def test_ingest_lines_follows_working_directory(self, db, tmp_path):
+        """Test that relative paths resolve against the cwd each process chdir'd to, inherited by its children."""
+        lines = [
+            '100 chdir("data") = 0',
+            '100 clone(child_stack=NULL, flags=CLONE_CHILD_CLEARTID|SIGCHLD) = 101',
+            '101 openat(AT_FDCWD, "in.csv", O_RDONLY) = 3',
+            '101 execve("../script.py", ["../script.py"], 0x7ffc /* 20 vars */) = 0',
+            '100 openat(AT_FDCWD, "../script.py", O_RDONLY) = 4',
+            '100 chdir("missing") = -1 ENOENT (No such file or directory)',
+            '100 openat(AT_FDCWD, "in.csv", O_RDONLY) = 5',
+        ]
+        ingest.ingest_lines(lines, db, COMMIT, TRACKED, str(tmp_path))
+        assert db.execute('''SELECT pid, p.path FROM opened_files JOIN paths p ON p.id = path_id
+            WHERE NOT is_directory ORDER BY opened_files.id''').fetchall() == [
+            (101, "data/in.csv"), (100, "script.py"), (100, "data/in.csv")
+        ]
+        assert db.execute('''SELECT f.path, w.path FROM executed_files
+            JOIN paths f ON f.id = path_id JOIN paths w ON w.id = workingdir_id''').fetchall() == [("script.py", "data")]
+
+    def test_ingest_lines_starts_in_command_cwd(self, db, tmp_path):
+        """Test that processes start in the directory the command ran from rather than the monitored directory."""
+        lines = [
+            '100 openat(AT_FDCWD, "in.csv", O_RDONLY) = 3',
+            '100 clone(child_stack=NULL, flags=CLONE_CHILD_CLEARTID|SIGCHLD) = 101',
+            '101 execve("../script.py", ["../script.py"], 0x7ffc /* 20 vars */) = 0',
+            '102 openat(AT_FDCWD, "../out/plot.png", O_WRONLY|O_CREAT|O_TRUNC, 0666) = 4',
+        ]
+        ingest.ingest_lines(lines, db, COMMIT, TRACKED, str(tmp_path), str(tmp_path / "data"))
+        assert db.execute('''SELECT pid, p.path FROM opened_files JOIN paths p ON p.id = path_id
+            ORDER BY opened_files.id''').fetchall() == [(100, "data/in.csv"), (102, "out/plot.png")]
+        assert db.execute('''SELECT f.path, w.path FROM executed_files
+            JOIN paths f ON f.id = path_id JOIN paths w ON w.id = workingdir_id''').fetchall() == [("script.py", "data")]
+
+    def test_ingest_lines_resolves_directory_fds(self, db, tmp_path):
+        """Test that *at syscalls resolve against the directory fd they were given, and fchdir moves the cwd to it."""
+        lines = [
+            '200 openat(AT_FDCWD, "out", O_RDONLY|O_DIRECTORY) = 7',
+            '200 openat(7, "plot.png", O_WRONLY|O_CREAT|O_TRUNC, 0666) = 8',
+            '200 openat(9, "plot.png", O_RDONLY) = 10',
+            f'200 openat(5<{tmp_path}/data>, "in.csv", O_RDONLY) = 11',
+            '200 fchdir(7) = 0',
+            '200 openat(AT_FDCWD, "plot.png", O_RDONLY) = 12',
+        ]
+        ingest.ingest_lines(lines, db, COMMIT, TRACKED, str(tmp_path))
+        # fd 9 was opened before tracing started, there is nothing to resolve it against
+        assert db.execute('''SELECT p.path, open_flag != 0 FROM opened_files JOIN paths p ON p.id = path_id
+            WHERE NOT is_directory ORDER BY opened_files.id''').fetchall() == [
+            ("out/plot.png", 1), ("data/in.csv", 0), ("out/plot.png", 0)
+        ]
+
+
+def test_ingest_strace(db, tmp_path, monkeypatch):
+    """Test that ingest_strace resolves HEAD and the tracked paths exactly once."""
+    calls = []
+    monkeypatch.setattr(ingest, "get_head_commit", lambda: calls.append("head") or COMMIT)
+    monkeypatch.setattr(ingest, "get_tracked_paths", lambda: calls.append("tracked") or TRACKED)
+    log = tmp_path / "strace.log"
+    log.write_text(STRACE_LOG.format(workingdir=tmp_path))
+
+    ingest.ingest_strace(str(log))
+
+    assert calls == ["head", "tracked"]
+    assert db.execute("SELECT COUNT(*) FROM opened_files WHERE commit_hash = ?", (COMMIT,)).fetchone()[0] == 4
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,94 @@
+import pytest
+from scimon import metrics
+from scimon.metrics import span, timed, count, get_stats, reset, format_profile, write_metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    reset()
+    yield
+    reset()
+
+
+@timed
+def load_rows(n):
+    count("subprocesses")
+    count("rows", n)
+    return n
+
+
+class TestSpans:
+
+    def test_counters_are_inclusive(self):
+        """Test that counters added in a span count towards it and every span around it."""
+        with span("command"):
+            load_rows(3)
+            load_rows(4)
+            count("nodes", 2)
+
+        stats = get_stats()
+        assert stats["load_rows"].calls == 2
+        assert stats["load_rows"].counters == {"subprocesses": 2, "rows": 7}
+        assert stats["command"].counters == {"subprocesses": 2, "rows": 7, "nodes": 2}
+        assert stats["command"].seconds >= stats["load_rows"].seconds
+
+    def test_span_recorded_on_error(self):
+        """Test that a span raising still records its call and leaves no span open."""
+        with pytest.raises(ValueError):
+            with span("failing"):
+                raise ValueError()
+        count("rows")
+        assert get_stats()["failing"].calls == 1
+        assert get_stats()["failing"].counters == {}
+
+    def test_format_profile(self):
+        """Test that the profile lists every span with its counters, the slowest first."""
+        with span("command"):
+            load_rows(5)
+        lines = format_profile().splitlines()
+        assert lines[0].split()[:3] == ["span", "calls", "seconds"]
+        assert [line.split()[0] for line in lines[1:]] == ["command", "load_rows"]
+        assert lines[2].split()[3:5] == ["1", "5"]
+
+
+class TestWriteMetrics:
+
+    def test_appends_openmetrics_exposition(self, tmp_path):
+        """Test that each write appends a complete exposition labelled with the command."""
+        path = tmp_path / "metrics.prom"
+        with span("visualize"):
+            load_rows(5)
+        assert write_metrics("visualize", str(path))
+        assert write_metrics("visualize", str(path))
+
+        expositions = path.read_text().split("# EOF\n")
+        assert len(expositions) == 3 and expositions[2] == ""
+        samples = {line.rsplit(" ", 2)[0]: line.rsplit(" ", 2)[1] for line in expositions[0].splitlines()
+                   if not line.startswith("#")}
+        assert samples['scimon_span_seconds_count{command="visualize",span="load_rows"}'] == "1"
+        assert samples['scimon_span_rows_total{command="visualize",span="visualize"}'] == "5"
+        assert 'scimon_span_nodes_total{command="visualize",span="load_rows"}' not in samples
+
+    def test_skipped_without_directory_or_spans(self, tmp_path):
+        """Test that nothing is written with no spans, metrics turned off or a missing directory."""
+        assert not write_metrics("list", str(tmp_path / "metrics.prom"))
+        with span("list"):
+            pass
+        assert not write_metrics("list", "")
+        assert not write_metrics("list", str(tmp_path / "missing" / "metrics.prom"))
+        assert not list(tmp_path.iterdir())
+
+    def test_rotates_large_file(self, tmp_path, monkeypatch):
+        """Test that a file past the size limit is moved aside before appending."""
+        monkeypatch.setattr(metrics, "METRICS_MAX_BYTES", 10)
+        path = tmp_path / "metrics.prom"
+        path.write_text("x" * 20)
+        with span("list"):
+            pass
+        assert write_metrics("list", str(path))
+        assert (tmp_path / "metrics.prom.1").read_text() == "x" * 20
+        assert path.read_text().endswith("# EOF\n")
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,80 @@
+import pytest
+from array import array
+from scimon.models import Graph, Process, File, Edge, build_csr
+
+
+class TestGraph:
+    """Tests for the interned, array-backed Graph."""
+
+    def test_add_node_interns_equal_nodes(self):
+        """Test that equal nodes share one id and the first instance is kept."""
+        graph = Graph()
+        first = Process("abc123", 1)
+
+        assert graph.add_node(first) == 0
+        assert graph.add_node(Process("abc123", 1)) == 0
+        assert graph.add_node(File("abc123", "a.txt")) == 1
+        assert graph.get_node(0) is first
+        assert len(graph.nodes) == 2
+
+    def test_add_edge_deduplicates(self):
+        """Test that equal edges are only stored once and syscall names are interned."""
+        graph = Graph()
+        process, file = Process("abc123", 1), File("abc123", "a.txt")
+        graph.add_edge(Edge(process, file, "openat"))
+        graph.add_edge(Edge(Process("abc123", 1), File("abc123", "a.txt"), "openat"))
+        graph.add_edge(Edge(process, file, "execve"))
+
+        assert len(graph.edges) == 2
+        assert Edge(process, file, "openat") in graph.edges
+        assert Edge(file, process, "openat") not in graph.edges
+        assert Edge(process, file, "clone") not in graph.edges
+        assert set(graph.edges) == {Edge(process, file, "openat"), Edge(process, file, "execve")}
+
+    def test_constructor_accepts_nodes_and_edges(self):
+        """Test that a graph can still be built from collections of nodes and edges."""
+        process, file = Process("abc123", 1), File("abc123", "a.txt")
+        graph = Graph({process}, {Edge(file, process, "openat")})
+
+        assert process in graph.nodes
+        assert file in graph.nodes
+        assert Edge(file, process, "openat") in graph.edges
+
+    def test_get_adj_list(self):
+        """Test that the adjacency list maps each in-node to its out-nodes."""
+        graph = Graph()
+        output, process, script = File("abc123", "out.txt"), Process("abc123", 1), File("abc123", "script.py")
+        graph.add_edge(Edge(output, process, "openat"))
+        graph.add_edge(Edge(process, script, "execve"))
+
+        assert graph.get_adj_list() == {output: [process], process: [script]}
+
+        graph.add_edge(Edge(process, File("abc123", "data.csv"), "openat"))
+        assert graph.get_adj_list()[process] == [script, File("abc123", "data.csv")]
+
+    def test_successors_and_predecessors(self):
+        """Test neighbour lookups through the forward and reverse CSR adjacency."""
+        graph = Graph()
+        a, b, c = Process("abc123", 1), Process("abc123", 2), Process("abc123", 3)
+        graph.add_edge(Edge(a, b, "clone"))
+        graph.add_edge(Edge(a, c, "clone"))
+        graph.add_edge(Edge(b, c, "clone"))
+
+        assert graph.successors(a) == [b, c]
+        assert graph.predecessors(c) == [a, b]
+        assert graph.predecessors(a) == []
+        assert graph.successors(Process("abc123", 4)) == []
+
+
+def test_build_csr():
+    """Test that CSR offsets and targets group edges by source."""
+    csr = build_csr(array('i', [2, 0, 2, 1]), array('i', [0, 1, 1, 2]), 3)
+
+    assert list(csr.offsets) == [0, 1, 2, 4]
+    assert list(csr.neighbours(0)) == [1]
+    assert list(csr.neighbours(1)) == [2]
+    assert list(csr.neighbours(2)) == [0, 1]
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,120 @@
+import pytest
+from conftest import git, init_repo
+from scimon.db import get_db, close_db, initialize_db, insert_command, insert_provenance_edges, get_provenance_lineage
+from scimon.ingest import ingest_lines
+from scimon.models import ProvenanceEdge
+from scimon import provenance
+from scimon.provenance import get_lineage
+from scimon.utils import get_tracked_paths
+
+CLEAN_LOG = """100 execve("/usr/bin/python3", ["python3", "clean.py"], 0x7ffc /* 20 vars */) = 0
+100 openat(AT_FDCWD, "clean.py", O_RDONLY|O_CLOEXEC) = 3
+100 clone(child_stack=NULL, flags=CLONE_CHILD_CLEARTID|SIGCHLD) = 101
+101 openat(AT_FDCWD, "raw.csv", O_RDONLY) = 4
+100 openat(AT_FDCWD, "{repo}/clean.csv", O_WRONLY|O_CREAT|O_TRUNC, 0666) = 5
+100 openat(AT_FDCWD, "clean.csv", O_RDONLY) = 6
+100 openat(AT_FDCWD, "notes.txt", O_RDONLY) = 7
+"""
+PLOT_LOG = """200 openat(AT_FDCWD, "plot.py", O_RDONLY) = 3
+200 openat(AT_FDCWD, "clean.csv", O_RDONLY) = 4
+200 openat(AT_FDCWD, "plot.png", O_WRONLY|O_CREAT|O_TRUNC, 0666) = 5
+"""
+
+
+def commit(repo, message, **files):
+    for name, content in files.items():
+        (repo / name.replace("_", ".")).write_text(content)
+    git("add", "-A", cwd=repo)
+    git("commit", "-q", "-m", message, cwd=repo)
+    return git("rev-parse", "HEAD", cwd=repo)
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    init_repo(repo)
+    with open(repo / ".gitignore", "a") as f:
+        f.write("notes.txt\n")
+    monkeypatch.chdir(repo)
+    initialize_db()
+    yield repo
+    close_db()
+
+
+@pytest.fixture
+def pipeline(repo):
+    """raw.csv -> clean.py -> clean.csv -> plot.py -> plot.png over three commits, with both commands ingested."""
+    c1 = commit(repo, "init", raw_csv="1\n", clean_py="", plot_py="")
+    c2 = commit(repo, "python clean.py", clean_csv="1.0\n")
+    c3 = commit(repo, "python plot.py", plot_png="png")
+    db = get_db()
+    ingest_lines(CLEAN_LOG.format(repo=repo).splitlines(), db, c2, get_tracked_paths(c2), str(repo))
+    ingest_lines(PLOT_LOG.splitlines(), db, c3, get_tracked_paths(c3), str(repo))
+    with db:
+        insert_command(c1, c2, "python clean.py", db)
+        insert_command(c2, c3, "python plot.py", db)
+    return c1, c2, c3
+
+
+class TestProvenance:
+
+    def test_ingest_adds_commit_edges(self, pipeline):
+        """Test that ingesting a command links each file it wrote to the versions its writers read."""
+        c1, c2, c3 = pipeline
+        edges = get_db().execute("SELECT commit_hash, filename, input_commit, input_filename FROM provenance_edges "
+                                 "WHERE commit_hash = ? ORDER BY input_filename", (c2,)).fetchall()
+        # notes.txt is untracked and clean.csv read back is not its own input
+        assert edges == [(c2, "clean.csv", c1, "clean.py"), (c2, "clean.csv", c1, "raw.csv")]
+
+    def test_lineage_across_commits(self, pipeline):
+        """Test that lineage queries follow file versions through every commit in both directions."""
+        c1, c2, c3 = pipeline
+        assert set(get_lineage("plot.png", "HEAD", get_db())) == {
+            ProvenanceEdge(c2, "clean.csv", c1, "clean.py"),
+            ProvenanceEdge(c2, "clean.csv", c1, "raw.csv"),
+            ProvenanceEdge(c3, "plot.png", c2, "clean.csv"),
+            ProvenanceEdge(c3, "plot.png", c1, "plot.py"),
+        }
+        assert set(get_lineage("raw.csv", c1, get_db(), downstream=True)) == {
+            ProvenanceEdge(c2, "clean.csv", c1, "raw.csv"),
+            ProvenanceEdge(c3, "plot.png", c2, "clean.csv"),
+        }
+        # a version that didn't change the file refers to the last one that did
+        assert get_lineage("clean.csv", c3, get_db()) == get_lineage("clean.csv", c2, get_db())
+
+    def test_backfills_commands_missing_from_graph(self, pipeline):
+        """Test that commands ingested before the graph existed are added on the next lineage query."""
+        c1, c2, c3 = pipeline
+        db = get_db()
+        with db:
+            db.execute("DELETE FROM provenance_edges")
+            db.execute("DELETE FROM provenance_commits")
+        assert len(get_lineage("plot.png", c3, db)) == 4
+        assert db.execute("SELECT COUNT(*) FROM provenance_commits").fetchone()[0] == 2
+
+    def test_git_runs_outside_transactions(self, repo, pipeline, monkeypatch):
+        """Test that reingesting a commit resolves its input versions with git after the traces are committed."""
+        c1, c2, c3 = pipeline
+        db = get_db()
+        latest_commits = provenance.get_latest_commits_for_files
+
+        def outside_transaction(*args):
+            assert not db.in_transaction
+            return latest_commits(*args)
+
+        monkeypatch.setattr(provenance, "get_latest_commits_for_files", outside_transaction)
+        ingest_lines(PLOT_LOG.splitlines(), db, c3, get_tracked_paths(c3), str(repo))
+        assert db.execute("SELECT COUNT(*) FROM provenance_edges WHERE commit_hash = ?", (c3,)).fetchone()[0] == 2
+
+    def test_long_chain(self, repo):
+        """Test that a lineage spanning hundreds of versions comes back from a single query."""
+        db = get_db()
+        with db:
+            insert_provenance_edges((ProvenanceEdge(f"c{i}", "model.bin", f"c{i - 1}", "model.bin") for i in range(1, 501)), db)
+        assert len(get_provenance_lineage("model.bin", "c500", db)) == 500
+        assert len(get_provenance_lineage("model.bin", "c0", db, downstream=True)) == 500
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,69 @@
+import pytest
+from unittest.mock import patch
+from scimon.runner import rule_dependencies, run_rules
+from scimon.scimon import run
+from scimon.models import MakeRule
+
+
+class TestRuleDependencies:
+
+    def test_prerequisites_and_shared_targets(self):
+        """Test that rules wait for the closest earlier rule of each prerequisite and for earlier writes of their target."""
+        rules = [
+            MakeRule("data.csv", "c1", [], "git restore --source=c1 -- data.csv"),
+            MakeRule("a.png", "c2", ["data.csv"], "python a.py"),
+            MakeRule("b.png", "c2", ["data.csv"], "python b.py"),
+            MakeRule("data.csv", "c3", [], "git restore --source=c3 -- data.csv"),
+            MakeRule("report.pdf", "c4", ["a.png", "b.png", "data.csv"], "make report"),
+        ]
+        assert rule_dependencies(rules) == [set(), {0}, {0}, {0}, {1, 2, 3}]
+
+
+class TestRunRules:
+
+    def test_independent_rules_run_concurrently(self, tmp_path, monkeypatch):
+        """Test that independent branches run at the same time, each waiting for the other to start."""
+        monkeypatch.chdir(tmp_path)
+        barrier = "touch {0}.started; for i in $(seq 100); do [ -e {1}.started ] && exit 0; sleep 0.05; done; exit 1"
+        rules = [
+            MakeRule("a", "c1", [], barrier.format("a", "b")),
+            MakeRule("b", "c1", [], barrier.format("b", "a")),
+            MakeRule("c", "c2", ["a", "b"], "cat a.started b.started > c"),
+        ]
+        result = run_rules(rules, jobs=2)
+        assert result.succeeded == rules
+        assert (tmp_path / "c").exists()
+
+    def test_failure_cancels_dependents(self, tmp_path, monkeypatch):
+        """Test that a failing recipe cancels the rules depending on it while independent rules still run."""
+        monkeypatch.chdir(tmp_path)
+        rules = [
+            MakeRule("a", "c1", [], "exit 3"),
+            MakeRule("b", "c1", [], "touch b"),
+            MakeRule("c", "c2", ["a"], "touch c"),
+            MakeRule("d", "c3", ["c", "b"], "touch d"),
+        ]
+        result = run_rules(rules, jobs=4)
+        assert result.failed == [rules[0]]
+        assert result.succeeded == [rules[1]]
+        assert result.cancelled == [rules[2], rules[3]]
+        assert not (tmp_path / "c").exists() and not (tmp_path / "d").exists()
+
+
+@patch('scimon.scimon.check_file_validity', return_value=True)
+@patch('scimon.scimon.plan_rules')
+def test_run_plans_and_executes(mock_plan_rules, mock_valid, tmp_path, monkeypatch):
+    """Test that scimon run executes the planned rules in dependency order."""
+    monkeypatch.chdir(tmp_path)
+    mock_plan_rules.return_value = [
+        MakeRule("in.txt", "c1", [], "echo 1 > in.txt"),
+        MakeRule("out.txt", "c2", ["in.txt"], "cat in.txt in.txt > out.txt"),
+    ]
+    result = run("out.txt", "c2", jobs=2)
+    mock_plan_rules.assert_called_once_with("out.txt", "c2")
+    assert not result.failed
+    assert (tmp_path / "out.txt").read_text() == "1\n1\n"
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -1,4 +1,5 @@
 import pytest
+from conftest import git
 from unittest.mock import patch, MagicMock, mock_open
 
 # Import the modules to test
@@ -9,10 +10,17 @@ from scimon.scimon import (
     build_file_execution_nodes_and_edges,
     generate_graph,
     reproduce,
+    plan_reproduction,
+    plan_rules,
+    PlanningContext,
+    plan_targets,
+    reproduce_targets,
+    write_makefile,
     MAKE_FILE_RULE_TEMPLATE,
     MAKE_FILE_NAME
 )
-from scimon.models import Graph, Process, File, Edge, ProcessTrace, FileOpenTrace, FileExecutionTrace
+from scimon.models import Graph, Process, File, Edge, ProcessTrace, FileOpenTrace, FileExecutionTrace, ReproducePlan, MakeRule
+from scimon.utils import TrackedPaths
 
 class TestGetTraceData:
     """Tests for the get_trace_data function."""
@@ -28,7 +36,7 @@ class TestGetTraceData:
         
         # Create mock data
         process_traces = [ProcessTrace(1, 2, 3, "fork")]
-        open_file_traces = [FileOpenTrace(2, "file.txt", "open", 0, "O_RDONLY")]
+        open_file_traces = [FileOpenTrace(2, "file.txt", "open", 0, 0)]
         exec_file_traces = [FileExecutionTrace(2, "script.py", "execve")]
         
         # Configure mocks
@@ -120,20 +128,18 @@ class TestBuildProcessNodesAndEdges:
 class TestBuildFileReadWriteNodesAndEdges:
     """Tests for the build_file_read_write_nodes_and_edges function."""
     
-    @patch('scimon.scimon.is_file_tracked_by_git')
-    @patch('scimon.scimon.os.path.isdir')
-    def test_build_file_read_write_nodes_edges_read_mode(self, mock_isdir, mock_is_tracked):
+    @patch('scimon.scimon.get_tracked_paths')
+    def test_build_file_read_write_nodes_edges_read_mode(self, mock_tracked):
         """Test building file nodes and edges with read-only mode."""
         # Setup
         graph = Graph()
         git_hash = "abc123"
         
         # Configure mocks
-        mock_is_tracked.return_value = True
-        mock_isdir.return_value = False
+        mock_tracked.return_value = TrackedPaths(frozenset({"test_file.txt"}), frozenset({"."}))
         
         # Create a file trace with read mode
-        file_trace = FileOpenTrace(pid=100, filename="test_file.txt", syscall="open", mode=0, open_flag="O_RDONLY")
+        file_trace = FileOpenTrace(pid=100, filename="test_file.txt", syscall="open", mode=0, open_flag=0)
         file_traces = [file_trace]
         
         # Call the function
@@ -154,20 +160,18 @@ class TestBuildFileReadWriteNodesAndEdges:
         edge = Edge(process_node, file_node, "open")
         assert edge in graph.edges
     
-    @patch('scimon.scimon.is_file_tracked_by_git')
-    @patch('scimon.scimon.os.path.isdir')
-    def test_build_file_read_write_nodes_edges_write_mode(self, mock_isdir, mock_is_tracked):
+    @patch('scimon.scimon.get_tracked_paths')
+    def test_build_file_read_write_nodes_edges_write_mode(self, mock_tracked):
         """Test building file nodes and edges with write mode."""
         # Setup
         graph = Graph()
         git_hash = "abc123"
         
         # Configure mocks
-        mock_is_tracked.return_value = True
-        mock_isdir.return_value = False
+        mock_tracked.return_value = TrackedPaths(frozenset({"output.txt"}), frozenset({"."}))
         
         # Create a file trace with write mode
-        file_trace = FileOpenTrace(pid=100, filename="output.txt", syscall="open", mode=0, open_flag="O_WRONLY")
+        file_trace = FileOpenTrace(pid=100, filename="output.txt", syscall="open", mode=0, open_flag=1)
         file_traces = [file_trace]
         
         # Call the function
@@ -188,20 +192,18 @@ class TestBuildFileReadWriteNodesAndEdges:
         edge = Edge(file_node, process_node, "open")
         assert edge in graph.edges
     
-    @patch('scimon.scimon.is_file_tracked_by_git')
-    @patch('scimon.scimon.os.path.isdir')
-    def test_build_file_read_write_nodes_edges_ignored_files(self, mock_isdir, mock_is_tracked):
+    @patch('scimon.scimon.get_tracked_paths')
+    def test_build_file_read_write_nodes_edges_ignored_files(self, mock_tracked):
         """Test that files not tracked by git are ignored."""
         # Setup
         graph = Graph()
         git_hash = "abc123"
         
         # Configure mocks to ignore the file
-        mock_is_tracked.return_value = False
-        mock_isdir.return_value = False
+        mock_tracked.return_value = TrackedPaths(frozenset(), frozenset())
         
         # Create a file trace
-        file_trace = FileOpenTrace(pid=100, filename="ignored.txt", syscall="open", mode=0, open_flag="O_RDONLY")
+        file_trace = FileOpenTrace(pid=100, filename="ignored.txt", syscall="open", mode=0, open_flag=0)
         file_traces = [file_trace]
         
         # Call the function
@@ -211,20 +213,18 @@ class TestBuildFileReadWriteNodesAndEdges:
         assert len(graph.nodes) == 0
         assert len(graph.edges) == 0
     
-    @patch('scimon.scimon.is_file_tracked_by_git')
-    @patch('scimon.scimon.os.path.isdir')
-    def test_build_file_read_write_nodes_edges_directory(self, mock_isdir, mock_is_tracked):
+    @patch('scimon.scimon.get_tracked_paths')
+    def test_build_file_read_write_nodes_edges_directory(self, mock_tracked):
         """Test that directories are ignored."""
         # Setup
         graph = Graph()
         git_hash = "abc123"
         
         # Configure mocks to treat as directory
-        mock_is_tracked.return_value = True
-        mock_isdir.return_value = True
+        mock_tracked.return_value = TrackedPaths(frozenset({"test_dir/file.txt"}), frozenset({".", "test_dir"}))
         
         # Create a directory trace
-        file_trace = FileOpenTrace(pid=100, filename="test_dir", syscall="open", mode=0, open_flag="O_RDONLY")
+        file_trace = FileOpenTrace(pid=100, filename="test_dir", syscall="open", mode=0, open_flag=0)
         file_traces = [file_trace]
         
         # Call the function
@@ -238,17 +238,15 @@ class TestBuildFileReadWriteNodesAndEdges:
 class TestBuildFileExecutionNodesAndEdges:
     """Tests for the build_file_execution_nodes_and_edges function."""
     
-    @patch('scimon.scimon.is_file_tracked_by_git')
-    @patch('scimon.scimon.os.path.isdir')
-    def test_build_file_execution_nodes_edges(self, mock_isdir, mock_is_tracked):
+    @patch('scimon.scimon.get_tracked_paths')
+    def test_build_file_execution_nodes_edges(self, mock_tracked):
         """Test building file execution nodes and edges."""
         # Setup
         graph = Graph()
         git_hash = "abc123"
         
         # Configure mocks
-        mock_is_tracked.return_value = True
-        mock_isdir.return_value = False
+        mock_tracked.return_value = TrackedPaths(frozenset({"script.py"}), frozenset({"."}))
         
         # Create a file execution trace
         file_trace = FileExecutionTrace(pid=100, filename="script.py", syscall="execve")
@@ -272,17 +270,15 @@ class TestBuildFileExecutionNodesAndEdges:
         edge = Edge(process_node, file_node, "execve")
         assert edge in graph.edges
     
-    @patch('scimon.scimon.is_file_tracked_by_git')
-    @patch('scimon.scimon.os.path.isdir')
-    def test_build_file_execution_nodes_edges_ignored_files(self, mock_isdir, mock_is_tracked):
+    @patch('scimon.scimon.get_tracked_paths')
+    def test_build_file_execution_nodes_edges_ignored_files(self, mock_tracked):
         """Test that files not tracked by git are ignored for execution."""
         # Setup
         graph = Graph()
         git_hash = "abc123"
         
         # Configure mocks to ignore the file
-        mock_is_tracked.return_value = False
-        mock_isdir.return_value = False
+        mock_tracked.return_value = TrackedPaths(frozenset(), frozenset())
         
         # Create a file execution trace
         file_trace = FileExecutionTrace(pid=100, filename="ignored.py", syscall="execve")
@@ -295,17 +291,15 @@ class TestBuildFileExecutionNodesAndEdges:
         assert len(graph.nodes) == 0
         assert len(graph.edges) == 0
     
-    @patch('scimon.scimon.is_file_tracked_by_git')
-    @patch('scimon.scimon.os.path.isdir')
-    def test_build_file_execution_nodes_edges_directory(self, mock_isdir, mock_is_tracked):
+    @patch('scimon.scimon.get_tracked_paths')
+    def test_build_file_execution_nodes_edges_directory(self, mock_tracked):
         """Test that directories are ignored for execution."""
         # Setup
         graph = Graph()
         git_hash = "abc123"
         
         # Configure mocks to treat as directory
-        mock_is_tracked.return_value = True
-        mock_isdir.return_value = True
+        mock_tracked.return_value = TrackedPaths(frozenset({"test_dir/file.txt"}), frozenset({".", "test_dir"}))
         
         # Create a directory execution trace
         file_trace = FileExecutionTrace(pid=100, filename="test_dir", syscall="execve")
@@ -323,13 +317,13 @@ class TestGenerateGraph:
     """Tests for the generate_graph function."""
     
     @patch('scimon.scimon.get_db')
-    @patch('scimon.scimon.get_trace_data')
+    @patch('scimon.scimon.get_lineage_trace_data')
     @patch('scimon.scimon.build_process_nodes_and_edges')
     @patch('scimon.scimon.build_file_read_write_nodes_and_edges')
     @patch('scimon.scimon.build_file_execution_nodes_and_edges')
     def test_generate_graph(self, mock_build_exec, mock_build_rw, mock_build_proc, 
                            mock_get_trace, mock_get_db):
-        """Test the graph generation function with all steps."""
+        """Test that the graph is built from the trace rows upstream of the file."""
         # Setup
         filename = "test_file.py"
         git_hash = "abc123"
@@ -338,7 +332,7 @@ class TestGenerateGraph:
         
         # Create mock data
         process_traces = [ProcessTrace(1, 2, 3, "fork")]
-        open_file_traces = [FileOpenTrace(2, "file.txt", "open", 0, "O_RDONLY")]
+        open_file_traces = [FileOpenTrace(2, "file.txt", "open", 0, 0)]
         exec_file_traces = [FileExecutionTrace(2, "script.py", "execve")]
         
         # Configure mock to return trace data
@@ -349,7 +343,7 @@ class TestGenerateGraph:
         
         # Verify calls
         mock_get_db.assert_called_once()
-        mock_get_trace.assert_called_once_with(git_hash, db_mock)
+        mock_get_trace.assert_called_once_with(filename, git_hash, db_mock)
         mock_build_proc.assert_called_once_with(result, process_traces, git_hash)
         mock_build_rw.assert_called_once_with(result, open_file_traces, git_hash)
         mock_build_exec.assert_called_once_with(result, exec_file_traces, git_hash)
@@ -361,6 +355,9 @@ class TestGenerateGraph:
 class TestReproduce:
     """Tests for the reproduce function."""
     
+    @patch('scimon.scimon.get_db')
+    @patch('scimon.scimon.get_reproduce_plan', return_value=None)
+    @patch('scimon.scimon.insert_reproduce_plan')
     @patch('scimon.scimon.is_file_tracked_by_git')
     @patch('scimon.scimon.is_git_hash_on_file')
     @patch('scimon.scimon.get_latest_commit_for_file')
@@ -370,7 +367,8 @@ class TestReproduce:
     @patch('scimon.scimon.os.path.isdir')
     @patch('builtins.open', new_callable=mock_open)
     def test_reproduce_file_no_dependencies(self, mock_file, mock_isdir, mock_get_closest, mock_get_command,
-                                          mock_gen_graph, mock_get_latest, mock_is_hash_on, mock_is_tracked):
+                                          mock_gen_graph, mock_get_latest, mock_is_hash_on, mock_is_tracked,
+                                          mock_insert_plan, mock_get_plan, mock_db):
         """Test reproduce function for a file with no dependencies."""
         # Setup
         file = "simple.txt"
@@ -391,7 +389,7 @@ class TestReproduce:
         reproduce(file, git_hash)
         
         # Verify file operations for Makefile
-        mock_file.assert_called_once_with(MAKE_FILE_NAME, 'a')
+        mock_file.assert_called_once_with(MAKE_FILE_NAME, 'w')
         mock_file().write.assert_called_once()
         
         # Verify the rule template was used with correct parameters
@@ -404,6 +402,8 @@ class TestReproduce:
         assert write_arg.strip() == expected_rule.strip()
 
     @patch('scimon.scimon.get_db')
+    @patch('scimon.scimon.get_reproduce_plan', return_value=None)
+    @patch('scimon.scimon.insert_reproduce_plan')
     @patch('scimon.scimon.is_file_tracked_by_git')
     @patch('scimon.scimon.is_git_hash_on_file')
     @patch('scimon.scimon.get_latest_commit_for_file')
@@ -413,7 +413,8 @@ class TestReproduce:
     @patch('scimon.scimon.os.path.isdir')
     @patch('builtins.open', new_callable=mock_open)
     def test_reproduce_file_with_dependencies(self, mock_file, mock_isdir, mock_get_closest, mock_get_command,
-                                            mock_gen_graph, mock_get_latest, mock_is_hash_on, mock_is_tracked, mock_db):
+                                            mock_gen_graph, mock_get_latest, mock_is_hash_on, mock_is_tracked,
+                                            mock_insert_plan, mock_get_plan, mock_db):
         """Test reproduce function for a file with dependencies."""
         # Setup
         file = "output.txt"
@@ -427,7 +428,6 @@ class TestReproduce:
         mock_get_latest.return_value = git_hash
         mock_get_command.return_value = command
         mock_get_closest.return_value = "def456"  # Different hash for dependency
-        mock_db.return_value = None
 
         # Create a graph with dependencies
         graph_mock = MagicMock()
@@ -456,6 +456,44 @@ class TestReproduce:
         # This would need to be adapted to the exact implementation
         # For now, verify the rule was generated with dependencies
         assert mock_file().write.call_count > 0
+
+        # Verify the plans of both the file and its dependency were cached
+        mock_insert_plan.assert_any_call(file, git_hash, ReproducePlan([("process.py", "def456")], command), mock_db.return_value)
+        assert mock_insert_plan.call_count == 2
+
+    @patch('scimon.scimon.get_db')
+    @patch('scimon.scimon.get_reproduce_plan')
+    @patch('scimon.scimon.is_file_tracked_by_git')
+    @patch('scimon.scimon.is_git_hash_on_file')
+    @patch('scimon.scimon.generate_graph')
+    @patch('scimon.scimon.os.path.isdir')
+    @patch('builtins.open', new_callable=mock_open)
+    def test_reproduce_cached_plan(self, mock_file, mock_isdir, mock_gen_graph, mock_is_hash_on, mock_is_tracked,
+                                   mock_get_plan, mock_db):
+        """Test that a cached plan is used without rebuilding the provenance graph."""
+        # Setup
+        file = "output.txt"
+        git_hash = "abc123"
+        command = "python process.py > output.txt"
+
+        # Configure mocks
+        mock_isdir.return_value = False
+        mock_is_tracked.return_value = True
+        mock_is_hash_on.return_value = True
+        mock_get_plan.side_effect = lambda f, h, db: {
+            (file, git_hash): ReproducePlan([("process.py", "def456")], command),
+            ("process.py", "def456"): ReproducePlan([], "git restore --source=def456 -- process.py"),
+        }[(f, h)]
+
+        # Call the function
+        reproduce(file, git_hash)
+
+        # Verify the graph was never built and both rules were written, dependency first
+        mock_gen_graph.assert_not_called()
+        mock_file().write.assert_called_once_with(
+            MAKE_FILE_RULE_TEMPLATE.render(target="process.py", prerequisites="", recipe="git restore --source=def456 -- process.py")
+            + MAKE_FILE_RULE_TEMPLATE.render(target=file, prerequisites="process.py", recipe=command)
+        )
     
     @patch('scimon.scimon.is_file_tracked_by_git')
     @patch('scimon.scimon.os.path.isdir')
@@ -513,5 +551,209 @@ class TestReproduce:
         mock_is_hash_on.assert_called_once_with(file, git_hash)
 
 
+class TestPlanRules:
+    """Tests for the plan_rules function."""
+
+    @patch('scimon.scimon.plan_reproduction')
+    def test_plan_rules_shared_ancestor(self, mock_plan):
+        """Test that a prerequisite shared by several files is planned and emitted once."""
+        plans = {
+            ("report.pdf", "c3"): ReproducePlan([("a.png", "c2"), ("b.png", "c2")], "make report"),
+            ("a.png", "c2"): ReproducePlan([("data.csv", "c1")], "python a.py"),
+            ("b.png", "c2"): ReproducePlan([("data.csv", "c1")], "python b.py"),
+            ("data.csv", "c1"): ReproducePlan([], "git restore --source=c1 -- data.csv"),
+        }
+        mock_plan.side_effect = lambda f, h, *_: plans[(f, h)]
+
+        rules = plan_rules("report.pdf", "c3")
+
+        assert rules == [
+            MakeRule("data.csv", "c1", [], "git restore --source=c1 -- data.csv"),
+            MakeRule("a.png", "c2", ["data.csv"], "python a.py"),
+            MakeRule("b.png", "c2", ["data.csv"], "python b.py"),
+            MakeRule("report.pdf", "c3", ["a.png", "b.png"], "make report"),
+        ]
+        assert mock_plan.call_count == len(plans)
+
+    @patch('scimon.scimon.plan_reproduction')
+    def test_plan_rules_cycle(self, mock_plan):
+        """Test that a file read and written by the same command doesn't loop forever."""
+        plans = {
+            ("log.txt", "c2"): ReproducePlan([("log.txt", "c2"), ("script.sh", "c1")], "bash script.sh"),
+            ("script.sh", "c1"): ReproducePlan([], "git restore --source=c1 -- script.sh"),
+        }
+        mock_plan.side_effect = lambda f, h, *_: plans[(f, h)]
+
+        rules = plan_rules("log.txt", "c2")
+
+        assert rules == [
+            MakeRule("script.sh", "c1", [], "git restore --source=c1 -- script.sh"),
+            MakeRule("log.txt", "c2", ["script.sh"], "bash script.sh"),
+        ]
+
+    @patch('scimon.scimon.plan_reproduction')
+    def test_plan_rules_deep_chain(self, mock_plan):
+        """Test that chains deeper than the recursion limit can be planned."""
+        depth = 5000
+        mock_plan.side_effect = lambda f, h, *_: ReproducePlan([(f"f{int(h) - 1}", str(int(h) - 1))] if int(h) else [], f"make {f}")
+
+        rules = plan_rules(f"f{depth}", str(depth))
+
+        assert len(rules) == depth + 1
+        assert rules[0] == MakeRule("f0", "0", [], "make f0")
+        assert rules[-1] == MakeRule(f"f{depth}", str(depth), [f"f{depth - 1}"], f"make f{depth}")
+
+    @patch('scimon.scimon.get_db')
+    @patch('scimon.scimon.get_reproduce_plan', return_value=None)
+    @patch('scimon.scimon.insert_reproduce_plan')
+    @patch('scimon.scimon.get_command', return_value="bash run.sh")
+    @patch('scimon.scimon.get_closest_ancestor_hash', return_value="c1")
+    @patch('scimon.scimon.generate_graph')
+    def test_plan_reproduction_process_cycle(self, mock_gen_graph, mock_closest, mock_command, mock_insert_plan,
+                                             mock_get_plan, mock_db):
+        """Test that processes forking each other and chains deeper than the recursion limit are walked once."""
+        depth = 5000
+        out = File("c2", "out.txt")
+        processes = [Process("c2", pid) for pid in range(depth)]
+        adj = {out: [processes[0]]}
+        for pid, process in enumerate(processes[:-1]):
+            adj[process] = [processes[pid + 1], File("c2", f"in{pid % 3}.txt")]
+        adj[processes[-1]] = [processes[0], out]
+        mock_gen_graph.return_value.get_adj_list.return_value = adj
+
+        plan = plan_reproduction("out.txt", "c2")
+
+        assert plan == ReproducePlan([("out.txt", "c1"), ("in0.txt", "c1"), ("in2.txt", "c1"), ("in1.txt", "c1")], "bash run.sh")
+        assert mock_closest.call_count == 4
+
+    @patch('scimon.scimon.restore_recipe', return_value="git restore --source=c1 -- data.csv")
+    @patch('scimon.scimon.generate_graph')
+    def test_plan_reproduction_database_locked(self, mock_gen_graph, mock_restore, tmp_path, monkeypatch):
+        """Test that a plan is returned without waiting when another writer holds the database, just not cached."""
+        import sqlite3
+        import time
+        from scimon.db import initialize_db, close_db, get_db, get_reproduce_plan, DB_NAME
+        monkeypatch.chdir(tmp_path)
+        initialize_db()
+        mock_gen_graph.return_value.get_adj_list.return_value = {}
+        daemon = sqlite3.connect(str(tmp_path / DB_NAME))
+        try:
+            daemon.execute("BEGIN IMMEDIATE")
+            start = time.monotonic()
+            plan = plan_reproduction("data.csv", "c1")
+            assert time.monotonic() - start < 1
+            daemon.rollback()
+            assert plan == ReproducePlan([], "git restore --source=c1 -- data.csv")
+            assert get_reproduce_plan("data.csv", "c1", get_db()) is None
+            plan_reproduction("data.csv", "c1")
+            assert get_reproduce_plan("data.csv", "c1", get_db()) == plan
+        finally:
+            daemon.close()
+            close_db()
+
+
+class TestPlanTargets:
+    """Tests for planning several targets in one pass."""
+
+    @patch('scimon.scimon.get_db')
+    @patch('scimon.scimon.get_reproduce_plan', return_value=None)
+    @patch('scimon.scimon.insert_reproduce_plan')
+    @patch('scimon.scimon.get_command', return_value="python plot.py")
+    @patch('scimon.scimon.get_closest_ancestor_hash', return_value="c1")
+    @patch('scimon.scimon.restore_recipe', side_effect=lambda f, h: f"git restore --source={h} -- {f}")
+    @patch('scimon.scimon.generate_graph')
+    def test_shared_graph_and_lookups(self, mock_gen_graph, mock_restore, mock_closest, mock_command,
+                                      mock_insert_plan, mock_get_plan, mock_db):
+        """Test that outputs of one commit share its command and ancestor lookups, and their common input is planned once."""
+        process = Process("c2", 1)
+        graph_c2, graph_c1 = MagicMock(), MagicMock()
+        graph_c2.get_adj_list.return_value = {
+            File("c2", "a.png"): [process], File("c2", "b.png"): [process], process: [File("c2", "data.csv")]
+        }
+        graph_c1.get_adj_list.return_value = {}
+        mock_gen_graph.side_effect = lambda f, h: {"c2": graph_c2, "c1": graph_c1}[h]
+
+        rules = plan_targets([("a.png", "c2"), ("b.png", "c2"), ("a.png", "c2")])
+
+        assert rules == [
+            MakeRule("data.csv", "c1", [], "git restore --source=c1 -- data.csv"),
+            MakeRule("a.png", "c2", ["data.csv"], "python plot.py"),
+            MakeRule("b.png", "c2", ["data.csv"], "python plot.py"),
+        ]
+        # one lineage graph per distinct output
+        assert [c.args for c in mock_gen_graph.call_args_list] == [("a.png", "c2"), ("data.csv", "c1"), ("b.png", "c2")]
+        mock_closest.assert_called_once_with("data.csv", "c2")
+        mock_command.assert_called_once()
+
+    @patch('scimon.scimon.get_db')
+    @patch('scimon.scimon.get_reproduce_plan', return_value=None)
+    @patch('scimon.scimon.insert_reproduce_plan')
+    @patch('scimon.scimon.get_command', return_value="python plot.py")
+    @patch('scimon.scimon.get_provenance_inputs', return_value={"data.csv": "c0"})
+    @patch('scimon.scimon.get_closest_ancestor_hash', return_value="c1")
+    @patch('scimon.scimon.generate_graph')
+    def test_prerequisites_from_provenance(self, mock_gen_graph, mock_closest, mock_inputs, mock_command,
+                                           mock_insert_plan, mock_get_plan, mock_db):
+        """Test that prerequisite versions come from the provenance graph, with git only resolving the inputs it lacks."""
+        process = Process("c2", 1)
+        mock_gen_graph.return_value.get_adj_list.return_value = {
+            File("c2", "a.png"): [process], process: [File("c2", "data.csv"), File("c2", "plot.py")]
+        }
+
+        context = PlanningContext()
+        plan = plan_reproduction("a.png", "c2", context)
+        plan_reproduction("b.png", "c2", context)
+
+        assert plan == ReproducePlan([("data.csv", "c0"), ("plot.py", "c1")], "python plot.py")
+        mock_inputs.assert_called_once_with("c2", mock_db.return_value)
+        mock_closest.assert_called_once_with("plot.py", "c2")
+
+
+@patch('scimon.scimon.plan_targets')
+def test_reproduce_targets(mock_plan_targets, tmp_path, monkeypatch):
+    """Test that globs, plain paths and --all-outputs-of resolve to one planning pass and a single Makefile."""
+    git("init", "-q", "-b", "main", cwd=tmp_path)
+    (tmp_path / "figs").mkdir()
+    (tmp_path / "data.csv").write_text("1")
+    git("add", "-A", cwd=tmp_path)
+    git("commit", "-q", "-m", "data", cwd=tmp_path)
+    for name in ("a.png", "b.png"):
+        (tmp_path / "figs" / name).write_text(name)
+    git("add", "-A", cwd=tmp_path)
+    git("commit", "-q", "-m", "python plot.py", cwd=tmp_path)
+    (tmp_path / "table.tex").write_text("t")
+    git("add", "-A", cwd=tmp_path)
+    git("commit", "-q", "-m", "python table.py", cwd=tmp_path)
+    plots, table = git("rev-parse", "HEAD^", cwd=tmp_path), git("rev-parse", "HEAD", cwd=tmp_path)
+    (tmp_path / "figs" / "untracked.png").write_text("x")
+    (tmp_path / MAKE_FILE_NAME).write_text("stale: rule\n")
+    monkeypatch.chdir(tmp_path)
+    mock_plan_targets.side_effect = lambda targets: [MakeRule(f, h, [], f"make {f}") for f, h in targets]
+
+    rules = reproduce_targets(["figs/*.png", "./figs/a.png"], None, all_outputs_of=table)
+
+    mock_plan_targets.assert_called_once_with([("figs/a.png", plots), ("figs/b.png", plots), ("table.tex", table)])
+    assert [rule.target for rule in rules] == ["figs/a.png", "figs/b.png", "table.tex"]
+    makefile = (tmp_path / MAKE_FILE_NAME).read_text()
+    assert makefile.count("make figs/a.png") == 1
+    assert "stale" not in makefile
+
+
+def test_write_makefile_conflicting_versions(tmp_path, monkeypatch, capsys):
+    """Test that a plan needing a file at two versions isn't written as two rules for the same make target."""
+    monkeypatch.chdir(tmp_path)
+    rules = [
+        MakeRule("model.pt", "c1", [], "git restore --source=c1 -- model.pt"),
+        MakeRule("model.pt", "c2", ["model.pt"], "python train.py"),
+        MakeRule("eval.txt", "c2", ["model.pt"], "python eval.py"),
+    ]
+
+    assert not write_makefile(rules)
+    assert not (tmp_path / MAKE_FILE_NAME).exists()
+    assert "model.pt is needed at 2 versions: c1, c2" in capsys.readouterr().out
+    assert write_makefile(rules[1:])
+    assert (tmp_path / MAKE_FILE_NAME).read_text().count("model.pt:") == 1
+
+
 if __name__ == "__main__":
     pytest.main()
\ No newline at end of file
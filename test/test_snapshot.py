@@ -0,0 +1,79 @@
+import pytest
+from conftest import git
+from scimon.snapshot import snapshot, commit_working_tree
+from scimon.db import get_db, close_db
+
+
+class TestSnapshot:
+
+    def test_records_command_and_changes(self, repo, tmp_path):
+        """Test that a snapshot commits the working tree and records the command and changed files together."""
+        pre = git("rev-parse", "HEAD", cwd=repo)
+        (repo / "script.py").write_text("print(2)\n")
+        (repo / "out dir").mkdir()
+        (repo / "out dir" / "result.csv").write_text("1\n")
+        pending = tmp_path / "pending"
+
+        taken = snapshot("python script.py", pending=str(pending))
+
+        assert taken.parent == pre
+        assert taken.commit == git("rev-parse", "HEAD", cwd=repo)
+        assert git("log", "-1", "--format=%s", cwd=repo) == "python script.py"
+        assert git("status", "--porcelain", cwd=repo) == ""
+        db = get_db()
+        assert db.execute("SELECT pre_command_commit, post_command_commit, command FROM commands").fetchall() == [
+            (pre, taken.commit, "python script.py")
+        ]
+        assert sorted(db.execute("SELECT commit_hash, filename FROM file_changes").fetchall()) == [
+            (taken.commit, "out dir/result.csv"), (taken.commit, "script.py")
+        ]
+        assert pending.read_text() == f"{repo}\t{taken.commit}\n"
+
+    def test_pending_records_trace_cwd(self, repo, tmp_path):
+        """Test that the directory the traced command ran from is appended to pending with the new commit."""
+        pending = tmp_path / "pending"
+        (repo / "script.py").write_text("print(2)\n")
+        taken = snapshot("python ../script.py", pending=str(pending), trace_cwd=str(tmp_path))
+        assert pending.read_text() == f"{repo}\t{taken.commit}\t{tmp_path}\n"
+
+    def test_clean_tree(self, repo, tmp_path):
+        """Test that nothing is committed or recorded when the working tree matches HEAD."""
+        head = git("rev-parse", "HEAD", cwd=repo)
+        assert snapshot("ls", pending=str(tmp_path / "pending")) is None
+        assert git("rev-parse", "HEAD", cwd=repo) == head
+        assert not (tmp_path / "pending").exists()
+
+    def test_pre_command_records_no_command(self, repo):
+        """Test that a pre-command snapshot commits and records changed files but no command."""
+        (repo / "notes.txt").write_text("edited by hand\n")
+        taken = snapshot("python script.py", is_pre_command=True)
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) FROM commands").fetchone()[0] == 0
+        assert db.execute("SELECT filename FROM file_changes WHERE commit_hash = ?", (taken.commit,)).fetchall() == [("notes.txt",)]
+
+    def test_initial_commit(self, tmp_path, monkeypatch, identity):
+        """Test that a repository without commits gets a root commit listing every file."""
+        git("init", "-q", "-b", "main", cwd=tmp_path)
+        (tmp_path / "a.txt").write_text("a")
+        monkeypatch.chdir(tmp_path)
+
+        taken = commit_working_tree("init")
+        assert taken.parent is None
+        assert taken.changed == ["a.txt"]
+        assert git("rev-parse", "HEAD", cwd=tmp_path) == taken.commit
+
+
+def test_database_files_never_committed(initialized):
+    """Test that snapshots taken with the database open leave its -wal and -shm files out of the commits."""
+    for i in range(2):
+        (initialized / "out.txt").write_text(f"{i}\n")
+        taken = snapshot(f"python script.py {i}")
+        assert taken.changed == ["out.txt"]
+    assert get_db().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert not [name for name in git("ls-files", cwd=initialized).splitlines() if name.startswith(".db")]
+    close_db()
+    assert git("status", "--porcelain", cwd=initialized) == ""
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,92 @@
+import pytest
+from scimon.tracer import (
+    TRACED_SYSCALLS, STAT_SYSCALLS, PROFILES, Tracer, StraceTracer, SeccompStraceTracer, get_tracer, get_tracer_for_dir,
+    get_profile_for_dir, set_tracer_for_dir
+)
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / "project" / "sub").mkdir(parents=True)
+    return tmp_path
+
+
+class TestTracers:
+
+    def test_strace_command(self):
+        """Test that the default tracer traces every ingested system call."""
+        command = StraceTracer().command("log", ["python3", "run.py"])
+        assert command[:3] == ["strace", "-f", "-e"]
+        assert command[3] == "trace=" + ",".join(TRACED_SYSCALLS)
+        assert command[4:] == ["-o", "log", "--", "python3", "run.py"]
+
+    def test_seccomp_skips_stat_family(self):
+        """Test that the seccomp tracer filters in the kernel and leaves out the stat family."""
+        arguments = SeccompStraceTracer().arguments()
+        assert "--seccomp-bpf" in arguments
+        traced = arguments[-1][len("trace="):].split(",")
+        assert "openat" in traced and "execve" in traced and "clone" in traced
+        assert not STAT_SYSCALLS & set(traced)
+
+    def test_profile_syscalls(self):
+        """Test that the io profile leaves out the stat family and sockets but keeps what provenance needs."""
+        traced = StraceTracer().arguments(PROFILES["io"])[3][len("trace="):].split(",")
+        assert not STAT_SYSCALLS & set(traced)
+        assert "connect" not in traced
+        assert {"openat", "execve", "clone", "chdir", "fchdir", "rename"} <= set(traced)
+        assert StraceTracer().arguments(PROFILES["project"]) == StraceTracer().arguments()
+
+    def test_incomplete_tracer(self):
+        """Test that a tracer without arguments can't be created."""
+        class Incomplete(Tracer):
+            name = "incomplete"
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_get_tracer_unknown(self):
+        """Test that unknown tracer names are rejected."""
+        with pytest.raises(ValueError):
+            get_tracer("ltrace")
+
+
+class TestTracerConfig:
+
+    def test_default_tracer(self, home):
+        """Test that directories without configuration use strace."""
+        assert get_tracer_for_dir(str(home / "project"), str(home / ".tracers")).name == "strace"
+
+    def test_closest_configured_parent_wins(self, home):
+        """Test that the tracer of the closest configured parent directory is used."""
+        config = str(home / ".tracers")
+        set_tracer_for_dir(str(home / "project"), "strace-seccomp", config)
+        assert get_tracer_for_dir(str(home / "project" / "sub"), config).name == "strace-seccomp"
+
+        set_tracer_for_dir(str(home / "project" / "sub"), "strace", config)
+        set_tracer_for_dir(str(home / "project"), "strace-seccomp", config)
+        assert get_tracer_for_dir(str(home / "project" / "sub"), config).name == "strace"
+        assert get_tracer_for_dir(str(home / "project"), config).name == "strace-seccomp"
+        assert get_tracer_for_dir(str(home), config).name == "strace"
+
+        lines = (home / ".tracers").read_text().splitlines()
+        assert len(lines) == 2
+        assert lines[1].split("\t")[:2] == ["project", "strace-seccomp"]
+        assert lines[1].split("\t")[2] == " ".join(SeccompStraceTracer().arguments())
+
+    def test_profile_config(self, home):
+        """Test that the profile is stored with whether it is scoped, and entries from before profiles are full."""
+        config = home / ".tracers"
+        config.write_text("project\tstrace\tstrace -f\n")
+        assert get_profile_for_dir(str(home / "project" / "sub"), str(config)).name == "full"
+
+        set_tracer_for_dir(str(home / "project" / "sub"), "strace", str(config), profile="io")
+        assert get_profile_for_dir(str(home / "project" / "sub"), str(config)).name == "io"
+        assert get_profile_for_dir(str(home / "project"), str(config)).name == "full"
+        assert config.read_text().splitlines()[1].split("\t")[3:] == ["io", "1"]
+        with pytest.raises(ValueError):
+            set_tracer_for_dir(str(home / "project"), "strace", str(config), profile="everything")
+
+
+if __name__ == "__main__":
+    pytest.main()
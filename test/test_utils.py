@@ -1,6 +1,7 @@
 import pytest 
 import subprocess
 from scimon import utils
+from scimon.commitgraph import CommitGraph
 
 class TestGetLatestCommitForFile:
     def test_get_latest_commit_for_file_success(monkeypatch):
@@ -49,6 +50,39 @@ class TestIsFileTrackedByGitTrue:
         monkeypatch.setattr(utils.subprocess, "run", throw)
         assert utils.is_file_tracked_by_git(mock_file) is False
 
+class TestGetTrackedPaths:
+    def test_get_tracked_paths(self, monkeypatch):
+        def git_ls_files(cmd, capture_output, check):
+            return subprocess.CompletedProcess(cmd, 0, stdout=b"a.txt\0src/pkg/b.py\0")
+
+        monkeypatch.setattr(utils.subprocess, "run", git_ls_files)
+        tracked = utils.get_tracked_paths()
+        assert tracked.files == frozenset({"a.txt", "src/pkg/b.py"})
+        assert tracked.directories == frozenset({".", "src", "src/pkg"})
+        assert "src/pkg" in tracked
+        assert "c.txt" not in tracked
+
+    def test_get_tracked_paths_at_commit_is_cached(self, monkeypatch):
+        calls = []
+        def git_ls_tree(cmd, capture_output, check):
+            calls.append(cmd)
+            return subprocess.CompletedProcess(cmd, 0, stdout=b"a.txt\0")
+
+        utils._get_tracked_paths_at_commit.cache_clear()
+        monkeypatch.setattr(utils.subprocess, "run", git_ls_tree)
+        assert utils.get_tracked_paths("abc123").files == frozenset({"a.txt"})
+        assert utils.get_tracked_paths("abc123").files == frozenset({"a.txt"})
+        assert calls == [["git", "ls-tree", "-r", "-z", "--name-only", "abc123"]]
+        utils._get_tracked_paths_at_commit.cache_clear()
+
+class TestNormalizePath:
+    def test_normalize_path(self):
+        assert utils.normalize_path("data/../a.txt", "/repo") == "a.txt"
+        assert utils.normalize_path("/repo/out/b.png", "/repo") == "out/b.png"
+        assert utils.normalize_path("/repo", "/repo") == "."
+        assert utils.normalize_path("/usr/lib/os.py", "/repo") is None
+        assert utils.normalize_path("/repository/a.txt", "/repo") is None
+
 class TestIsGitHashOnFile:
     def test_is_git_hash_on_file_empty_hash(monkeypatch):
         assert utils.is_git_hash_on_file("foo.txt", "") is True
@@ -108,6 +142,7 @@ class TestGetClosestAncestor:
             return subprocess.CompletedProcess(cmd, 0, stdout=mock_ancestor_hashes)
         
         monkeypatch.setattr(utils.subprocess, "run", git_log)
+        monkeypatch.setattr(utils, "get_commit_graph", CommitGraph)
         monkeypatch.setattr(utils, "is_ancestor", lambda c1, c2: c1 == "def")
         
         assert utils.get_closest_ancestor_hash("foo.txt", "xyz") == "def"
@@ -119,6 +154,7 @@ class TestGetClosestAncestor:
             return subprocess.CompletedProcess(cmd, 0, stdout=mock_ancestor_hashes)
         
         monkeypatch.setattr(utils.subprocess, "run", git_log)
+        monkeypatch.setattr(utils, "get_commit_graph", CommitGraph)
         monkeypatch.setattr(utils, "is_ancestor", lambda c1, c2: False)
         
         with pytest.raises(ValueError) as ei:
@@ -126,6 +162,24 @@ class TestGetClosestAncestor:
         
         assert "Provided git_hash is invalid" in str(ei.value)
 
+    def test_get_closest_ancestor_hash_uses_commit_graph(self, monkeypatch):
+        def git_log(cmd, capture_output, text, check):
+            return subprocess.CompletedProcess(cmd, 0, stdout="c3\nc1\n")
+
+        commit_graph = CommitGraph()
+        for commit, parents in [("c1", ()), ("c2", ("c1",)), ("c3", ("c1",)), ("c4", ("c2",))]:
+            commit_graph.add(commit, parents)
+
+        def is_ancestor(c1, c2):
+            raise AssertionError("git merge-base should not be called")
+
+        monkeypatch.setattr(utils.subprocess, "run", git_log)
+        monkeypatch.setattr(utils, "get_commit_graph", lambda: commit_graph)
+        monkeypatch.setattr(utils, "is_ancestor", is_ancestor)
+
+        assert utils.get_closest_ancestor_hash("foo.txt", "c4") == "c1"
+        assert utils.get_closest_ancestor_hash("foo.txt", "c3") == "c3"
+
 
 if __name__ == "__main__":
     pytest.main()
\ No newline at end of file